@@ -0,0 +1,99 @@
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+
+from .metrics import REGISTRY
+
+
+logger = logging.getLogger(__name__)
+
+
+# Opt-in: 0 disables the cache
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 0))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 60 * 60))
+# Short utterances ("yes", "that one") only make sense in their context, they are never cached
+ANSWER_CACHE_MIN_WORDS = int(os.environ.get("ANSWER_CACHE_MIN_WORDS", 4))
+
+ANSWER_CACHE_HITS = REGISTRY.counter("answer_cache_hits_total", "Responses served from the answer cache.")
+ANSWER_CACHE_MISSES = REGISTRY.counter("answer_cache_misses_total", "Cacheable responses not found in the answer cache.")
+
+FILLER_WORDS = frozenset(["um", "uh", "uhm", "er", "ah", "hmm", "so", "well", "like", "please", "hi", "hello", "hey", "okay", "ok"])
+
+_non_word_re = re.compile(r"[^\w]+", re.UNICODE)
+# Phone numbers, dates, times, emails and introductions: the answer would repeat them to other callers
+_personal_details_re = re.compile(r"\d|@|\b(my name|this is|i am|i'm|im|call me|speaking)\b", re.IGNORECASE)
+
+
+def has_personal_details(content):
+    return _personal_details_re.search(content) is not None
+
+
+def normalize_question(content):
+    words = _non_word_re.sub(" ", content.lower()).split()
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+class AnswerCache:
+    """
+    Process-wide LRU cache of complete answers, keyed on the normalized user utterance and the
+    conversation state, with a TTL.
+
+    The answers are replayed to other callers: only context-free questions should be cached, the caller
+    decides which turns are (e.g. the first question of a call). Utterances with personal details are never
+    cacheable.
+
+    config_version identifies the prompt and tools the answers were generated with, it's part of every key.
+    The prompt only changes with a deployment, which starts with an empty cache.
+
+    Parameters:
+    - config_version (str): Version of the prompt/configuration, e.g. PROMPT_PREFIX_FINGERPRINT.
+    - max_size (int): Maximum number of answers, the least recently used one is evicted.
+    - ttl (float): Seconds an answer is served from the cache.
+    - min_words (int): Utterances with fewer words (after normalization) are not cacheable.
+    """
+
+    def __init__(self, config_version, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, min_words=ANSWER_CACHE_MIN_WORDS):
+        self.config_version = config_version
+        self.max_size = max_size
+        self.ttl = ttl
+        self.min_words = min_words
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def make_key(self, utterance, state="default"):
+        """Returns the cache key of the utterance, or None if it's not cacheable."""
+        if has_personal_details(utterance):
+            return None
+        normalized_utterance = normalize_question(utterance)
+        if normalized_utterance.count(" ") + 1 < self.min_words:
+            return None
+        return (self.config_version, state, normalized_utterance)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            ANSWER_CACHE_MISSES.inc()
+            return None
+
+        answer, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            ANSWER_CACHE_MISSES.inc()
+            return None
+
+        self._entries.move_to_end(key)
+        ANSWER_CACHE_HITS.inc()
+        return answer
+
+    def put(self, key, answer):
+        self._entries[key] = (answer, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
@@ -3,7 +3,12 @@ import datetime
 import asyncio
 
 
-from llm_fsm import ConversationalLLMStateMachine, FSMError
+# Run from the root of the repository: python -m backend.appointment_chatbot
+from .llm_fsm import ConversationalLLMStateMachine, FSMError
+from .usage import CallUsage
+from .availability import AvailabilityIndex
+from .appointments import AppointmentBook, AppointmentRepository
+from .scheduler import SalonScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -14,8 +19,9 @@ APPOINTMENT_CONFIRM_STATE = "appointment_confirm"
 
 
 BEGIN_SENTENCE = "Hey there, I'm your personal hair salon assistant, how can I help you?"
-def get_generic_system_message(data):
-    system_message = """Goal: You are assisting customers with inquiries about our hair salon "Filpino haircuts". Answer their questions about services and pricing, and schedule appointments. Information about the hair salon:
+# The system message is the prefix of every prompt: the date is at its end so everything before it stays
+# byte-identical and is served from the provider-side prompt cache.
+GENERIC_SYSTEM_MESSAGE = """Goal: You are assisting customers with inquiries about our hair salon "Filpino haircuts". Answer their questions about services and pricing, and schedule appointments. Information about the hair salon:
      * List of all hair services offered: 
         - haircut
         - coloring
@@ -56,12 +62,14 @@ Communication style:
     - This is a real-time transcript, expect there to be errors. If you can guess what the user is trying to say, then guess and respond. When you must ask for clarification, pretend that you heard the voice and be colloquial (use phrases like "didn't catch that", "some noise", "pardon", "you're coming through choppy", "static in your speech", "voice is cutting in and out"). Do not ever mention "transcription error"
 
 If the user wants to schedule an appointment, gather the following information: the date for the appointment that best suits the customer, the customer name, the contact phone number and optionally the email.
+It's not possible to schedule an appointment for more than 2 months in advance.
+Today is {today}
 """
 
+
+def get_generic_system_message(data):
     today = datetime.datetime.now().date()
-    system_message +="Today is {today}\n".format(today=today)
-    system_message += "It's not possible to schedule an appointment for more than 2 months in advance."
-    return system_message
+    return GENERIC_SYSTEM_MESSAGE.format(today=today)
 
 #Please provide the following information so the customer can accurately answer
 
@@ -268,35 +276,21 @@ extract_appointment_customer_phone_tool = {
     }
 }
 
-available_slots = {
-    "2024-12-23": ["10:00", "11:00", "14:00", "15:00"],
-    "2024-12-24": ["09:00", "10:00", "11:00", "14:00"],
-    "2024-12-25": ["11:00", "13:00", "14:00", "16:00"],
-    "2024-12-26": ["10:00", "12:00", "15:00", "16:00"],
-}
+# Fixed slots of the opening hours over the booking horizon
+availability = AvailabilityIndex.from_opening_hours()
 
-appointments = []
+# Fixed slots are booked with any free stylist
+appointment_book = AppointmentBook(availability, AppointmentRepository(), scheduler=SalonScheduler())
 
 
-def schedule_appointment(appointment_date, appointment_start_time, name, phone, email=None):
-    # Implement your appointment booking logic here
-    logger.info(f"Appointment booked for {name} on {appointment_date}. We will contact you at {phone} or {email}.")
+async def schedule_appointment(appointment_date, appointment_start_time, name, phone, email=None, call_id=None):
+    # The slot held by the call, if any, is converted into the appointment
+    appointment_id = await appointment_book.book(appointment_date, appointment_start_time, name, phone, email, owner=call_id)
+    return appointment_id is not None
 
-    if date in available_slots[doctor_name] and time in available_slots[doctor_name][date]:
-        available_slots[date].remove(time)
-        appointments.append({
-            "name": name,
-            "phone": phone,
-            "email": email,
-            "start_time": appointment_start_time,
-            "date": appointment_date
-        })
-        return True
-    return False
 
-
-def check_availability(date):
-    return available_slots.get(date, [])
+def check_availability(date, call_id=None):
+    return appointment_book.get_slots(date, owner=call_id)
 
 def generate_appointment_information_string(data):
     appointment_information = "Date:{appointment_date}\nTime: {appointment_start_time}\nContact name: {contact_name}\nContact email: {contact_email}".format(**data)
@@ -309,7 +303,7 @@ def generate_appointment_information_string(data):
 
 
 appointment_state_precomputed_values = {
-    "time_slots": lambda data: check_availability(data["appointment_date"]) if "appointment_date" in data else None,
+    "time_slots": lambda data: check_availability(data["appointment_date"], data.get("call_id")) if "appointment_date" in data else None,
     "is_all_information_available": lambda data: "appointment_start_time" in data and "appointment_date" in data and "customer_name" in data and "customer_phone" in data and data["appointment_start_time"] in data["precomputed_values"]["time_slots"]
 }
 
@@ -344,10 +338,10 @@ def appointment_confirm_state_system_message(data):
 
 
 def create_appointment_chatbot():
-    state_machine = ConversationalLLMStateMachine(initial_state=INFORMATION_INQUIRY_STATE, default_llm_model="gpt-4o-mini", common_tools=[end_call_tool, detect_user_intent_tool])
+    state_machine = ConversationalLLMStateMachine(initial_state=INFORMATION_INQUIRY_STATE, default_llm_model="gpt-4o-mini", common_tools=[end_call_tool, detect_user_intent_tool], max_chat_history_messages=20)
 
     @state_machine.define_state(state_key=INFORMATION_INQUIRY_STATE, system_message=get_generic_system_message, tools=[ask_schedule_appointment_tool])
-    def information_inquiry(data):
+    async def information_inquiry(data):
         data_tools = data["tools"]
 
         if "ask_schedule_appointment" in data_tools:
@@ -356,9 +350,14 @@ def create_appointment_chatbot():
             return INFORMATION_INQUIRY_STATE
 
     @state_machine.define_state(state_key=APPOINTMENT_STATE, system_message=appointment_state_system_message, tools=[extract_appointment_date_tool, extract_appointment_start_time_tool, extract_appointment_customer_name_tool, extract_appointment_customer_email_tool, extract_appointment_customer_phone_tool], precomputed_values=appointment_state_precomputed_values)
-    def appointment(data):
+    async def appointment(data):
         user_intent = data.get("user_intent")
 
+        # Hold the chosen slot so no other caller books it while the contact information is gathered
+        call_id = data.get("call_id")
+        if call_id and "appointment_date" in data and "appointment_start_time" in data:
+            await appointment_book.hold(data["appointment_date"], data["appointment_start_time"], call_id)
+
         if user_intent in ("appointment", "appointment_change_information"):
             return APPOINTMENT_STATE
         elif user_intent == "appointment_confirmation":
@@ -367,7 +366,7 @@ def create_appointment_chatbot():
             return INFORMATION_INQUIRY_STATE
 
     @state_machine.define_state(state_key=APPOINTMENT_CONFIRM_STATE, system_message=appointment_confirm_state_system_message, tools=[appointment_confirmation_tool])
-    def appointment_confirm(data):
+    async def appointment_confirm(data):
         user_intent = data.get("user_intent")
 
         data_tools = data["tools"]
@@ -379,7 +378,7 @@ def create_appointment_chatbot():
                 customer_phone = data["customer_phone"]
                 customer_email = data["customer_email"]
 
-                schedule_appointment(date=appointment_date, start_time=appointment_start_time, name=customer_name, phone=customer_phone, email=customer_email)
+                await schedule_appointment(appointment_date=appointment_date, appointment_start_time=appointment_start_time, name=customer_name, phone=customer_phone, email=customer_email, call_id=data.get("call_id"))
 
                 return INFORMATION_INQUIRY_STATE
             elif user_intent == "appointment_change_information":
@@ -394,6 +393,12 @@ def create_appointment_chatbot():
 
 async def main():
     appointment_chatbot = create_appointment_chatbot()
+    await appointment_book.load()
+    appointment_book.start()
+    # The usage of every step is recorded per state
+    call_usage = CallUsage(call_id="cli", report=None)
+    appointment_chatbot.set_context_data("call_usage", call_usage)
+    appointment_chatbot.set_context_data("call_id", "cli")
 
     print("Appointment chatbot\n\n")
     while True:
@@ -408,6 +413,12 @@ async def main():
             print(e)
             break
 
+    for state, usage in call_usage.by_state.items():
+        print(f"{state}: {usage.total_tokens} tokens ({usage.cached_tokens} cached prompt tokens) in {usage.requests} requests, {usage.seconds:.1f}s")
+
+    await appointment_book.release_holds("cli")
+    await appointment_book.close()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
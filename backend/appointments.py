@@ -0,0 +1,580 @@
+import os
+import time
+import heapq
+import datetime
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from .availability import FIXED_SLOT_MINUTES, parse_time
+from .scheduler import SalonScheduler
+
+
+logger = logging.getLogger(__name__)
+
+
+APPOINTMENTS_DB = os.environ.get("APPOINTMENTS_DB", "appointments.db")
+# Seconds a slot chosen by a caller is held for them while the booking is confirmed
+SLOT_HOLD_TTL = float(os.environ.get("SLOT_HOLD_TTL", 300))
+
+BOOKED = "booked"
+CANCELLED = "cancelled"
+
+# The statements are constants so the sqlite3 statement cache of the connection prepares each of them once
+# The window of a stylist overlaps a booked appointment or an active hold of another caller
+OVERLAP_SQL = (
+    "EXISTS (SELECT 1 FROM appointments WHERE date = :date AND stylist = :stylist AND status = '" + BOOKED + "' "
+    "AND start_minute < :end_minute AND start_minute + duration > :start_minute) "
+    "OR EXISTS (SELECT 1 FROM slot_holds WHERE date = :date AND stylist = :stylist AND owner != :owner AND expires_at >= :now "
+    "AND start_minute < :end_minute AND start_minute + duration > :start_minute)"
+)
+# Every appointment is booked with a stylist: a single conditional write, so two workers can't book overlapping windows
+RESERVE_SERVICE_SQL = (
+    "INSERT OR IGNORE INTO appointments (date, start_time, start_minute, stylist, service, duration, name, phone, email, status, created_at) "
+    "SELECT :date, :start_time, :start_minute, :stylist, :service, :duration, :name, :phone, :email, '" + BOOKED + "', :now "
+    "WHERE NOT (" + OVERLAP_SQL + ")"
+)
+# A hold is taken if the window isn't booked and isn't held by another caller, or only by an expired hold
+HOLD_SERVICE_SQL = (
+    "INSERT INTO slot_holds (date, start_time, stylist, start_minute, duration, owner, expires_at) "
+    "SELECT :date, :start_time, :stylist, :start_minute, :duration, :owner, :expires_at "
+    "WHERE NOT (" + OVERLAP_SQL + ") "
+    "ON CONFLICT (date, start_time, stylist) DO UPDATE SET "
+    "owner = excluded.owner, expires_at = excluded.expires_at, start_minute = excluded.start_minute, duration = excluded.duration "
+    "WHERE slot_holds.owner = excluded.owner OR slot_holds.expires_at < :now"
+)
+# Appointments of the fixed slots booked before the stylists get one, if they have a free window
+ASSIGN_STYLIST_SQL = (
+    "UPDATE appointments SET stylist = :stylist, start_minute = :start_minute, duration = :duration "
+    "WHERE id = :id AND stylist = '' AND status = '" + BOOKED + "' AND NOT (" + OVERLAP_SQL + ")"
+)
+RELEASE_HOLD_SQL = "DELETE FROM slot_holds WHERE date = ? AND start_time = ? AND stylist = ? AND owner = ?"
+RELEASE_OWNER_HOLDS_SQL = "DELETE FROM slot_holds WHERE owner = ?"
+EXPIRE_HOLD_SQL = "DELETE FROM slot_holds WHERE date = ? AND start_time = ? AND stylist = ? AND owner = ? AND expires_at <= ?"
+ACTIVE_HOLDS_SQL = "SELECT start_time, owner FROM slot_holds WHERE date = ? AND stylist = ? AND expires_at >= ?"
+CANCEL_SQL = "UPDATE appointments SET status = '" + CANCELLED + "' WHERE id = ? AND status = '" + BOOKED + "'"
+GET_SQL = "SELECT id, date, start_time, name, phone, email, status, created_at, stylist, service, duration FROM appointments WHERE id = ?"
+UNASSIGNED_SQL = "SELECT id, date, start_time FROM appointments WHERE status = '" + BOOKED + "' AND stylist = '' AND date BETWEEN ? AND ?"
+BOOKED_SERVICES_SQL = (
+    "SELECT date, start_time, stylist, duration FROM appointments "
+    "WHERE status = '" + BOOKED + "' AND stylist != '' AND date BETWEEN ? AND ?"
+)
+
+
+@dataclass
+class Appointment:
+    id: int
+    date: str
+    start_time: str
+    name: str
+    phone: str
+    email: str | None
+    status: str
+    created_at: float
+    # Empty for the appointments of the fixed slots booked before the stylists
+    stylist: str = ""
+    # None for the appointments of the fixed slots
+    service: str | None = None
+    duration: int | None = None
+
+
+class AppointmentRepository:
+    """
+    Appointments stored in SQLite (WAL mode), shared by all the workers of the host.
+
+    Every appointment is booked with a stylist for its duration, the fixed slots included. Reserving it is a
+    conditional INSERT on the overlap of its minutes with the other appointments and holds of the stylist: two
+    workers booking overlapping windows at the same time can't both succeed. Holds are conditional upserts of
+    slot_holds, an expired hold is ignored until it's deleted.
+    Queries run in a single thread executor so the event loop never blocks on disk I/O.
+
+    Parameters:
+    - path (str): Path of the SQLite database.
+    """
+
+    def __init__(self, path=APPOINTMENTS_DB):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="appointments")
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5.0, cached_statements=32)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS appointments ("
+                "id INTEGER PRIMARY KEY, "
+                "date TEXT NOT NULL, "
+                "start_time TEXT NOT NULL, "
+                "name TEXT NOT NULL, "
+                "phone TEXT NOT NULL, "
+                "email TEXT, "
+                "status TEXT NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "stylist TEXT NOT NULL DEFAULT '', "
+                "service TEXT, "
+                "duration INTEGER, "
+                "start_minute INTEGER)"
+            )
+            # Databases created before the stylists
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(appointments)")]
+            if "stylist" not in columns:
+                connection.execute("ALTER TABLE appointments ADD COLUMN stylist TEXT NOT NULL DEFAULT ''")
+                connection.execute("ALTER TABLE appointments ADD COLUMN service TEXT")
+                connection.execute("ALTER TABLE appointments ADD COLUMN duration INTEGER")
+            if "start_minute" not in columns:
+                connection.execute("ALTER TABLE appointments ADD COLUMN start_minute INTEGER")
+                connection.execute(
+                    "UPDATE appointments SET start_minute = "
+                    "CAST(substr(start_time, 1, 2) AS INTEGER) * 60 + CAST(substr(start_time, 4, 2) AS INTEGER)"
+                )
+            connection.execute("DROP INDEX IF EXISTS appointments_booked_slot")
+            connection.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS appointments_booked_stylist_slot "
+                "ON appointments (date, start_time, stylist) WHERE status = '" + BOOKED + "'"
+            )
+            # Holds only last a few minutes: the ones of a database created before the stylists are dropped
+            hold_columns = [row[1] for row in connection.execute("PRAGMA table_info(slot_holds)")]
+            if hold_columns and "stylist" not in hold_columns:
+                connection.execute("DROP TABLE slot_holds")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS slot_holds ("
+                "date TEXT NOT NULL, "
+                "start_time TEXT NOT NULL, "
+                "stylist TEXT NOT NULL DEFAULT '', "
+                "start_minute INTEGER, "
+                "duration INTEGER, "
+                "owner TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, "
+                "PRIMARY KEY (date, start_time, stylist))"
+            )
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _get_window_parameters(self, date, start_time, stylist, duration, owner):
+        start_minute = parse_time(start_time)
+        return {
+            "date": date,
+            "start_time": start_time,
+            "stylist": stylist,
+            "start_minute": start_minute,
+            "end_minute": start_minute + duration,
+            "duration": duration,
+            "owner": owner or "",
+            "now": time.time(),
+        }
+
+    def _reserve_service(self, date, start_time, stylist, service, duration, name, phone, email, owner):
+        connection = self._connect()
+        parameters = self._get_window_parameters(date, start_time, stylist, duration, owner)
+        parameters.update(service=service, name=name, phone=phone, email=email)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = connection.execute(RESERVE_SERVICE_SQL, parameters)
+            if cursor.rowcount == 0:
+                appointment_id = None
+            else:
+                appointment_id = cursor.lastrowid
+                # The hold of the owner is converted into the appointment
+                connection.execute(RELEASE_HOLD_SQL, (date, start_time, stylist, owner or ""))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return appointment_id
+
+    def _hold_service(self, date, start_time, stylist, duration, owner, expires_at):
+        parameters = self._get_window_parameters(date, start_time, stylist, duration, owner)
+        parameters["expires_at"] = expires_at
+        return self._connect().execute(HOLD_SERVICE_SQL, parameters).rowcount > 0
+
+    def _assign_stylist(self, appointment_id, date, start_time, stylist, duration):
+        parameters = self._get_window_parameters(date, start_time, stylist, duration, None)
+        parameters["id"] = appointment_id
+        return self._connect().execute(ASSIGN_STYLIST_SQL, parameters).rowcount > 0
+
+    def _release_hold(self, date, start_time, owner, stylist):
+        self._connect().execute(RELEASE_HOLD_SQL, (date, start_time, stylist, owner))
+
+    def _release_owner_holds(self, owner):
+        self._connect().execute(RELEASE_OWNER_HOLDS_SQL, (owner,))
+
+    def _expire_hold(self, date, start_time, owner, expires_at, stylist):
+        self._connect().execute(EXPIRE_HOLD_SQL, (date, start_time, stylist, owner, expires_at))
+
+    def _get_holds(self, date, stylist):
+        return set(self._connect().execute(ACTIVE_HOLDS_SQL, (date, stylist, time.time())).fetchall())
+
+    def _cancel(self, appointment_id):
+        return self._connect().execute(CANCEL_SQL, (appointment_id,)).rowcount > 0
+
+    def _get(self, appointment_id):
+        return self._connect().execute(GET_SQL, (appointment_id,)).fetchone()
+
+    def _get_unassigned_slots(self, start_date, end_date):
+        return self._connect().execute(UNASSIGNED_SQL, (start_date, end_date)).fetchall()
+
+    def _get_booked_services(self, start_date, end_date):
+        return self._connect().execute(BOOKED_SERVICES_SQL, (start_date, end_date)).fetchall()
+
+    async def reserve_service(self, date, start_time, stylist, service, duration, name, phone, email=None, owner=None):
+        """
+        Books the service (None for a fixed slot) with the stylist, returns the id of the appointment or None if the
+        window overlaps an appointment of the stylist or a hold of another owner. A hold of owner is converted.
+        """
+        return await self._run(self._reserve_service, date, start_time, stylist, service, duration, name, phone, email, owner)
+
+    async def hold_service(self, date, start_time, stylist, duration, owner, expires_at):
+        """Holds the window of the stylist for owner until expires_at, returns False if it overlaps an appointment or a hold of another owner."""
+        return await self._run(self._hold_service, date, start_time, stylist, duration, owner, expires_at)
+
+    async def assign_stylist(self, appointment_id, date, start_time, stylist, duration):
+        """Books an appointment without a stylist with the stylist, returns False if the window isn't free."""
+        return await self._run(self._assign_stylist, appointment_id, date, start_time, stylist, duration)
+
+    async def release_hold(self, date, start_time, owner, stylist):
+        await self._run(self._release_hold, date, start_time, owner, stylist)
+
+    async def release_owner_holds(self, owner):
+        await self._run(self._release_owner_holds, owner)
+
+    async def expire_hold(self, date, start_time, owner, expires_at, stylist):
+        """Deletes the hold if it wasn't renewed after expires_at."""
+        await self._run(self._expire_hold, date, start_time, owner, expires_at, stylist)
+
+    async def get_holds(self, date, stylist):
+        """Returns the (start_time, owner) of the active holds of the stylist on date."""
+        return await self._run(self._get_holds, date, stylist)
+
+    async def cancel(self, appointment_id):
+        """Returns False if there's no booked appointment with this id."""
+        return await self._run(self._cancel, appointment_id)
+
+    async def get(self, appointment_id) -> Appointment | None:
+        row = await self._run(self._get, appointment_id)
+        if row is None:
+            return None
+        return Appointment(*row)
+
+    async def get_unassigned_slots(self, start_date="0000-00-00", end_date="9999-99-99"):
+        """Returns the (id, date, start_time) of the booked appointments without a stylist between start_date and end_date."""
+        return await self._run(self._get_unassigned_slots, start_date, end_date)
+
+    async def get_booked_services(self, start_date="0000-00-00", end_date="9999-99-99"):
+        """Returns the (date, start_time, stylist, duration) of the booked appointments with a stylist between start_date and end_date."""
+        return await self._run(self._get_booked_services, start_date, end_date)
+
+    async def close(self):
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+
+
+class AppointmentBook:
+    """
+    Books appointments in the repository and keeps the calendars of the worker up to date.
+
+    Every appointment is booked with a stylist for its duration: a service with a stylist offering it, or a
+    fixed slot (fixed_slot_minutes from a time of check_availability) with any stylist. The free fixed slots of
+    the availability index are derived from the calendars of the stylists, so a fixed slot and a service can't
+    both take the same stylist.
+
+    The repository decides: the calendars of a worker don't know about the windows booked or held by the
+    other workers until a reservation fails or the booked appointments are loaded again.
+
+    A window chosen by a caller can be held for them (owner is usually the call_id) while the booking is
+    confirmed: it's not offered to the other callers and the hold is converted by book_service(). The holds of
+    this worker expire in a background reaper that sleeps until the earliest expiration of a heap. Holds
+    released by another worker (e.g. the call_ended webhook of the call reached it) are only deleted from the
+    repository: this worker frees them when a hold or a booking finds the window taken, until then they aren't
+    offered by get_slots() for at most hold_ttl.
+
+    Parameters:
+    - availability (AvailabilityIndex): Free fixed slots of the worker.
+    - repository (AppointmentRepository): Persistent appointments.
+    - hold_ttl (float): Seconds a slot is held.
+    - scheduler (SalonScheduler): Calendars of the stylists.
+    - snapshot (AvailabilitySnapshot): Precomputed availability, updated on every change and read by get_slots().
+    - fixed_slot_minutes (int): Duration of the appointments of the fixed slots.
+    """
+
+    def __init__(self, availability, repository, hold_ttl=SLOT_HOLD_TTL, scheduler=None, snapshot=None, fixed_slot_minutes=FIXED_SLOT_MINUTES):
+        self.availability = availability
+        self.repository = repository
+        self.hold_ttl = hold_ttl
+        self.scheduler = scheduler or SalonScheduler()
+        self.snapshot = snapshot
+        self.fixed_slot_minutes = fixed_slot_minutes
+        # (date, start_time, stylist) -> (owner, expires_at, duration) of the holds taken by this worker
+        self._holds = {}
+        self._owner_holds = {}
+        # (expires_at, date, start_time, stylist, owner), entries of renewed or released holds are skipped when popped
+        self._expirations = []
+        self._expirations_changed = asyncio.Event()
+        self._reaper_task = None
+
+    def start(self):
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_holds())
+
+    async def load(self):
+        """Books the appointments already booked (by a previous process or another worker) in the calendars."""
+        scheduler = self.scheduler
+        scheduler.advance_to(datetime.date.today())
+        start_date = scheduler.start_date.isoformat()
+        booked_services = await self.repository.get_booked_services(start_date)
+        for date, start_time, stylist, duration in booked_services:
+            if stylist in scheduler.stylists and scheduler.get_day(date) is not None:
+                scheduler.book(stylist, date, start_time, duration)
+        logger.info(f"{len(booked_services)} booked appointments loaded")
+
+        for appointment_id, date, start_time in await self.repository.get_unassigned_slots(start_date):
+            await self._assign_stylist(appointment_id, date, start_time)
+
+        if self.snapshot is not None:
+            self.snapshot.rebuild()
+        else:
+            for day in range(scheduler.horizon_days):
+                self._update_fixed_slots(scheduler.get_date(day))
+
+    async def _assign_stylist(self, appointment_id, date, start_time):
+        for stylist in self.scheduler.stylists:
+            if not self.scheduler.book(stylist, date, start_time, self.fixed_slot_minutes):
+                continue
+            if await self.repository.assign_stylist(appointment_id, date, start_time, stylist, self.fixed_slot_minutes):
+                logger.info(f"Appointment {appointment_id} of {date} {start_time} assigned to {stylist}")
+                return
+            self.scheduler.release(stylist, date, start_time, self.fixed_slot_minutes)
+        logger.warning(f"No stylist is free for the appointment {appointment_id} of {date} {start_time}")
+
+    def _update_fixed_slots(self, date):
+        if self.scheduler.get_day(date) is not None:
+            self.availability.set_slots(date, self.scheduler.get_fixed_slots(date, self.fixed_slot_minutes))
+
+    def _availability_changed(self, date):
+        # The snapshot sets the fixed slots of the date itself
+        if self.snapshot is not None:
+            self.snapshot.update(date)
+        else:
+            self._update_fixed_slots(date)
+
+    def get_hold_owner(self, date, start_time, stylist):
+        hold = self._holds.get((date, start_time, stylist))
+        return hold[0] if hold is not None else None
+
+    def get_slots(self, date, owner=None):
+        """Free fixed slots of the date, including the times held by owner."""
+        slots = self.snapshot.get_slots(date) if self.snapshot is not None else self.availability.get_slots(date)
+        if owner is not None:
+            held_times = [key[1] for key in self._owner_holds.get(owner, ()) if key[0] == date]
+            if held_times:
+                slots = sorted(set(slots).union(held_times))
+        return slots
+
+    def _get_duration(self, service):
+        return self.fixed_slot_minutes if service is None else self.scheduler.services[service]
+
+    def _get_candidates(self, service, stylist=None):
+        candidates = list(self.scheduler.stylists) if service is None else self.scheduler.get_stylists(service)
+        if stylist is not None:
+            candidates = [stylist] if stylist in candidates else []
+        return candidates
+
+    def _add_hold(self, date, start_time, stylist, owner, duration):
+        key = (date, start_time, stylist)
+        expires_at = time.time() + self.hold_ttl
+        self._holds[key] = (owner, expires_at, duration)
+        self._owner_holds.setdefault(owner, set()).add(key)
+        heapq.heappush(self._expirations, (expires_at, date, start_time, stylist, owner))
+        if self._expirations[0][0] == expires_at:
+            self._expirations_changed.set()
+
+    def _remove_hold(self, date, start_time, stylist, owner):
+        """Forgets the hold, returns its duration."""
+        key = (date, start_time, stylist)
+        duration = self._holds.pop(key)[2]
+        owner_holds = self._owner_holds.get(owner)
+        if owner_holds is not None:
+            owner_holds.discard(key)
+            if not owner_holds:
+                del self._owner_holds[owner]
+        return duration
+
+    def _free_hold(self, date, start_time, stylist, owner):
+        """Forgets the hold and frees its window."""
+        duration = self._remove_hold(date, start_time, stylist, owner)
+        self.scheduler.release(stylist, date, start_time, duration)
+
+    async def _sync_holds(self, date, stylist):
+        """Frees the holds of the stylist on date released by another worker, returns True if any was freed."""
+        holds = [(key, hold) for key, hold in self._holds.items() if key[0] == date and key[2] == stylist]
+        if not holds:
+            return False
+
+        active_holds = await self.repository.get_holds(date, stylist)
+        freed = False
+        for key, hold in holds:
+            # Not renewed or freed while the holds were read
+            if (key[1], hold[0]) not in active_holds and self._holds.get(key) is hold:
+                self._free_hold(date, key[1], stylist, hold[0])
+                logger.info(f"Hold of {date} {key[1]} {stylist} for {hold[0]} released by another worker")
+                freed = True
+        if freed:
+            self._availability_changed(date)
+        return freed
+
+    async def _book_window(self, stylist, date, start_time, duration):
+        """Books the window in the calendar of the stylist, after freeing the holds released by another worker if it's taken."""
+        if self.scheduler.book(stylist, date, start_time, duration):
+            return True
+        return await self._sync_holds(date, stylist) and self.scheduler.book(stylist, date, start_time, duration)
+
+    async def hold(self, date, start_time, owner, stylist=None):
+        """Holds the fixed slot for owner, or renews the hold. Returns False if no stylist is free."""
+        return await self.hold_service(None, date, start_time, owner, stylist) is not None
+
+    async def hold_service(self, service, date, start_time, owner, stylist=None):
+        """
+        Holds the window of the service (None for a fixed slot) for owner with the stylist, or with the first
+        stylist offering it who is free, or renews the hold. Returns the stylist, or None if nobody is available.
+        """
+        self.scheduler.advance_to(datetime.date.today())
+        duration = self._get_duration(service)
+        candidates = self._get_candidates(service, stylist)
+        # The stylist held by owner first, the hold is renewed
+        candidates.sort(key=lambda candidate: self.get_hold_owner(date, start_time, candidate) != owner)
+        for candidate in candidates:
+            held = self._holds.get((date, start_time, candidate))
+            held_by_owner = held is not None and held[0] == owner and held[2] == duration
+            if not held_by_owner:
+                if held is not None and held[0] == owner:
+                    # Held by owner for another service
+                    self._free_hold(date, start_time, candidate, owner)
+                if not await self._book_window(candidate, date, start_time, duration):
+                    continue
+
+            if not await self.repository.hold_service(date, start_time, candidate, duration, owner, time.time() + self.hold_ttl):
+                if not held_by_owner:
+                    self.scheduler.release(candidate, date, start_time, duration)
+                else:
+                    self._free_hold(date, start_time, candidate, owner)
+                self._availability_changed(date)
+                continue
+
+            self._add_hold(date, start_time, candidate, owner, duration)
+            self._availability_changed(date)
+            return candidate
+        return None
+
+    async def release_hold(self, date, start_time, owner, stylist):
+        if self.get_hold_owner(date, start_time, stylist) == owner:
+            self._free_hold(date, start_time, stylist, owner)
+            self._availability_changed(date)
+        await self.repository.release_hold(date, start_time, owner, stylist)
+
+    async def release_holds(self, owner):
+        """Releases all the holds of owner, e.g. when the call ends."""
+        dates = set()
+        for date, start_time, stylist in list(self._owner_holds.get(owner, ())):
+            self._free_hold(date, start_time, stylist, owner)
+            dates.add(date)
+        for date in dates:
+            self._availability_changed(date)
+        await self.repository.release_owner_holds(owner)
+
+    async def _reap_holds(self):
+        while True:
+            if not self._expirations:
+                await self._expirations_changed.wait()
+                self._expirations_changed.clear()
+                continue
+
+            expires_at, date, start_time, stylist, owner = self._expirations[0]
+            delay = expires_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._expirations_changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._expirations_changed.clear()
+                continue
+
+            heapq.heappop(self._expirations)
+            hold = self._holds.get((date, start_time, stylist))
+            if hold is None or hold[:2] != (owner, expires_at):
+                # Renewed, released or converted since
+                continue
+
+            self._free_hold(date, start_time, stylist, owner)
+            self._availability_changed(date)
+            try:
+                await self.repository.expire_hold(date, start_time, owner, expires_at, stylist)
+            except Exception:
+                logger.exception(f"Error expiring the hold of {date} {start_time}")
+            logger.info(f"Hold of {date} {start_time} {stylist} for {owner} expired")
+
+    async def book(self, date, start_time, name, phone, email=None, owner=None, stylist=None):
+        """Books the fixed slot, returns the id of the appointment or None if no stylist is free. A hold of owner is converted."""
+        booking = await self.book_service(None, date, start_time, name, phone, email, stylist, owner)
+        return booking[0] if booking is not None else None
+
+    async def book_service(self, service, date, start_time, name, phone, email=None, stylist=None, owner=None):
+        """
+        Books the service (None for a fixed slot) at date and start_time with the stylist, or with the first stylist
+        offering it who is free. A hold of owner is converted. Returns (appointment_id, stylist), or None if nobody
+        is available.
+        """
+        self.scheduler.advance_to(datetime.date.today())
+        duration = self._get_duration(service)
+        candidates = self._get_candidates(service, stylist)
+        # The stylist held by owner first
+        candidates.sort(key=lambda candidate: self.get_hold_owner(date, start_time, candidate) != owner)
+        for candidate in candidates:
+            held = owner is not None and self.get_hold_owner(date, start_time, candidate) == owner
+            if held:
+                # The window of the hold is taken again for the duration of this service
+                self._free_hold(date, start_time, candidate, owner)
+            if not await self._book_window(candidate, date, start_time, duration):
+                if held:
+                    self._availability_changed(date)
+                continue
+
+            appointment_id = await self.repository.reserve_service(date, start_time, candidate, service, duration, name, phone, email, owner)
+            if appointment_id is not None:
+                self._availability_changed(date)
+                logger.info(f"Appointment {appointment_id} booked for {name}: {service or 'appointment'} with {candidate} on {date} at {start_time}")
+                return appointment_id, candidate
+
+            # Overlaps an appointment or a hold of another worker: the repository decides, so the window isn't kept
+            self.scheduler.release(candidate, date, start_time, duration)
+            self._availability_changed(date)
+            logger.info(f"{candidate} already booked or held around {date} {start_time} by another worker")
+        return None
+
+    async def cancel(self, appointment_id):
+        appointment = await self.repository.get(appointment_id)
+        if appointment is None or not await self.repository.cancel(appointment_id):
+            return False
+
+        if appointment.stylist in self.scheduler.stylists:
+            self.scheduler.release(appointment.stylist, appointment.date, appointment.start_time, appointment.duration)
+        self._availability_changed(appointment.date)
+        return True
+
+    async def close(self):
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            try:
+                await self._reaper_task
+            except asyncio.CancelledError:
+                pass
+            self._reaper_task = None
+        await self.repository.close()
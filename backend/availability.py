@@ -0,0 +1,172 @@
+import os
+import bisect
+import logging
+import datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+# Granularity of the appointment slots
+SLOT_MINUTES = int(os.environ.get("SLOT_MINUTES", 15))
+# Interval between the fixed appointment slots generated from the opening hours
+FIXED_SLOT_MINUTES = int(os.environ.get("FIXED_SLOT_MINUTES", 60))
+# Bookings can't be made more than 2 months in advance
+SCHEDULE_HORIZON_DAYS = int(os.environ.get("SCHEDULE_HORIZON_DAYS", 62))
+
+# weekday (Monday is 0) -> opening and closing time, closed on the missing days
+OPENING_HOURS = {
+    0: ("09:00", "19:00"),
+    1: ("09:00", "19:00"),
+    2: ("09:00", "19:00"),
+    3: ("09:00", "19:00"),
+    4: ("09:00", "19:00"),
+    5: ("09:00", "17:00"),
+}
+
+
+def parse_time(time_string):
+    """Minutes since midnight of a "HH:MM" time."""
+    hours, minutes = time_string.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def format_time(minutes):
+    return "%02d:%02d" % divmod(minutes, 60)
+
+
+def get_opening_slots(date, opening_hours=OPENING_HOURS, every=FIXED_SLOT_MINUTES):
+    """Start times of the fixed slots of a datetime.date: every minutes from the opening, ending before the closing."""
+    hours = opening_hours.get(date.weekday())
+    if hours is None:
+        return []
+    return [format_time(minutes) for minutes in range(parse_time(hours[0]), parse_time(hours[1]) - every + 1, every)]
+
+
+class AvailabilityIndex:
+    """
+    Free appointment slots, indexed per day.
+
+    Each day is a bitmap (an int) with one bit per slot of slot_minutes since midnight, and the days with
+    at least one free slot are kept in a sorted list. Dates are "YYYY-MM-DD" strings, which sort like the
+    dates, and times "HH:MM" strings.
+
+    - Slots of a date, free check, reserve and release: constant time.
+    - Next free slot at or after a date and time: the lowest set bit of the day, then a bisect on the days.
+    - Free slots in a date range: a bisect on the days.
+
+    Parameters:
+    - slot_minutes (int): Granularity of the slots, the times are rounded down to it.
+    """
+
+    def __init__(self, slot_minutes=SLOT_MINUTES):
+        self.slot_minutes = slot_minutes
+        # date -> bitmap of the free slots
+        self._days = {}
+        # Sorted dates with at least one free slot
+        self._free_days = []
+        # Last date whose slots were generated from the opening hours
+        self._opened_until = None
+
+    @classmethod
+    def from_slots(cls, slots, slot_minutes=SLOT_MINUTES):
+        """Builds the index from a dict of date -> list of free times."""
+        index = cls(slot_minutes=slot_minutes)
+        for date, times in slots.items():
+            index.add_slots(date, times)
+        return index
+
+    @classmethod
+    def from_opening_hours(cls, start_date=None, days=SCHEDULE_HORIZON_DAYS, opening_hours=OPENING_HOURS, every=FIXED_SLOT_MINUTES, slot_minutes=SLOT_MINUTES):
+        """Builds the index with the fixed slots of the opening hours, from start_date (today by default) for days."""
+        index = cls(slot_minutes=slot_minutes)
+        index.open_days(start_date or datetime.date.today(), days, opening_hours, every)
+        return index
+
+    def open_days(self, start_date, days, opening_hours=OPENING_HOURS, every=FIXED_SLOT_MINUTES):
+        """Adds the fixed slots of the opening hours of the days from start_date that weren't opened yet."""
+        for i in range(days):
+            date = start_date + datetime.timedelta(days=i)
+            if self._opened_until is not None and date.isoformat() <= self._opened_until:
+                continue
+            self.add_slots(date.isoformat(), get_opening_slots(date, opening_hours, every))
+            self._opened_until = date.isoformat()
+
+    def _get_bit(self, time_string):
+        return parse_time(time_string) // self.slot_minutes
+
+    def _set_day(self, date, bitmap):
+        was_free = bool(self._days.get(date))
+        self._days[date] = bitmap
+
+        if bitmap and not was_free:
+            bisect.insort(self._free_days, date)
+        elif not bitmap and was_free:
+            del self._free_days[bisect.bisect_left(self._free_days, date)]
+
+    def _get_times(self, bitmap):
+        times = []
+        while bitmap:
+            lowest_bit = bitmap & -bitmap
+            times.append(format_time((lowest_bit.bit_length() - 1) * self.slot_minutes))
+            bitmap ^= lowest_bit
+        return times
+
+    def add_slot(self, date, time_string):
+        self._set_day(date, self._days.get(date, 0) | (1 << self._get_bit(time_string)))
+
+    def add_slots(self, date, times):
+        bitmap = self._days.get(date, 0)
+        for time_string in times:
+            bitmap |= 1 << self._get_bit(time_string)
+        self._set_day(date, bitmap)
+
+    def set_slots(self, date, times):
+        """Replaces the free times of the date."""
+        bitmap = 0
+        for time_string in times:
+            bitmap |= 1 << self._get_bit(time_string)
+        self._set_day(date, bitmap)
+
+    def is_free(self, date, time_string):
+        return bool(self._days.get(date, 0) >> self._get_bit(time_string) & 1)
+
+    def reserve(self, date, time_string):
+        """Removes the slot, returns False if it wasn't free."""
+        bit = 1 << self._get_bit(time_string)
+        bitmap = self._days.get(date, 0)
+        if not bitmap & bit:
+            return False
+        self._set_day(date, bitmap & ~bit)
+        return True
+
+    def release(self, date, time_string):
+        """Makes the slot free again, e.g. when an appointment is cancelled."""
+        self.add_slot(date, time_string)
+
+    def get_slots(self, date):
+        """Free times of the date, sorted."""
+        return self._get_times(self._days.get(date, 0))
+
+    def get_next_free_slot(self, date, time_string="00:00"):
+        """Returns the first free (date, time) at or after date and time, or None."""
+        bitmap = self._days.get(date, 0) >> self._get_bit(time_string) << self._get_bit(time_string)
+        if bitmap:
+            return date, format_time(((bitmap & -bitmap).bit_length() - 1) * self.slot_minutes)
+
+        i = bisect.bisect_right(self._free_days, date)
+        if i == len(self._free_days):
+            return None
+        next_date = self._free_days[i]
+        bitmap = self._days[next_date]
+        return next_date, format_time(((bitmap & -bitmap).bit_length() - 1) * self.slot_minutes)
+
+    def get_free_days(self, start_date, end_date):
+        """Dates with free slots between start_date and end_date, both included."""
+        start = bisect.bisect_left(self._free_days, start_date)
+        end = bisect.bisect_right(self._free_days, end_date)
+        return self._free_days[start:end]
+
+    def get_free_slots(self, start_date, end_date):
+        """Free times of the dates between start_date and end_date, both included, as a dict of date -> times."""
+        return {date: self.get_slots(date) for date in self.get_free_days(start_date, end_date)}
@@ -0,0 +1,238 @@
+import os
+import bisect
+import logging
+import datetime
+
+import numpy as np
+
+from .availability import FIXED_SLOT_MINUTES, parse_time, format_time
+from .scheduler import MINUTES_PER_DAY, find_earliest_window, list_windows
+
+
+logger = logging.getLogger(__name__)
+
+
+# Days from today in the availability summary of the prompts
+SNAPSHOT_SUMMARY_DAYS = int(os.environ.get("SNAPSHOT_SUMMARY_DAYS", 7))
+
+# Periods of the day in the summaries: name and first minute
+PERIODS = [
+    ("morning", 0),
+    ("afternoon", 12 * 60),
+    ("evening", 17 * 60),
+]
+
+
+class AvailabilitySnapshot:
+    """
+    Precomputed availability of the whole booking horizon, read by the prompts and the tool answers.
+
+    It holds the free times of the fixed slots, the free windows of every service with every stylist, and a
+    summary line per day: the number of free fixed appointment slots per period ("3 in the morning"), and the
+    services with no time left. A fixed slot is free when a stylist is free for its duration: the fixed slots
+    of the availability index are set from the calendars of the stylists, so the summary never lists a slot
+    no stylist can take. Bookings, cancellations and holds update the snapshot of their date only (update()),
+    and the horizon is rebuilt when the day changes.
+
+    Parameters:
+    - availability (AvailabilityIndex): Free fixed slots, derived from the scheduler.
+    - scheduler (SalonScheduler): Calendars of the stylists, defines the horizon.
+    - summary_days (int): Days from today in get_summary().
+    - fixed_slot_minutes (int): Duration of the appointments of the fixed slots.
+    """
+
+    def __init__(self, availability, scheduler, summary_days=SNAPSHOT_SUMMARY_DAYS, fixed_slot_minutes=FIXED_SLOT_MINUTES):
+        self.availability = availability
+        self.scheduler = scheduler
+        self.summary_days = summary_days
+        self.fixed_slot_minutes = fixed_slot_minutes
+        # Start times in the summaries: every slot of the day
+        self._starts = np.arange(0, MINUTES_PER_DAY, scheduler.slot_minutes)
+        self._period_masks = np.array([
+            (self._starts >= start) & (self._starts < end)
+            for (_, start), end in zip(PERIODS, [start for _, start in PERIODS[1:]] + [MINUTES_PER_DAY])
+        ], dtype=np.int32)
+
+        self.start_date = None
+        # Incremented on every change, e.g. to know if a prompt built from the summary is outdated
+        self.version = 0
+        # date -> free times of the fixed slots, and the sorted dates with free fixed slots
+        self._slots = {}
+        self._free_dates = []
+        # service -> (stylists, days, start times) free windows and their start minutes
+        self._windows = {}
+        self._window_starts = {}
+        # (days, start times) free fixed slots
+        self._free_starts = None
+        # date -> summary line, and the joined lines of the days after today
+        self._day_summaries = {}
+        self._summary = None
+        # Line of today, for a version and a slot of the day
+        self._today_summary = None
+        self._today_summary_key = None
+
+    def rebuild(self):
+        scheduler = self.scheduler
+        scheduler.advance_to(datetime.date.today())
+        self.start_date = scheduler.start_date
+
+        for day in range(scheduler.horizon_days):
+            self._set_fixed_slots(scheduler.get_date(day))
+        self._free_dates = self.availability.get_free_days(self.start_date.isoformat(), "9999-99-99")
+        self._slots = {date: self.availability.get_slots(date) for date in self._free_dates}
+        for service in scheduler.services:
+            self._windows[service], self._window_starts[service] = scheduler.get_windows(service, 0, scheduler.horizon_days)
+
+        self._free_starts = np.zeros((scheduler.horizon_days, len(self._starts)), dtype=np.int32)
+        self._day_summaries = {}
+        for day in range(scheduler.horizon_days):
+            self._update_day(day)
+
+        self._summary = None
+        self.version += 1
+        logger.info(f"Availability snapshot built from {self.start_date} for {scheduler.horizon_days} days")
+
+    def _set_fixed_slots(self, date):
+        self.availability.set_slots(date, self.scheduler.get_fixed_slots(date, self.fixed_slot_minutes))
+
+    def _refresh(self):
+        if self.start_date != datetime.date.today():
+            self.rebuild()
+
+    def _update_day(self, day):
+        date = self.scheduler.get_date(day)
+        free_starts = self._free_starts[day]
+        free_starts[:] = 0
+        for time_string in self._slots.get(date, ()):
+            free_starts[parse_time(time_string) // self.scheduler.slot_minutes] = 1
+
+        full_services = [service for service, windows in self._windows.items() if not windows[:, day].any()]
+        self._day_summaries[date] = self._format_day_summary(date, self._period_masks @ free_starts, full_services)
+
+    def _format_day_summary(self, date, period_counts, full_services):
+        day_name = datetime.date.fromisoformat(date).strftime("%A")
+        if self.scheduler.opening_hours.get(datetime.date.fromisoformat(date).weekday()) is None and not period_counts.any():
+            return f"{day_name} {date}: closed"
+        if not period_counts.any() and len(full_services) == len(self._windows):
+            return f"{day_name} {date}: fully booked"
+
+        if period_counts.any():
+            periods = ", ".join(f"{count} in the {name}" for (name, _), count in zip(PERIODS, period_counts) if count)
+            summary = f"{day_name} {date}: appointment slots left: {periods}"
+        else:
+            summary = f"{day_name} {date}: no appointment slots left"
+        if full_services:
+            summary += f"; no time left for {', '.join(full_services)}"
+        return summary
+
+    def update(self, date):
+        """Updates the snapshot of the date after a booking, a cancellation or a hold on it."""
+        if self.start_date is None:
+            return
+        if self.start_date != datetime.date.today():
+            self.rebuild()
+            return
+
+        day = self.scheduler.get_day(date)
+        if day is not None:
+            self._set_fixed_slots(date)
+        slots = self.availability.get_slots(date)
+        i = bisect.bisect_left(self._free_dates, date)
+        listed = i < len(self._free_dates) and self._free_dates[i] == date
+        if slots:
+            self._slots[date] = slots
+            if not listed and date >= self.start_date.isoformat():
+                self._free_dates.insert(i, date)
+        else:
+            self._slots.pop(date, None)
+            if listed:
+                del self._free_dates[i]
+
+        if day is not None:
+            for service in self._windows:
+                windows, _ = self.scheduler.get_windows(service, day, day + 1)
+                self._windows[service][:, day] = windows[:, 0]
+            self._update_day(day)
+            if 0 < day <= self.summary_days:
+                self._summary = None
+        self.version += 1
+
+    def get_slots(self, date):
+        """Free times of the fixed slots of the date."""
+        self._refresh()
+        return list(self._slots.get(date, ()))
+
+    def get_next_free_slot(self, date, time_string="00:00"):
+        """Returns the first free fixed slot (date, time) at or after date and time, or None."""
+        self._refresh()
+        for time in self._slots.get(date, ()):
+            if time >= time_string:
+                return date, time
+
+        i = bisect.bisect_right(self._free_dates, date)
+        if i == len(self._free_dates):
+            return None
+        next_date = self._free_dates[i]
+        return next_date, self._slots[next_date][0]
+
+    def find_slots(self, service, date, stylist=None, earliest_time="00:00"):
+        """Returns the start times of the service on date, not before earliest_time, with the stylists available at each of them."""
+        self._refresh()
+        day = self.scheduler.get_day(date)
+        if day is None:
+            return []
+
+        day_windows = self._windows[service][:, day]
+        if stylist is not None:
+            day_windows = day_windows & (np.array(self.scheduler.stylists) == stylist)[:, None]
+        earliest_minute = parse_time(earliest_time)
+        return [
+            (format_time(start), [self.scheduler.stylists[i] for i in stylist_indexes])
+            for start, stylist_indexes in list_windows(day_windows, self._window_starts[service])
+            if start >= earliest_minute
+        ]
+
+    def find_earliest_slot(self, service, date=None, time_string="00:00", stylist=None):
+        """Returns the first (date, time, stylist) at or after date and time when the service can be booked, or None."""
+        self._refresh()
+        first_day = 0 if date is None else self.scheduler.get_day(date)
+        if first_day is None:
+            return None
+
+        windows = self._windows[service][:, first_day:]
+        if stylist is not None:
+            windows = windows & (np.array(self.scheduler.stylists) == stylist)[:, None, None]
+        window = find_earliest_window(windows, self._window_starts[service], parse_time(time_string))
+        if window is None:
+            return None
+
+        day, start, stylist_index = window
+        return self.scheduler.get_date(first_day + day), format_time(int(self._window_starts[service][start])), self.scheduler.stylists[stylist_index]
+
+    def get_day_summary(self, date):
+        self._refresh()
+        return self._day_summaries.get(date)
+
+    def get_summary(self):
+        """Summary lines of today and the next summary_days days."""
+        self._refresh()
+        if self._summary is None:
+            self._summary = "\n".join(
+                self._day_summaries[self.scheduler.get_date(day)]
+                for day in range(1, min(self.summary_days + 1, self.scheduler.horizon_days))
+            )
+
+        # The slots of today that have already passed aren't counted, so its line is rebuilt at each slot
+        now = datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        today_summary_key = (self.version, minute // self.scheduler.slot_minutes)
+        if self._today_summary_key != today_summary_key:
+            free_starts = self._free_starts[0] * (self._starts >= minute)
+            full_services = [
+                service for service, windows in self._windows.items()
+                if not windows[:, 0, self._window_starts[service] >= minute].any()
+            ]
+            self._today_summary = self._format_day_summary(now.date().isoformat(), self._period_masks @ free_starts, full_services)
+            self._today_summary_key = today_summary_key
+
+        return self._today_summary + "\n" + self._summary if self._summary else self._today_summary
@@ -0,0 +1,72 @@
+import os
+import time
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Recording is disabled unless a directory is configured
+CALL_RECORDING_DIR = os.environ.get("CALL_RECORDING_DIR")
+
+INBOUND = "i"
+OUTBOUND = "o"
+
+
+class CallRecorder:
+    """
+    Append-only log of every websocket frame of a call.
+
+    Each line is "<milliseconds since the recorder started>\\t<i|o>\\t<frame>", where the frame is
+    the raw JSON text exchanged with Retell. A reconnect of the same call appends to the same log.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._started_at = time.monotonic()
+
+    def record(self, direction, frame: str):
+        if "\n" in frame:
+            frame = json.dumps(json.loads(frame), ensure_ascii=False, separators=(",", ":"))
+
+        offset_ms = (time.monotonic() - self._started_at) * 1000
+        self._file.write("%.1f\t%s\t%s\n" % (offset_ms, direction, frame))
+
+    def record_inbound(self, frame: str):
+        self.record(INBOUND, frame)
+
+    def record_outbound(self, frame: str):
+        self.record(OUTBOUND, frame)
+
+    def close(self):
+        self._file.close()
+
+
+def create_call_recorder(call_id, recording_dir=CALL_RECORDING_DIR) -> CallRecorder | None:
+    if not recording_dir:
+        return None
+
+    os.makedirs(recording_dir, exist_ok=True)
+    file_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in call_id) + ".log"
+    return CallRecorder(os.path.join(recording_dir, file_name))
+
+
+def read_call_recording(path):
+    """Yields (offset_seconds, direction, frame) for every frame of a recorded call."""
+    # The offsets restart on every reconnect, the connections are laid out one after another
+    base_offset = 0.0
+    last_offset = 0.0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            offset_ms, direction, frame = line.split("\t", 2)
+            offset = base_offset + float(offset_ms) / 1000
+            if offset < last_offset:
+                base_offset = last_offset
+                offset = base_offset + float(offset_ms) / 1000
+            last_offset = offset
+            yield offset, direction, json.loads(frame)
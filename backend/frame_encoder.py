@@ -0,0 +1,65 @@
+import json
+
+from .custom_types import ResponseResponse
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+# Quoted and escaped JSON string, the C implementation of the stdlib is as fast as orjson for a
+# single str and doesn't need the bytes -> str round trip.
+encode_string = json.encoder.encode_basestring
+
+
+_RESPONSE_FRAME_PREFIX = '{"response_type":"response","response_id":%d,"content":'
+
+_RESPONSE_FRAME_SUFFIXES = {
+    (False, False): ',"content_complete":false,"end_call":false}',
+    (True, False): ',"content_complete":true,"end_call":false}',
+    (False, True): ',"content_complete":false,"end_call":true}',
+    (True, True): ',"content_complete":true,"end_call":true}',
+}
+
+
+def encode_model(model) -> str:
+    """Encodes any of the Retell response models (config, ping_pong...) into a text frame."""
+    return dumps(model.model_dump(exclude_none=True))
+
+
+def encode_ping_pong(timestamp: int) -> str:
+    return '{"response_type":"ping_pong","timestamp":%d}' % timestamp
+
+
+class ResponseFrameEncoder:
+    """
+    Encodes the streamed ResponseResponse frames of one response_id.
+
+    The constant parts of the frame are pre-built once per response_id, so encoding a token only
+    escapes its content and concatenates three strings: no model validation, no dict copies.
+    """
+
+    def __init__(self, response_id: int):
+        self.response_id = response_id
+        self._prefix = _RESPONSE_FRAME_PREFIX % response_id
+
+    def encode(self, content: str, content_complete: bool = False, end_call: bool = False, transfer_number: str | None = None) -> str:
+        suffix = _RESPONSE_FRAME_SUFFIXES[(bool(content_complete), bool(end_call))]
+        if transfer_number is not None:
+            suffix = ',"transfer_number":' + encode_string(transfer_number) + suffix
+
+        return self._prefix + encode_string(content) + suffix
+
+    def encode_event(self, event: ResponseResponse) -> str:
+        if event.response_id != self.response_id:
+            return ResponseFrameEncoder(event.response_id).encode_event(event)
+
+        return self.encode(event.content, event.content_complete, event.end_call, event.transfer_number)
@@ -1,5 +1,10 @@
 import os
+import re
 import json
+import time
+import asyncio
+import datetime
+import hashlib
 import logging
 from typing import List
 
@@ -12,39 +17,147 @@ from .custom_types import (
     Utterance,
 )
 from .llm_fsm.fsm import LLMStateMachine
+from .llm_fsm.context import RollingSummaryContext, build_summary_messages
+from .usage import CallUsage, TokenUsage
+from .model_router import ModelRouter, start_hedged_stream, BOOKING_KEYWORDS
+from .reminders import ReminderEngine
+from .availability import AvailabilityIndex
+from .appointments import AppointmentBook, AppointmentRepository
+from .scheduler import SalonScheduler, SERVICES, STYLISTS
+from .availability_snapshot import AvailabilitySnapshot
 
 
 logger = logging.getLogger(__name__)
 
 
-available_slots = {
-    "2023-07-01": ["10:00", "11:00", "14:00", "15:00"],
-    "2023-07-02": ["09:00", "10:00", "11:00", "14:00"],
-    "2023-07-03": ["11:00", "13:00", "14:00", "16:00"],
-    "2023-07-04": ["10:00", "12:00", "15:00", "16:00"],
+# Transcript messages sent verbatim, the older ones are folded into a rolling summary
+CONTEXT_MAX_RECENT_MESSAGES = int(os.environ.get("CONTEXT_MAX_RECENT_MESSAGES", 30))
+CONTEXT_MIN_MESSAGES_TO_SUMMARIZE = int(os.environ.get("CONTEXT_MIN_MESSAGES_TO_SUMMARIZE", 10))
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gpt-4o-mini")
+
+# Seconds a tool call may take before its result is replaced by an error for the model
+TOOL_CALL_TIMEOUT = float(os.environ.get("TOOL_CALL_TIMEOUT", 5))
+# Tools that hold or book a slot: they aren't timed out nor cancelled with the response, a write handed to the
+# repository commits anyway and the model must be told its actual outcome. The SQLite busy timeout bounds them.
+WRITE_TOOLS = frozenset(["hold_time_slot", "schedule_appointment"])
+# Completions with tool results fed back to the model in a single turn, the last one can't call tools
+MAX_TOOL_ROUNDS = int(os.environ.get("MAX_TOOL_ROUNDS", 3))
+
+# Said as soon as the model calls one of these tools, while the tool and the follow-up completion run.
+# Overridden with a JSON object in TOOL_FILLER_MESSAGES, "{}" disables them.
+DEFAULT_TOOL_FILLER_MESSAGES = {
+    "check_availability": "One sec, let me check.",
+    "find_appointment_slots": "One sec, let me check.",
+    "schedule_appointment": "Okay, give me a moment to book that for you.",
 }
+TOOL_FILLER_MESSAGES = json.loads(os.environ["TOOL_FILLER_MESSAGES"]) if os.environ.get("TOOL_FILLER_MESSAGES") else DEFAULT_TOOL_FILLER_MESSAGES
+
+
+# Fixed slots of the opening hours over the booking horizon
+availability = AvailabilityIndex.from_opening_hours()
+
+# Calendars of the stylists, for the services booked with a stylist
+scheduler = SalonScheduler()
+# Availability read by the prompts and the tool answers, built when the server loads the booked slots
+availability_snapshot = AvailabilitySnapshot(availability, scheduler)
+
+# Appointments are persisted, the server loads the booked appointments into the calendars on startup
+appointment_book = AppointmentBook(availability, AppointmentRepository(), scheduler=scheduler, snapshot=availability_snapshot)
+
+
+def check_availability(date, call_id=None):
+    return appointment_book.get_slots(date, owner=call_id)
+
+
+# Tool implementations: they receive the parsed arguments of the tool call and the call_id, and return
+# the result fed back to the model. end_call is not here, it ends the turn instead.
+async def run_check_availability(arguments, call_id):
+    date = arguments["date"]
+    now = datetime.datetime.now()
+    today = now.date().isoformat()
+    # The past days and the times of today that have already passed aren't offered
+    earliest_time = now.strftime("%H:%M") if date <= today else "00:00"
+    available_times = [time_string for time_string in check_availability(date, call_id) if date >= today and time_string >= earliest_time]
+    if not available_times:
+        next_free_slot = availability_snapshot.get_next_free_slot(max(date, today), earliest_time)
+        if next_free_slot is None:
+            return f"No available times on {date}."
+        return f"No available times on {date}. The next available time is on {next_free_slot[0]} at {next_free_slot[1]}."
+    return f"Available times on {date}: {', '.join(available_times)}"
 
-appointments = []
 
+async def run_find_appointment_slots(arguments, call_id):
+    service = arguments["service"]
+    stylist = arguments.get("stylist")
+    if service not in SERVICES:
+        return f"Unknown service {service}, the services are: {', '.join(SERVICES)}."
+    if stylist is not None and service not in STYLISTS.get(stylist, ()):
+        return f"{stylist} doesn't do {service}, ask for: {', '.join(scheduler.get_stylists(service))}."
 
-def book_appointment(name, phone, email, appointment_date):
-    # Implement your appointment booking logic here
-    logger.info(f"Appointment booked for {name} on {appointment_date}. We will contact you at {phone} or {email}.")
+    now = datetime.datetime.now()
+    today = now.date().isoformat()
+    date = arguments.get("date")
+    # The times of today that have already passed aren't offered
+    earliest_time = now.strftime("%H:%M") if date in (None, today) else "00:00"
+    if date is not None:
+        slots = availability_snapshot.find_slots(service, date, stylist, earliest_time)
+        if slots:
+            return f"Available times for {service} on {date}: " + ", ".join(f"{time_string} ({' or '.join(stylists)})" for time_string, stylists in slots)
 
-    if date in available_slots[doctor_name] and time in available_slots[doctor_name][date]:
-        available_slots[date].remove(time)
-        appointments.append({
-            "name": name,
-            "phone": phone,
-            "email": email,
-            "appointment_date": appointment_date
-        })
-        return True
-    return False
+    earliest_slot = availability_snapshot.find_earliest_slot(service, date or today, earliest_time, stylist)
+    if earliest_slot is None:
+        return f"No available times for {service} in the next {scheduler.horizon_days} days."
+    message = f"The earliest available time for {service} is on {earliest_slot[0]} at {earliest_slot[1]} with {earliest_slot[2]}."
+    if date is not None:
+        return f"No available times for {service} on {date}. {message}"
+    return f"{message}\nAvailability of the next days:\n{availability_snapshot.get_summary()}"
 
 
-def check_availability(date):
-    return available_slots.get(date, [])
+async def run_hold_time_slot(arguments, call_id):
+    if call_id is None:
+        return "The time slot can't be held, continue with the booking."
+    # Without a service, a fixed slot of check_availability with any stylist
+    service = arguments.get("service") if arguments.get("service") in SERVICES else None
+    for_service = f" for {service}" if service else ""
+    stylist = await appointment_book.hold_service(service, arguments["date"], arguments["time"], call_id, arguments.get("stylist"))
+    if stylist is None:
+        return f"The time slot {arguments['date']} {arguments['time']} is not available{for_service}."
+    return f"The time slot {arguments['date']} {arguments['time']} is held with {stylist}{for_service} while the booking is completed."
+
+
+async def run_schedule_appointment(arguments, call_id):
+    service = arguments.get("service") if arguments.get("service") in SERVICES else None
+    for_service = f" for {service}" if service else ""
+    booking = await appointment_book.book_service(
+        service,
+        arguments["date"],
+        arguments["time"],
+        arguments["customer_name"],
+        arguments["customer_phone"],
+        arguments["customer_email"],
+        stylist=arguments.get("stylist"),
+        # The window held by the call, if any, is converted into the appointment
+        owner=call_id,
+    )
+    if booking is None:
+        return f"The time slot {arguments['date']} {arguments['time']} is not available{for_service}."
+    return f"Appointment booked{for_service} with {booking[1]} on {arguments['date']} at {arguments['time']}."
+
+
+async def run_detect_user_intent(arguments, call_id):
+    return f"User intent noted: {arguments['intention']}."
+
+
+# Write tool calls in progress, referenced until they complete even if their response was cancelled
+_write_tasks = set()
+
+TOOL_HANDLERS = {
+    "check_availability": run_check_availability,
+    "find_appointment_slots": run_find_appointment_slots,
+    "hold_time_slot": run_hold_time_slot,
+    "schedule_appointment": run_schedule_appointment,
+    "detect_user_intent": run_detect_user_intent,
+}
 
 
 begin_sentence = "Hey there, I'm your personal hair salon assistant, how can I help you?"
@@ -82,14 +195,276 @@ Optional additions:
 """
 
 
+style_guide = '##Objective\nYou are a voice AI agent engaging in a human-like voice conversation with the user. You will respond based on your given instruction and the provided transcript and be as human-like as possible\n\n## Style Guardrails\n- [Be concise] Keep your response succinct, short, and get to the point quickly. Address one question or action item at a time. Don\'t pack everything you want to say into one utterance.\n- [Do not repeat] Don\'t repeat what\'s in the transcript. Rephrase if you have to reiterate a point. Use varied sentence structures and vocabulary to ensure each response is unique and personalized.\n- [Be conversational] Speak like a human as though you\'re speaking to a close friend -- use everyday language and keep it human-like. Occasionally add filler words, while keeping the prose short. Avoid using big words or sounding too formal.\n- [Reply with emotions]: You have human-like emotions, attitudes, and dispositions. When appropriate: use tone and style to create more engaging and personalized responses; incorporate humor or wit; get emotional or empathetic; apply elements of surprise or suspense to keep the user engaged. Don\'t be a pushover.\n- [Be proactive] Lead the conversation and do not be passive. Most times, engage users by ending with a question or suggested next step.\n\n## Response Guideline\n- [Overcome ASR errors] This is a real-time transcript, expect there to be errors. If you can guess what the user is trying to say,  then guess and respond. When you must ask for clarification, pretend that you heard the voice and be colloquial (use phrases like "didn\'t catch that", "some noise", "pardon", "you\'re coming through choppy", "static in your speech", "voice is cutting in and out"). Do not ever mention "transcription error", and don\'t repeat yourself.\n- [Always stick to your role] Think about what your role can and cannot do. If your role cannot do something, try to steer the conversation back to the goal of the conversation and to your role. Don\'t repeat yourself in doing this. You should still be creative, human-like, and lively.\n- [Create smooth conversation] Your response should both fit your role and fit into the live calling session to create a human-like conversation. You respond directly to what the user just said.\n\n## Role\n'
+
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": style_guide + agent_prompt,
+}
+
+# Step 1: Prepare the function calling definition to the prompt
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "end_call",
+            "description": "End the call only when user explicitly requests it.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "message": {
+                        "type": "string",
+                        "description": "The message you will say before ending the call with the customer.",
+                    },
+                },
+                "required": ["message"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "detect_user_intent",
+            "description": """According to the conversation, select one of the next user intents if it's possible:
+    - appointment: the user wants to make an appointment
+    - appointment_confirmation: the user confirms the information regarding the appointment
+    - information_inquiry: the user wants information about the service
+    - complain: the user is complaining
+    - thanks: the user is complimenting the service
+""",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "intention": {
+                        "type": "string",
+                        "description": "The intention of the user.",
+                        "enum": ["appointment", "appointment_confirmation", "information_inquiry", "complain", "thanks"]
+                    },
+                },
+                "required": ["intention"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_availability",
+            "description": "Check available time slots for a given date",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date": {
+                        "type": "string",
+                        "description": "The date to check availability for, in YYYY-MM-DD format"
+                    }
+                },
+                "required": ["date"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_appointment_slots",
+            "description": "Find the available times for a service, with the stylists who can do it. Without a date, or if the date is full, returns the earliest available time",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "service": {
+                        "type": "string",
+                        "description": "The service the user wants",
+                        "enum": list(SERVICES),
+                    },
+                    "date": {
+                        "type": "string",
+                        "description": "The date the user wants, in YYYY-MM-DD format"
+                    },
+                    "stylist": {
+                        "type": "string",
+                        "description": "The stylist the user asked for, if any",
+                        "enum": list(STYLISTS),
+                    }
+                },
+                "required": ["service"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "hold_time_slot",
+            "description": "Hold the time slot chosen by the user so nobody else can book it while the contact information is gathered and confirmed",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date": {
+                        "type": "string",
+                        "description": "The date of the time slot, in YYYY-MM-DD format"
+                    },
+                    "time": {
+                        "type": "string",
+                        "description": "The time of the time slot, in HH:MM format"
+                    },
+                    "service": {
+                        "type": "string",
+                        "description": "The service of the appointment, if it was found with find_appointment_slots",
+                        "enum": list(SERVICES),
+                    },
+                    "stylist": {
+                        "type": "string",
+                        "description": "The stylist chosen by the user, if any",
+                        "enum": list(STYLISTS),
+                    }
+                },
+                "required": ["date", "time"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "schedule_appointment",
+            "description": "Schedule an appointment for the service if the user confirms the relevant information for the appointment: date, time, name, email and phone",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date": {
+                        "type": "string",
+                        "description": "The date for the appointment, in YYYY-MM-DD format"
+                    },
+                    "time": {
+                        "type": "string",
+                        "description": "The time for the appointment, in HH:MM format"
+                    },
+                    "customer_name": {
+                        "type": "string",
+                        "description": "The name of the customer"
+                    },
+                    "customer_email": {
+                        "type": "string",
+                        "description": "The email of the customer"
+                    },
+                    "customer_phone": {
+                        "type": "string",
+                        "description": "The phone of the customer"
+                    },
+                    "service": {
+                        "type": "string",
+                        "description": "The service of the appointment, if it was found with find_appointment_slots",
+                        "enum": list(SERVICES),
+                    },
+                    "stylist": {
+                        "type": "string",
+                        "description": "The stylist chosen by the user, if any",
+                        "enum": list(STYLISTS),
+                    }
+                },
+                "required": ["date", "time", "customer_name", "customer_email", "customer_phone"]
+            }
+        }
+    }
+]
+
+# Identifies the prompt prefix (system message and tools), it changes when the prompt changes
+PROMPT_PREFIX_FINGERPRINT = hashlib.sha256(
+    json.dumps([SYSTEM_MESSAGE, TOOLS], sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+
+_word_re = re.compile(r"\w+", re.UNICODE)
+
+
+def get_availability_message():
+    # After the transcript, so the availability changes don't invalidate the prompt cache of the call
+    return {
+        "role": "system",
+        "content": "Availability of the next days:\n" + availability_snapshot.get_summary(),
+    }
+
+
+class TranscriptMessageCache:
+    """
+    Incremental conversion of the Retell transcript of a call into OpenAI messages.
+
+    Retell sends the whole transcript on every turn, but only the trailing utterances are new or
+    edited: the unchanged prefix keeps its converted messages and only the rest is converted.
+    """
+
+    def __init__(self):
+        self._utterances = []
+        self._messages = []
+
+    def get_common_prefix_length(self, transcript: List[Utterance]):
+        utterances = self._utterances
+        n = min(len(transcript), len(utterances))
+        i = 0
+        while i < n:
+            role, content = utterances[i]
+            utterance = transcript[i]
+            if utterance.role != role or utterance.content != content:
+                break
+            i += 1
+        return i
+
+    def convert(self, transcript: List[Utterance]):
+        """Returns the messages of the transcript. The list is reused between turns, copy it before modifying it."""
+        common_prefix_length = self.get_common_prefix_length(transcript)
+        if common_prefix_length < len(self._utterances):
+            del self._utterances[common_prefix_length:]
+            del self._messages[common_prefix_length:]
+
+        for utterance in transcript[common_prefix_length:]:
+            self._utterances.append((utterance.role, utterance.content))
+            if utterance.role == "agent":
+                self._messages.append({"role": "assistant", "content": utterance.content})
+            else:
+                self._messages.append({"role": "user", "content": utterance.content})
+
+        return self._messages
+
+
 class LlmClient:
-    def __init__(self, model="gpt-4o-mini"):
-        self.client = AsyncOpenAI(
-            organization=os.environ.get("OPENAI_ORGANIZATION_ID"),
-            api_key=os.environ["OPENAI_API_KEY"],
-            model=model
+    def __init__(self, client=None, call_usage=None, context_state=None, answer_cache=None, hedge_client=None, model_router=None, reminder_engine=None, call_id=None):
+        # Per-call handles should receive the shared client of LlmClientManager, creating a
+        # client here opens a new connection pool.
+        if client is None:
+            client = AsyncOpenAI(
+                organization=os.environ.get("OPENAI_ORGANIZATION_ID"),
+                api_key=os.environ["OPENAI_API_KEY"],
+            )
+        self.client = client
+        self.call_id = call_id
+        # Hedged requests go to the alternate endpoint if there's one
+        self.hedge_client = hedge_client or client
+        self.model_router = model_router or ModelRouter()
+        self.reminder_engine = reminder_engine or ReminderEngine()
+        self.transcript_message_cache = TranscriptMessageCache()
+        self.call_usage = call_usage or CallUsage()
+        self.answer_cache = answer_cache
+        self.context = RollingSummaryContext(
+            self.summarize_messages,
+            max_recent_messages=CONTEXT_MAX_RECENT_MESSAGES,
+            min_messages_to_summarize=CONTEXT_MIN_MESSAGES_TO_SUMMARIZE,
+            **(context_state or {}),
         )
-        self.model = model
+
+    def close(self):
+        self.context.cancel()
+
+    async def summarize_messages(self, previous_summary, messages):
+        started_at = time.perf_counter()
+        response = await self.client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=build_summary_messages(previous_summary, messages),
+            temperature=0,
+        )
+        if response.usage is not None:
+            self.call_usage.record(
+                TokenUsage.from_openai_usage(response.usage, seconds=time.perf_counter() - started_at),
+                model=SUMMARY_MODEL,
+                state="summary",
+            )
+        return response.choices[0].message.content
 
     def draft_begin_message(self):
         response = ResponseResponse(
@@ -100,28 +475,43 @@ class LlmClient:
         )
         return response
 
+    def get_conversation_state(self, request: ResponseRequiredRequest):
+        """Coarse state of the conversation, part of the answer cache key."""
+        # Right after the begin message there is no context yet, so those answers can be reused as is
+        if len(request.transcript) <= 2:
+            return "greeting"
+        return "conversation"
+
+    def get_answer_cache_key(self, request: ResponseRequiredRequest):
+        """Returns the answer cache key of the turn, or None if its answer may depend on the call."""
+        if self.answer_cache is None or request.interaction_type != "response_required":
+            return None
+        if not request.transcript or request.transcript[-1].role != "user":
+            return None
+        # Later answers depend on the earlier turns: the name of the caller, the service or date they chose...
+        state = self.get_conversation_state(request)
+        if state != "greeting":
+            return None
+
+        content = request.transcript[-1].content
+        # Answers about bookings depend on the availability and the caller, not only on the question
+        if any(word in BOOKING_KEYWORDS or word.isdigit() for word in _word_re.findall(content.lower())):
+            return None
+        return self.answer_cache.make_key(content, state)
+
     def convert_transcript_to_openai_messages(self, transcript: List[Utterance]):
-        messages = []
-        for utterance in transcript:
-            if utterance.role == "agent":
-                messages.append({"role": "assistant", "content": utterance.content})
-            else:
-                messages.append({"role": "user", "content": utterance.content})
-        return messages
+        return self.transcript_message_cache.convert(transcript)
 
     def prepare_prompt(self, request: ResponseRequiredRequest):
-        prompt = [
-            {
-                "role": "system",
-                "content": '##Objective\nYou are a voice AI agent engaging in a human-like voice conversation with the user. You will respond based on your given instruction and the provided transcript and be as human-like as possible\n\n## Style Guardrails\n- [Be concise] Keep your response succinct, short, and get to the point quickly. Address one question or action item at a time. Don\'t pack everything you want to say into one utterance.\n- [Do not repeat] Don\'t repeat what\'s in the transcript. Rephrase if you have to reiterate a point. Use varied sentence structures and vocabulary to ensure each response is unique and personalized.\n- [Be conversational] Speak like a human as though you\'re speaking to a close friend -- use everyday language and keep it human-like. Occasionally add filler words, while keeping the prose short. Avoid using big words or sounding too formal.\n- [Reply with emotions]: You have human-like emotions, attitudes, and dispositions. When appropriate: use tone and style to create more engaging and personalized responses; incorporate humor or wit; get emotional or empathetic; apply elements of surprise or suspense to keep the user engaged. Don\'t be a pushover.\n- [Be proactive] Lead the conversation and do not be passive. Most times, engage users by ending with a question or suggested next step.\n\n## Response Guideline\n- [Overcome ASR errors] This is a real-time transcript, expect there to be errors. If you can guess what the user is trying to say,  then guess and respond. When you must ask for clarification, pretend that you heard the voice and be colloquial (use phrases like "didn\'t catch that", "some noise", "pardon", "you\'re coming through choppy", "static in your speech", "voice is cutting in and out"). Do not ever mention "transcription error", and don\'t repeat yourself.\n- [Always stick to your role] Think about what your role can and cannot do. If your role cannot do something, try to steer the conversation back to the goal of the conversation and to your role. Don\'t repeat yourself in doing this. You should still be creative, human-like, and lively.\n- [Create smooth conversation] Your response should both fit your role and fit into the live calling session to create a human-like conversation. You respond directly to what the user just said.\n\n## Role\n'
-                + agent_prompt,
-            }
-        ]
+        # The system message is the same object on every request: together with TOOLS it's a
+        # byte-stable prefix that the provider-side prompt cache can reuse.
+        prompt = [SYSTEM_MESSAGE]
         transcript_messages = self.convert_transcript_to_openai_messages(
             request.transcript
         )
-        for message in transcript_messages:
-            prompt.append(message)
+        # Long calls only send the last messages verbatim, after the summary of the older ones
+        prompt.extend(self.context.get_messages(transcript_messages))
+        prompt.append(get_availability_message())
 
         if request.interaction_type == "reminder_required":
             prompt.append(
@@ -134,181 +524,246 @@ class LlmClient:
 
     # Step 1: Prepare the function calling definition to the prompt
     def prepare_functions(self):
-        functions = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "end_call",
-                    "description": "End the call only when user explicitly requests it.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "message": {
-                                "type": "string",
-                                "description": "The message you will say before ending the call with the customer.",
-                            },
-                        },
-                        "required": ["message"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "detect_user_intent",
-                    "description": """According to the conversation, select one of the next user intents if it's possible:
-    - appointment: the user wants to make an appointment
-    - appointment_confirmation: the user confirms the information regarding the appointment
-    - information_inquiry: the user wants information about the service
-    - complain: the user is complaining
-    - thanks: the user is complimenting the service
-""",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "intention": {
-                                "type": "string",
-                                "description": "The intention of the user.",
-                                "enum": ["appointment", "appointment_confirmation", "information_inquiry", "complain", "thanks"]
-                            },
-                        },
-                        "required": ["intention"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "check_availability",
-                    "description": "Check available time slots for a given date",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "date": {
-                                "type": "string",
-                                "description": "The date to check availability for, in YYYY-MM-DD format"
-                            }
-                        },
-                        "required": ["date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "schedule_appointment",
-                    "description": "Schedule an appointment for the service if the user confirms the relevant information for the appointment: date, time, name, email and phone",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "date": {
-                                "type": "string",
-                                "description": "The date for the appointment, in YYYY-MM-DD format"
-                            },
-                            "time": {
-                                "type": "string",
-                                "description": "The time for the appointment, in HH:MM format"
-                            },
-                            "customer_name": {
-                                "type": "string",
-                                "description": "The name of the customer"
-                            },
-                            "customer_email": {
-                                "type": "string",
-                                "description": "The email of the customer"
-                            },
-                            "customer_phone": {
-                                "type": "string",
-                                "description": "The phone of the customer"
-                            }
-                        },
-                        "required": ["date", "time", "customer_name", "customer_email", "customer_phone"]
-                    }
-                }
-            }
-        ]
-        return functions
+        return TOOLS
 
-    async def draft_response(self, request: ResponseRequiredRequest):
-        prompt = self.prepare_prompt(request)
-        func_call = {}
-        func_arguments = ""
-        stream = await self.client.chat.completions.create(
-            model="gpt-4-turbo-preview",  # Or use a 3.5 model for speed
-            messages=prompt,
-            stream=True,
-            # Step 2: Add the function into your request
-            tools=self.prepare_functions(),
+    async def open_stream(self, model, messages, tool_choice="auto"):
+        """Starts the completion stream, hedged with a second request if the first one is slow to start."""
+        def create_stream(client, model):
+            return client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                # Step 2: Add the function into your request
+                tools=self.prepare_functions(),
+                tool_choice=tool_choice,
+                # The last chunk of the stream carries the usage, including the cached prompt tokens
+                extra_body={"stream_options": {"include_usage": True}},
+            )
+
+        hedge_model = self.model_router.get_hedge_model(model)
+        # Hedging with the same model on the same endpoint only doubles the load of a slow provider
+        if hedge_model == model and self.hedge_client is self.client:
+            create_hedge_stream = None
+        else:
+            create_hedge_stream = lambda: create_stream(self.hedge_client, hedge_model)
+        return await start_hedged_stream(
+            model,
+            lambda: create_stream(self.client, model),
+            hedge_model,
+            create_hedge_stream,
+            self.model_router.hedge_delay,
         )
 
-        async for chunk in stream:
-            # Step 3: Extract the functions
-            if len(chunk.choices) == 0:
-                continue
-            if chunk.choices[0].delta.tool_calls:
-                tool_calls = chunk.choices[0].delta.tool_calls[0]
-                if tool_calls.id:
-                    if func_call:
-                        # Another function received, old function complete, can break here.
-                        break
-                    func_call = {
-                        "id": tool_calls.id,
-                        "func_name": tool_calls.function.name or "",
-                        "arguments": {},
-                    }
-                else:
-                    # append argument
-                    func_arguments += tool_calls.function.arguments or ""
+    async def run_tool_call(self, tool_call, metrics=None):
+        """Runs a tool call and returns its result for the model. Errors and timeouts are reported to the model too."""
+        function_name = tool_call["name"]
+        tool_call_started_at = time.perf_counter()
+        try:
+            handler = TOOL_HANDLERS.get(function_name)
+            if handler is None:
+                raise ValueError(f"unknown tool {function_name}")
+            arguments = json.loads(tool_call["arguments"] or "{}")
+            if function_name in WRITE_TOOLS:
+                # The in-memory availability is updated after the write, so the handler always runs to completion
+                task = asyncio.create_task(handler(arguments, self.call_id))
+                _write_tasks.add(task)
+                task.add_done_callback(_write_tasks.discard)
+                return await asyncio.shield(task)
+            return await asyncio.wait_for(handler(arguments, self.call_id), TOOL_CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Tool call {function_name} timed out after {TOOL_CALL_TIMEOUT}s")
+            return "Error: the request timed out, it can't be checked right now."
+        except Exception as err:
+            logger.error(f"Error in tool call {function_name}: {err!r}")
+            return f"Error: {err!r}"
+        finally:
+            if metrics is not None:
+                metrics.on_tool_call(function_name, time.perf_counter() - tool_call_started_at)
 
-            # Parse transcripts
-            if chunk.choices[0].delta.content:
-                response = ResponseResponse(
-                    response_id=request.response_id,
-                    content=chunk.choices[0].delta.content,
-                    content_complete=False,
-                    end_call=False,
-                )
-                yield response
+    async def draft_response(self, request: ResponseRequiredRequest, metrics=None, tool_gate=None):
+        """
+        Streams the response events of the request.
 
-        # Step 4: Call the functions
-        if func_call:
-            function_name = func_call["func_name"]
-            if function_name == "end_call":
-                func_call["arguments"] = json.loads(func_arguments)
-                response = ResponseResponse(
+        Tool calls of a completion run concurrently and their results are fed back to the model, which
+        streams the answer in a follow-up completion (at most MAX_TOOL_ROUNDS times per turn).
+
+        If tool_gate (asyncio.Event) is given, the tool calls are not executed until it's set: used by
+        speculative drafts, which must not have side effects before the user has finished talking.
+        """
+        if request.interaction_type == "reminder_required":
+            reminder = self.reminder_engine.get_reminder(request.transcript)
+            if reminder is not None:
+                if metrics is not None:
+                    metrics.model = "reminder_template"
+                    metrics.state = request.interaction_type
+
+                yield ResponseResponse.model_construct(
                     response_id=request.response_id,
-                    content=func_call["arguments"]["message"],
+                    content=reminder,
                     content_complete=True,
-                    end_call=True,
+                    end_call=False,
                 )
-                yield response
+                return
 
-            elif function_name == "check_availability":
-                available_times = check_availability(function_args['date'])
-                response = ResponseResponse(
+        answer_cache_key = self.get_answer_cache_key(request)
+        if answer_cache_key is not None:
+            cached_answer = self.answer_cache.get(answer_cache_key)
+            if cached_answer is not None:
+                if metrics is not None:
+                    metrics.model = "answer_cache"
+                    metrics.state = request.interaction_type
+
+                yield ResponseResponse.model_construct(
                     response_id=request.response_id,
-                    content=f"Available times on {function_args['date']}: {', '.join(available_times)}",
+                    content=cached_answer,
                     content_complete=True,
                     end_call=False,
                 )
-                yield response
-            elif function_name == "book_appointment":
-                success = book_appointment(
-                    function_args['date'],
-                    function_args['time'],
-                    function_args['customer_name'],
-                    function_args['customer_email'],
-                    function_args['customer_phone']
-                )
+                return
+
+        answer_parts = []
+        prompt = self.prepare_prompt(request)
+        has_tool_calls = False
+        call_ended = False
+        filler_sent = False
+
+        if metrics is not None:
+            metrics.state = request.interaction_type
+
+        for tool_round in range(MAX_TOOL_ROUNDS + 1):
+            # index -> {"id", "name", "arguments"}, the deltas of parallel tool calls are interleaved
+            tool_calls = {}
+            round_parts = []
+            # Usage is accounted per state: the follow-ups with tool results apart from the first completion
+            usage_state = request.interaction_type if tool_round == 0 else "tool_followup"
+            round_started_at = time.perf_counter()
+
+            stream = await self.open_stream(
+                self.model_router.route(request, tool_round),
+                prompt,
+                # The tools stay in the request to keep the cached prompt prefix, the last round can't use them
+                tool_choice="none" if tool_round == MAX_TOOL_ROUNDS else "auto",
+            )
+            # The model of the stream that started first
+            model = stream.model
+            if metrics is not None and tool_round == 0:
+                metrics.model = model
+
+            # The stream is closed as soon as the response is abandoned (i.e. the task is cancelled
+            # because a newer response_id arrived) so the provider stops generating tokens.
+            try:
+                async for chunk in stream:
+                    chunk_usage = getattr(chunk, "usage", None)
+                    if chunk_usage is not None:
+                        usage = TokenUsage.from_openai_usage(chunk_usage, seconds=time.perf_counter() - round_started_at)
+                        self.call_usage.record(usage, model=model, state=usage_state, response_id=request.response_id)
+                        if metrics is not None:
+                            # The follow-up rounds may use another model than the first one
+                            metrics.on_usage(usage, model)
+
+                    # Step 3: Extract the functions
+                    if len(chunk.choices) == 0:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.tool_calls:
+                        for tool_call_delta in delta.tool_calls:
+                            tool_call = tool_calls.get(tool_call_delta.index)
+                            if tool_call is None:
+                                tool_call = tool_calls[tool_call_delta.index] = {"id": "", "name": "", "arguments": ""}
+                            if tool_call_delta.id:
+                                tool_call["id"] = tool_call_delta.id
+                            if tool_call_delta.function is not None:
+                                if tool_call_delta.function.name:
+                                    tool_call["name"] = tool_call_delta.function.name
+                                tool_call["arguments"] += tool_call_delta.function.arguments or ""
+
+                            # Fill the silence of the tool path, unless the model already said something
+                            filler = TOOL_FILLER_MESSAGES.get(tool_call["name"])
+                            if filler and not filler_sent and not round_parts:
+                                filler_sent = True
+                                round_parts.append(filler)
+                                answer_parts.append(filler)
+                                response = ResponseResponse.model_construct(
+                                    response_id=request.response_id,
+                                    content=filler,
+                                    content_complete=False,
+                                    end_call=False,
+                                )
+                                yield response
+
+                    # Parse transcripts
+                    if delta.content:
+                        content = delta.content
+                        if not round_parts and answer_parts and not answer_parts[-1][-1:].isspace() and not content[:1].isspace():
+                            # Follow-up of a tool round: keep the sentences apart
+                            content = " " + content
+
+                        if metrics is not None:
+                            metrics.on_token()
+                        round_parts.append(content)
+                        answer_parts.append(content)
+
+                        # Token frames are built without validation, this is the hottest loop of
+                        # the server.
+                        response = ResponseResponse.model_construct(
+                            response_id=request.response_id,
+                            content=content,
+                            content_complete=False,
+                            end_call=False,
+                        )
+                        yield response
+            finally:
+                await stream.close()
+
+            if not tool_calls:
+                break
+            has_tool_calls = True
+
+            # Step 4: Call the functions
+            if tool_gate is not None:
+                await tool_gate.wait()
+
+            tool_calls = [tool_calls[index] for index in sorted(tool_calls)]
+            end_call = next((tool_call for tool_call in tool_calls if tool_call["name"] == "end_call"), None)
+            if end_call is not None:
+                try:
+                    message = json.loads(end_call["arguments"])["message"]
+                except (ValueError, KeyError, TypeError):
+                    message = ""
                 response = ResponseResponse(
                     response_id=request.response_id,
-                    content="Appointment booked successfully!" if success else "Sorry, that time slot is not available.",
+                    content=message,
                     content_complete=True,
-                    end_call=False,
+                    end_call=True,
                 )
                 yield response
-        else:
-            # No functions, complete response
+                call_ended = True
+                break
+
+            # All the tool calls of the round run concurrently, then their results are fed back
+            # to the model which streams the answer.
+            results = await asyncio.gather(*(self.run_tool_call(tool_call, metrics) for tool_call in tool_calls))
+
+            prompt.append({
+                "role": "assistant",
+                "content": "".join(round_parts) or None,
+                "tool_calls": [
+                    {
+                        "id": tool_call["id"],
+                        "type": "function",
+                        "function": {"name": tool_call["name"], "arguments": tool_call["arguments"]},
+                    }
+                    for tool_call in tool_calls
+                ],
+            })
+            for tool_call, result in zip(tool_calls, results):
+                prompt.append({"role": "tool", "tool_call_id": tool_call["id"], "content": result})
+
+        if not call_ended:
+            # Only plain answers are cached: tool calls depend on the state of the bookings
+            if answer_cache_key is not None and answer_parts and not has_tool_calls:
+                self.answer_cache.put(answer_cache_key, "".join(answer_parts))
+
             response = ResponseResponse(
                 response_id=request.response_id,
                 content="",
@@ -316,3 +771,6 @@ class LlmClient:
                 end_call=False,
             )
             yield response
+
+        # The turn is complete: fold the old messages into the summary before the next turn
+        self.context.maybe_schedule_summarization(self.convert_transcript_to_openai_messages(request.transcript))
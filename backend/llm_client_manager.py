@@ -0,0 +1,104 @@
+import os
+import logging
+
+import httpx
+from openai import AsyncOpenAI
+
+from .llm import LlmClient
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    import h2  # noqa: F401
+except ImportError:
+    HTTP2_AVAILABLE = False
+else:
+    HTTP2_AVAILABLE = True
+
+
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 200))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 50))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 120))
+# Alternate OpenAI compatible endpoint of the hedged requests, by default they go to the same endpoint
+HEDGE_OPENAI_BASE_URL = os.environ.get("HEDGE_OPENAI_BASE_URL")
+
+
+class LlmClientManager:
+    """
+    Process-wide owner of the OpenAI client and its keep-alive HTTP connection pool.
+
+    Every websocket call gets a lightweight LlmClient handle that shares the same pool, so
+    only the first call of the process pays the TLS handshake.
+
+    Parameters:
+    - max_connections (int): Maximum number of concurrent connections to the OpenAI API.
+    - max_keepalive_connections (int): Maximum number of idle connections kept open.
+    - keepalive_expiry (float): Seconds an idle connection is kept open.
+    - http2 (bool | None): Use HTTP/2. By default it's enabled if the "h2" package is installed.
+    - answer_cache (AnswerCache | None): Process-wide answer cache shared by all the calls.
+    """
+
+    def __init__(self, max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS, keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY, http2=None, answer_cache=None):
+        if http2 is None:
+            http2 = HTTP2_AVAILABLE
+        elif http2 and not HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.answer_cache = answer_cache
+
+        self._http_client = None
+        self._client = None
+        self._hedge_client = None
+
+    def start(self):
+        if self._client is not None:
+            return
+
+        self._http_client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+        self._client = AsyncOpenAI(
+            organization=os.environ.get("OPENAI_ORGANIZATION_ID"),
+            api_key=os.environ["OPENAI_API_KEY"],
+            http_client=self._http_client,
+        )
+        if HEDGE_OPENAI_BASE_URL:
+            self._hedge_client = AsyncOpenAI(
+                base_url=HEDGE_OPENAI_BASE_URL,
+                api_key=os.environ.get("HEDGE_OPENAI_API_KEY") or os.environ["OPENAI_API_KEY"],
+                http_client=self._http_client,
+            )
+        logger.info(f"OpenAI connection pool started (max_connections={self.max_connections}, http2={self.http2})")
+
+    async def close(self):
+        if self._client is None:
+            return
+
+        await self._client.close()
+        self._client = None
+        self._hedge_client = None
+        self._http_client = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self.start()
+        return self._client
+
+    def get_llm_client(self, **kwargs) -> LlmClient:
+        """Returns a per-call LlmClient handle sharing the process-wide connection pool."""
+        kwargs.setdefault("answer_cache", self.answer_cache)
+        return LlmClient(client=self.client, hedge_client=self._hedge_client, **kwargs)
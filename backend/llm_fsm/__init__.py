@@ -1,3 +1,4 @@
 from .fsm import FSMRun, START_STATE, END_STATE, LLMStateMachine, ConversationalLLMStateMachine
 from .fsm_state import TransitionFuncWithConditions, LLMFSMState, ConversationFSMState
+from .context import RollingSummaryContext
 from .exceptions import FSMError, TransitionException, TransitionRequired, TransitionsNotAllowed, InvalidTransition
\ No newline at end of file
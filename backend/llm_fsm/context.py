@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+SUMMARY_INSTRUCTIONS = """Summarize the conversation between a customer (user) and an assistant below for the assistant to continue it. Keep every fact that may be needed later: names, phone numbers, emails, dates, times, services, prices, decisions and open questions. Be brief, use short sentences and don't add anything that wasn't said."""
+
+
+def build_summary_messages(previous_summary, messages):
+    """Builds the prompt to fold messages into the previous summary."""
+    conversation = "\n".join("%s: %s" % (message["role"], message["content"]) for message in messages)
+    if previous_summary:
+        conversation = "Summary of the earlier conversation: %s\n\n%s" % (previous_summary, conversation)
+
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": conversation},
+    ]
+
+
+class RollingSummaryContext:
+    """
+    Bounded chat context: the last messages are kept verbatim and the older ones are folded into a
+    rolling summary.
+
+    The summary is computed in a background task after a turn, never while building a prompt: until it's
+    ready, prompts use the previous summary and a few more verbatim messages.
+
+    Parameters:
+    - summarize: Async function receiving the previous summary (or None) and the messages to fold, returning the new summary.
+    - max_recent_messages (int): Number of messages kept verbatim.
+    - min_messages_to_summarize (int): Number of messages beyond max_recent_messages that triggers a summarization.
+    - summary (str): Summary of the first summarized_count messages, e.g. restored from a session.
+    - summarized_count (int): Number of leading messages already folded into the summary.
+    """
+
+    def __init__(self, summarize, max_recent_messages=20, min_messages_to_summarize=10, summary=None, summarized_count=0):
+        self.summarize = summarize
+        self.max_recent_messages = max_recent_messages
+        self.min_messages_to_summarize = min_messages_to_summarize
+        self.summary = summary
+        self.summarized_count = summarized_count
+        self._task = None
+
+    def get_summary_message(self):
+        if not self.summary:
+            return None
+        return {"role": "system", "content": "Summary of the earlier conversation: " + self.summary}
+
+    def get_messages(self, messages):
+        if len(messages) < self.summarized_count:
+            # The history was replaced, the summary doesn't apply anymore
+            self.reset()
+
+        context_messages = list(messages[self.summarized_count:])
+
+        summary_message = self.get_summary_message()
+        if summary_message is not None:
+            context_messages.insert(0, summary_message)
+        return context_messages
+
+    def maybe_schedule_summarization(self, messages):
+        if self._task is not None and not self._task.done():
+            return None
+
+        end = len(messages) - self.max_recent_messages
+        if end - self.summarized_count < self.min_messages_to_summarize:
+            return None
+
+        # Copied: the list may keep changing while the summary is computed
+        messages_to_summarize = list(messages[self.summarized_count:end])
+        self._task = asyncio.create_task(self._summarize(messages_to_summarize, self.summarized_count, end))
+        return self._task
+
+    async def _summarize(self, messages_to_summarize, start, end):
+        try:
+            summary = await self.summarize(self.summary, messages_to_summarize)
+        except Exception:
+            logger.exception("Error summarizing the chat history")
+            return
+
+        # Discard the summary if the context was reset in the meantime
+        if self.summarized_count == start:
+            self.summary = summary
+            self.summarized_count = end
+
+    def reset(self):
+        self.cancel()
+        self.summary = None
+        self.summarized_count = 0
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    def to_dict(self):
+        return {
+            "summary": self.summary,
+            "summarized_count": self.summarized_count,
+        }
@@ -280,7 +280,12 @@ class ConversationalLLMStateMachine(LLMStateMachine):
 
     llm_state_class = ConversationFSMState
 
+    def __init__(self, *args, max_chat_history_messages: int | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._max_chat_history_messages = max_chat_history_messages
+
     def define_state(self, *args, **kwargs):
+        kwargs.setdefault("max_chat_history_messages", self._max_chat_history_messages)
         return super().define_state(
             *args,
             chat_history_key=self.chat_history_key,
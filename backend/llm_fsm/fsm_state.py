@@ -1,4 +1,5 @@
 import json
+import time
 import logging
 from dataclasses import dataclass
 
@@ -6,6 +7,7 @@ from dataclasses import dataclass
 from litellm import acompletion
 
 from .exceptions import ValidationError
+from .context import RollingSummaryContext, build_summary_messages
 
 logger = logging.getLogger(__name__)
 
@@ -77,9 +79,10 @@ class TransitionFuncWithConditions:
 
 
 class LLMFSMState:
-    def __init__(self, state_key, system_message=None, user_input=None, chat_history=None, tools=None, output_var="result", llm_model=None, temperature=None, function_def_transition_selector=None, tool_prefix_varname=None, output_parser=None, validate_json_response=None, response_format=None, chat_completion_extra_kwargs=None, tools_key="tools", precomputed_values=None, data=None):
+    def __init__(self, state_key, system_message=None, user_input=None, chat_history=None, tools=None, output_var="result", llm_model=None, temperature=None, function_def_transition_selector=None, tool_prefix_varname=None, output_parser=None, validate_json_response=None, response_format=None, chat_completion_extra_kwargs=None, tools_key="tools", precomputed_values=None, data=None, usage_key="call_usage"):
         """
         - model (str): The LLM model to use for generating responses (default: "gpt-4o").
+        - usage_key (str): Key of the data holding the usage accounting of the call (e.g. a CallUsage), the usage of each step is recorded there per state.
         """
         self.state_key = state_key
         self._system_message = system_message
@@ -98,6 +101,7 @@ class LLMFSMState:
         self.tools_key = tools_key
         self.tools = tools
         self.precomputed_values = precomputed_values
+        self.usage_key = usage_key
 
         self.chat_completion_extra_kwargs = chat_completion_extra_kwargs
         self.response_format = response_format
@@ -194,18 +198,27 @@ class LLMFSMState:
         if self.chat_completion_extra_kwargs is not None:
             kw.update(self.chat_completion_extra_kwargs)
 
+        started_at = time.perf_counter()
         response = await acompletion(**kw)
 
-        logger.info(
-            f"tokens: {response.usage.total_tokens} total; {response.usage.completion_tokens} completion; {response.usage.prompt_tokens} prompt"
-        )
+        self.record_usage(response.usage, self.llm_model, self.state_key, time.perf_counter() - started_at)
 
         message = response.choices[0].message
         self.update_data(message)
 
-        next_state_key = self.function_def_transition_selector(self._readonly_data)
+        # The selectors registered with define_state are wrapped in coroutine functions
+        next_state_key = await self.function_def_transition_selector(self._readonly_data)
         return next_state_key
 
+    def record_usage(self, usage, model, state, seconds):
+        call_usage = self.data.get(self.usage_key) if self.usage_key else None
+        if call_usage is None:
+            logger.info(
+                f"tokens: {usage.total_tokens} total; {usage.completion_tokens} completion; {usage.prompt_tokens} prompt"
+            )
+        else:
+            call_usage.record_openai_usage(usage, model=model, state=state, seconds=seconds)
+
     def process_assistant_message_content(self, assistant_answer):
         response_format = self.response_format
 
@@ -285,7 +298,8 @@ class LLMFSMState:
             "tools_key": self.tools_key,
             "precomputed_values": self.precomputed_values,
             "chat_completion_extra_kwargs": self.chat_completion_extra_kwargs,
-            "response_format": self.response_format
+            "response_format": self.response_format,
+            "usage_key": self.usage_key,
         }
 
     def clone(self, **updated_kwargs):
@@ -309,7 +323,11 @@ class ManualResponse:
 
 
 class ConversationFSMState(LLMFSMState):
-    def __init__(self, user_input_key="user_input", assistant_answer_key="assistant_answer",  chat_history_key="chat_history", preprocess_input=None, restart_chat_history=False, goal=None, responses_per_user_intent=None, out_of_scope=None, information_to_be_gathered=None, confirmation=None, complete_string=None, **kwargs):
+    def __init__(self, user_input_key="user_input", assistant_answer_key="assistant_answer",  chat_history_key="chat_history", preprocess_input=None, restart_chat_history=False, goal=None, responses_per_user_intent=None, out_of_scope=None, information_to_be_gathered=None, confirmation=None, complete_string=None, max_chat_history_messages=None, summary_llm_model=None, chat_history_context_key="chat_history_context", **kwargs):
+        """
+        - max_chat_history_messages (int): If set, only the last messages of the chat history are sent verbatim, the older ones are folded into a rolling summary computed in the background.
+        - summary_llm_model (str): The LLM model used to summarize the chat history (default: llm_model).
+        """
         super().__init__(**kwargs)
         self.user_input_key = user_input_key
         self.assistant_answer_key = assistant_answer_key
@@ -322,6 +340,9 @@ class ConversationFSMState(LLMFSMState):
         self.information_to_be_gathered = information_to_be_gathered
         self.confirmation = confirmation
         self.complete_string = complete_string
+        self.max_chat_history_messages = max_chat_history_messages
+        self.summary_llm_model = summary_llm_model
+        self.chat_history_context_key = chat_history_context_key
 
     def preprocess_input(self, user_input):
         if self._preprocess_input is None:
@@ -356,6 +377,36 @@ class ConversationFSMState(LLMFSMState):
         self.append_chat_history_message("user", self.data[self.user_input_key])
         self.append_chat_history_message("assistant", self.data[self.assistant_answer_key])
 
+        chat_history_context = self.get_chat_history_context()
+        if chat_history_context is not None:
+            chat_history_context.maybe_schedule_summarization(self.data[self.chat_history_key])
+
+    def get_chat_history_context(self):
+        if self.max_chat_history_messages is None:
+            return None
+
+        chat_history_context = self.data.get(self.chat_history_context_key)
+        if chat_history_context is None:
+            chat_history_context = RollingSummaryContext(
+                self.summarize_chat_history,
+                max_recent_messages=self.max_chat_history_messages,
+                min_messages_to_summarize=max(self.max_chat_history_messages // 2, 2),
+            )
+            self.data[self.chat_history_context_key] = chat_history_context
+        return chat_history_context
+
+    async def summarize_chat_history(self, previous_summary, messages):
+        model = self.summary_llm_model or self.llm_model
+        started_at = time.perf_counter()
+        response = await acompletion(
+            model=model,
+            messages=build_summary_messages(previous_summary, messages),
+            temperature=0,
+        )
+        if response.usage is not None:
+            self.record_usage(response.usage, model, "summary", time.perf_counter() - started_at)
+        return response.choices[0].message.content
+
     def get_prompt_system_message(self):
         system_message = super().get_prompt_system_message()
         if system_message:
@@ -407,7 +458,10 @@ class ConversationFSMState(LLMFSMState):
         else:
             chat_history = self.data.get(self.chat_history_key)
             if chat_history:
-                return chat_history
+                chat_history_context = self.get_chat_history_context()
+                if chat_history_context is None:
+                    return chat_history
+                return chat_history_context.get_messages(chat_history)
             else:
                 return []
 
@@ -423,5 +477,8 @@ class ConversationFSMState(LLMFSMState):
         kwargs["information_to_be_gathered"] = self.information_to_be_gathered
         kwargs["confirmation"] = self.confirmation
         kwargs["complete_string"] = self.complete_string
+        kwargs["max_chat_history_messages"] = self.max_chat_history_messages
+        kwargs["summary_llm_model"] = self.summary_llm_model
+        kwargs["chat_history_context_key"] = self.chat_history_context_key
 
         return kwargs
\ No newline at end of file
@@ -0,0 +1,230 @@
+import time
+import bisect
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    labels = ",".join('%s="%s"' % (name, _escape_label_value(value)) for name, value in zip(labelnames, labelvalues))
+    if extra:
+        labels = labels + "," + extra if labels else extra
+    return "{%s}" % labels if labels else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = []
+        for labelvalues, value in self._values.items():
+            lines.append("%s%s %s" % (self.name, _format_labels(self.labelnames, labelvalues), _format_value(value)))
+        return lines
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per bucket counts (not cumulative, last one is +Inf), sum, count]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = []
+        for labelvalues, (bucket_counts, total, count) in self._series.items():
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative_count += bucket_count
+                le_label = 'le="%s"' % _format_value(upper_bound)
+                lines.append("%s_bucket%s %d" % (self.name, _format_labels(self.labelnames, labelvalues, le_label), cumulative_count))
+
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append("%s_sum%s %s" % (self.name, labels, _format_value(total)))
+            lines.append("%s_count%s %d" % (self.name, labels, count))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        """Renders all the metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type_name))
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+RESPONSE_LABELS = ("model", "state")
+
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from the response request to the first frame sent to Retell.",
+    RESPONSE_LABELS,
+)
+RESPONSE_DURATION = REGISTRY.histogram(
+    "llm_response_duration_seconds",
+    "Time from the response request to the content_complete frame.",
+    RESPONSE_LABELS,
+)
+RESPONSE_TOKENS = REGISTRY.histogram(
+    "llm_response_tokens",
+    "Number of streamed deltas received from the LLM per response.",
+    RESPONSE_LABELS,
+    buckets=COUNT_BUCKETS,
+)
+RESPONSE_FRAMES = REGISTRY.histogram(
+    "llm_response_frames",
+    "Number of frames sent to Retell per response.",
+    RESPONSE_LABELS,
+    buckets=COUNT_BUCKETS,
+)
+RESPONSES_CANCELLED = REGISTRY.counter(
+    "llm_responses_cancelled_total",
+    "Responses cancelled before completion because a newer response_id arrived or the call ended.",
+    RESPONSE_LABELS,
+)
+PROMPT_TOKENS = REGISTRY.counter(
+    "llm_prompt_tokens_total",
+    "Prompt tokens of the LLM requests.",
+    ("model",),
+)
+CACHED_PROMPT_TOKENS = REGISTRY.counter(
+    "llm_cached_prompt_tokens_total",
+    "Prompt tokens served from the provider prompt cache.",
+    ("model",),
+)
+COMPLETION_TOKENS = REGISTRY.counter(
+    "llm_completion_tokens_total",
+    "Completion tokens of the LLM requests.",
+    ("model",),
+)
+TOOL_CALL_DURATION = REGISTRY.histogram(
+    "llm_tool_call_duration_seconds",
+    "Time spent executing a tool call.",
+    ("tool",),
+)
+
+
+class ResponseMetrics:
+    """
+    Collects the instrumentation of a single response_id and records it in the histograms
+    when the response completes or is cancelled.
+
+    The LLM client fills in model and state and counts the tokens; the websocket handler
+    counts the frames it sends.
+    """
+
+    def __init__(self, response_id, model="", state="default"):
+        self.response_id = response_id
+        self.model = model
+        self.state = state
+        self.started_at = time.perf_counter()
+        self.time_to_first_token = None
+        self.tokens = 0
+        self.frames = 0
+        self.tool_call_seconds = 0.0
+        self.finished = False
+
+    @property
+    def labels(self):
+        return {"model": self.model, "state": self.state}
+
+    def on_token(self):
+        self.tokens += 1
+
+    def on_frame(self):
+        if self.frames == 0:
+            self.time_to_first_token = time.perf_counter() - self.started_at
+            TIME_TO_FIRST_TOKEN.observe(self.time_to_first_token, **self.labels)
+        self.frames += 1
+
+    def on_tool_call(self, tool_name, seconds):
+        self.tool_call_seconds += seconds
+        TOOL_CALL_DURATION.observe(seconds, tool=tool_name)
+
+    def on_usage(self, usage, model=None):
+        """Counts the tokens of a request, under model if it's not the model of the response."""
+        model = model or self.model
+        PROMPT_TOKENS.inc(usage.prompt_tokens, model=model)
+        CACHED_PROMPT_TOKENS.inc(usage.cached_tokens, model=model)
+        COMPLETION_TOKENS.inc(usage.completion_tokens, model=model)
+
+    def on_complete(self):
+        if self.finished:
+            return
+        self.finished = True
+
+        labels = self.labels
+        RESPONSE_DURATION.observe(time.perf_counter() - self.started_at, **labels)
+        RESPONSE_TOKENS.observe(self.tokens, **labels)
+        RESPONSE_FRAMES.observe(self.frames, **labels)
+
+    def on_cancel(self):
+        if self.finished:
+            return
+        self.finished = True
+
+        RESPONSES_CANCELLED.inc(**self.labels)
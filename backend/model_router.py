@@ -0,0 +1,167 @@
+import os
+import re
+import asyncio
+import logging
+
+from .metrics import REGISTRY
+
+
+logger = logging.getLogger(__name__)
+
+
+FAST_MODEL = os.environ.get("FAST_MODEL", "gpt-4o-mini")
+SMART_MODEL = os.environ.get("SMART_MODEL", "gpt-4-turbo-preview")
+# Utterances with at least this many words are routed to the smart model
+SMART_MODEL_MIN_WORDS = int(os.environ.get("SMART_MODEL_MIN_WORDS", 25))
+# Model of the hedged request, by default the same model as the first request
+HEDGE_MODEL = os.environ.get("HEDGE_MODEL", "")
+# A hedged request is sent if the first request hasn't streamed anything after this many milliseconds, 0 disables it.
+# Only used with a different HEDGE_MODEL or hedge endpoint: a duplicate request to a slow endpoint rarely helps.
+HEDGE_DELAY_MS = float(os.environ.get("HEDGE_DELAY_MS", 0))
+
+HEDGED_REQUESTS = REGISTRY.counter("llm_hedged_requests_total", "Hedged LLM requests sent because the first one was too slow.", ("model",))
+HEDGE_WINS = REGISTRY.counter("llm_hedge_wins_total", "Hedged LLM requests that streamed before the first one.", ("model",))
+
+# Booking logic needs the smart model: dates, times, contact details and tool calls
+BOOKING_KEYWORDS = frozenset([
+    "book", "booking", "appointment", "schedule", "reschedule", "cancel", "available", "availability",
+    "slot", "slots", "today", "tomorrow", "monday", "tuesday", "wednesday", "thursday", "friday",
+    "saturday", "sunday", "week", "morning", "afternoon", "evening", "email", "phone", "name",
+])
+
+_word_re = re.compile(r"\w+", re.UNICODE)
+
+
+class ModelRouter:
+    """
+    Picks the model of each turn: the fast model for short, simple turns and the smart model for the
+    booking logic, and the model of the hedged request.
+
+    Parameters:
+    - fast_model (str): Model of the simple turns and the reminders.
+    - smart_model (str): Model of the booking turns, the long utterances and the tool follow-ups.
+    - hedge_model (str): Model of the hedged request, empty to use the same model as the first request.
+    - hedge_delay (float): Seconds without a first chunk before the hedged request is sent, 0 disables it.
+    - smart_model_min_words (int): Utterances with at least this many words use the smart model.
+    """
+
+    def __init__(self, fast_model=FAST_MODEL, smart_model=SMART_MODEL, hedge_model=HEDGE_MODEL, hedge_delay=HEDGE_DELAY_MS / 1000, smart_model_min_words=SMART_MODEL_MIN_WORDS):
+        self.fast_model = fast_model
+        self.smart_model = smart_model
+        self.hedge_model = hedge_model
+        self.hedge_delay = hedge_delay
+        self.smart_model_min_words = smart_model_min_words
+
+    def route(self, request, tool_round=0):
+        if tool_round > 0:
+            # Answering with the results of a tool call (availability, booking)
+            return self.smart_model
+
+        if request.interaction_type != "response_required":
+            return self.fast_model
+
+        if not request.transcript or request.transcript[-1].role != "user":
+            return self.fast_model
+
+        words = _word_re.findall(request.transcript[-1].content.lower())
+        if len(words) >= self.smart_model_min_words:
+            return self.smart_model
+        if any(word in BOOKING_KEYWORDS or word.isdigit() for word in words):
+            return self.smart_model
+        return self.fast_model
+
+    def get_hedge_model(self, model):
+        return self.hedge_model or model
+
+
+class StartedStream:
+    """Completion stream whose first chunk has already been received."""
+
+    def __init__(self, model, stream, iterator, first_chunk):
+        self.model = model
+        self.stream = stream
+        self.iterator = iterator
+        self.first_chunk = first_chunk
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        if self.first_chunk is not None:
+            yield self.first_chunk
+        async for chunk in self.iterator:
+            yield chunk
+
+    async def close(self):
+        await self.stream.close()
+
+
+async def _start_stream(model, create_stream):
+    stream = await create_stream()
+    iterator = aiter(stream)
+    try:
+        first_chunk = await anext(iterator)
+    except StopAsyncIteration:
+        first_chunk = None
+    except BaseException:
+        await stream.close()
+        raise
+    return StartedStream(model, stream, iterator, first_chunk)
+
+
+async def start_hedged_stream(model, create_stream, hedge_model=None, create_hedge_stream=None, hedge_delay=0):
+    """
+    Starts the completion stream of model, and the one of hedge_model if the first chunk hasn't arrived after
+    hedge_delay seconds or the first request failed. Returns the StartedStream of the first one to stream, the
+    other one is cancelled.
+
+    Parameters:
+    - model (str): Model of the first request.
+    - create_stream: Function returning the awaitable completion stream of the first request.
+    - hedge_model (str): Model of the hedged request.
+    - create_hedge_stream: Function returning the awaitable completion stream of the hedged request, None disables hedging.
+    - hedge_delay (float): Seconds to wait for the first request before sending the hedged one.
+    """
+    if hedge_delay <= 0:
+        create_hedge_stream = None
+
+    pending = {asyncio.create_task(_start_stream(model, create_stream))}
+    hedge = None
+    error = None
+    try:
+        while True:
+            timeout = hedge_delay if create_hedge_stream is not None and hedge is None else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            started_streams = []
+            for task in done:
+                if task.exception() is None:
+                    started_streams.append(task)
+                else:
+                    error = task.exception()
+                    logger.warning(f"LLM request failed: {error!r}")
+
+            if started_streams:
+                # Both streamed at once: keep the first request, close the other stream
+                started_streams.sort(key=lambda task: task is hedge)
+                for task in started_streams[1:]:
+                    await task.result().close()
+
+                if started_streams[0] is hedge:
+                    HEDGE_WINS.inc(model=hedge_model)
+                return started_streams[0].result()
+
+            if create_hedge_stream is not None and hedge is None:
+                HEDGED_REQUESTS.inc(model=hedge_model)
+                if error is None:
+                    logger.info(f"No first chunk from {model} after {hedge_delay}s, hedging with {hedge_model}")
+                else:
+                    logger.info(f"Request to {model} failed, retrying with {hedge_model}")
+                hedge = asyncio.create_task(_start_stream(hedge_model, create_hedge_stream))
+                pending.add(hedge)
+            elif not pending:
+                raise error
+    finally:
+        # Abandoned requests are cancelled, which closes their streams
+        for task in pending:
+            task.cancel()
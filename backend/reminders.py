@@ -0,0 +1,89 @@
+import os
+import re
+import logging
+
+from .model_router import BOOKING_KEYWORDS
+
+
+logger = logging.getLogger(__name__)
+
+
+# Reminders served from the templates before falling back to the LLM, which can rephrase or end the call
+REMINDER_LLM_AFTER = int(os.environ.get("REMINDER_LLM_AFTER", 2))
+
+REMINDER_TEMPLATES = {
+    "greeting": [
+        "Are you still there?",
+        "Hello? I'm here whenever you're ready.",
+        "Take your time, how can I help you today?",
+    ],
+    "booking": [
+        "Are you still there? We can finish your booking whenever you're ready.",
+        "Take your time, I'm still here to complete your appointment.",
+        "Hello? Just let me know when you're ready to continue with the booking.",
+    ],
+    "conversation": [
+        "Are you still there?",
+        "Hello? Is there anything else I can help you with?",
+        "I'm still here if you have any other questions.",
+    ],
+}
+
+_word_re = re.compile(r"\w+", re.UNICODE)
+
+
+class ReminderEngine:
+    """
+    Serves the reminder_required turns from precomputed lines instead of a completion.
+
+    The lines depend on the state of the conversation and are not repeated while the user is silent.
+    After llm_after consecutive reminders, get_reminder returns None and the LLM takes over.
+
+    Parameters:
+    - templates (dict): Reminder lines per conversation state: greeting, booking and conversation.
+    - llm_after (int): Consecutive reminders served from the templates, 0 always uses the LLM.
+    """
+
+    def __init__(self, templates=REMINDER_TEMPLATES, llm_after=REMINDER_LLM_AFTER):
+        self.templates = templates
+        self.llm_after = llm_after
+
+    @staticmethod
+    def get_silent_utterances(transcript):
+        """Returns the agent utterances since the user last spoke."""
+        i = len(transcript)
+        while i > 0 and transcript[i - 1].role != "user":
+            i -= 1
+        return transcript[i:]
+
+    def get_state(self, transcript, silent_utterances):
+        if len(silent_utterances) == len(transcript):
+            return "greeting"
+
+        # The agent was asking for the details of an appointment when the user went silent
+        words = _word_re.findall(silent_utterances[0].content.lower()) if silent_utterances else []
+        if any(word in BOOKING_KEYWORDS for word in words):
+            return "booking"
+        return "conversation"
+
+    def get_reminder(self, transcript):
+        """Returns the reminder line, or None if the LLM should answer."""
+        silent_utterances = self.get_silent_utterances(transcript)
+        # The first silent utterance is the answer the user didn't reply to, the others are reminders
+        reminder_count = max(len(silent_utterances) - 1, 0)
+        if reminder_count >= self.llm_after:
+            return None
+
+        state = self.get_state(transcript, silent_utterances)
+        lines = self.templates.get(state) or self.templates.get("conversation")
+        if not lines:
+            return None
+
+        said = set(utterance.content.strip() for utterance in silent_utterances)
+        # Rotated by the length of the call so consecutive calls don't all start with the same line
+        start = len(transcript) % len(lines)
+        for i in range(len(lines)):
+            line = lines[(start + i) % len(lines)]
+            if line not in said:
+                return line
+        return None
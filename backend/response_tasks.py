@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseTaskRegistry:
+    """
+    Keeps track of the tasks generating responses for a single call.
+
+    Only one response is alive at a time: starting the response for a newer response_id
+    cancels the in-flight one, which also closes its upstream LLM stream.
+    """
+
+    def __init__(self, call_id):
+        self.call_id = call_id
+        self.response_id = None
+        self._task = None
+        self._background_tasks = set()
+
+    @property
+    def current_task(self):
+        return self._task
+
+    def start_response(self, response_id, coro):
+        self.cancel_response()
+
+        self.response_id = response_id
+        self._task = asyncio.create_task(coro)
+        self._task.add_done_callback(self._log_task_exception)
+        return self._task
+
+    def cancel_response(self):
+        task = self._task
+        if task is not None and not task.done():
+            logger.info(f"Cancelling response {self.response_id} for {self.call_id}")
+            task.cancel()
+        self._task = None
+
+    def spawn(self, coro):
+        """Runs a task that doesn't produce a response but must not outlive the call."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        task.add_done_callback(self._log_task_exception)
+        return task
+
+    async def close(self):
+        tasks = list(self._background_tasks)
+        if self._task is not None:
+            tasks.append(self._task)
+        self._task = None
+
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _log_task_exception(self, task):
+        if task.cancelled():
+            return
+
+        exc = task.exception()
+        if exc is not None:
+            logger.error(f"Error in task for {self.call_id}: {exc}", exc_info=exc)
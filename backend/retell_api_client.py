@@ -0,0 +1,98 @@
+import os
+import random
+import asyncio
+import logging
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+
+RETELL_MAX_CONNECTIONS = int(os.environ.get("RETELL_MAX_CONNECTIONS", 50))
+RETELL_MAX_CONCURRENT_REQUESTS = int(os.environ.get("RETELL_MAX_CONCURRENT_REQUESTS", 50))
+RETELL_CONNECT_TIMEOUT = float(os.environ.get("RETELL_CONNECT_TIMEOUT", 3.0))
+RETELL_READ_TIMEOUT = float(os.environ.get("RETELL_READ_TIMEOUT", 10.0))
+RETELL_MAX_RETRIES = int(os.environ.get("RETELL_MAX_RETRIES", 3))
+
+RETRYABLE_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class RetellApiClient:
+    """
+    Long-lived HTTP client for the Retell REST API, owned by the app lifespan.
+
+    Connections are kept alive in a pool, the number of in-flight requests is limited by a
+    semaphore, and requests failing with a connection error or a 5xx status are retried up to
+    max_retries times with exponential backoff and full jitter.
+
+    Parameters:
+    - api_key (str): Retell API key.
+    - max_connections (int): Maximum number of connections of the pool.
+    - max_concurrent_requests (int): Maximum number of requests in flight, the rest wait.
+    - connect_timeout (float): Seconds to wait for a connection.
+    - read_timeout (float): Seconds to wait for the response.
+    - max_retries (int): Maximum number of retries of a failed request.
+    - backoff (float): Base delay in seconds of the exponential backoff.
+    """
+
+    def __init__(self, api_key, max_connections=RETELL_MAX_CONNECTIONS, max_concurrent_requests=RETELL_MAX_CONCURRENT_REQUESTS, connect_timeout=RETELL_CONNECT_TIMEOUT, read_timeout=RETELL_READ_TIMEOUT, max_retries=RETELL_MAX_RETRIES, backoff=0.2):
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self._client = None
+
+    def start(self):
+        if self._client is not None:
+            return
+
+        self._client = httpx.AsyncClient(
+            headers={"Authorization": "Bearer %s" % self.api_key},
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self.start()
+        return self._client
+
+    def get_retry_delay(self, attempt):
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    async def request(self, method, url, **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    response = await self.client.request(method, url, **kwargs)
+            except RETRYABLE_EXCEPTIONS as exc:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Retrying {method} {url} after connection error: {exc}")
+            else:
+                if response.status_code < 500 or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+                logger.warning(f"Retrying {method} {url} after status {response.status_code}")
+
+            # Sleep outside of the semaphore, so waiting retries don't hold a slot
+            await asyncio.sleep(self.get_retry_delay(attempt))
+            attempt += 1
+
+    async def post_json(self, url, payload) -> dict:
+        response = await self.request("POST", url, json=payload)
+        return response.json()
@@ -0,0 +1,225 @@
+import logging
+import datetime
+
+import numpy as np
+
+from .availability import SLOT_MINUTES, FIXED_SLOT_MINUTES, SCHEDULE_HORIZON_DAYS, OPENING_HOURS, parse_time, format_time
+
+
+logger = logging.getLogger(__name__)
+
+
+MINUTES_PER_DAY = 24 * 60
+
+# service -> duration in minutes
+SERVICES = {
+    "haircut": 45,
+    "coloring": 120,
+    "highlights": 150,
+    "extensions": 180,
+    "treatment": 60,
+    "make-up": 45,
+    "wedding package": 180,
+}
+
+# stylist -> services
+STYLISTS = {
+    "John Doe": ["coloring", "highlights", "treatment"],
+    "Jane Smith": ["haircut", "extensions", "treatment", "make-up", "wedding package"],
+}
+
+
+def find_earliest_window(windows, starts, earliest_minute=0):
+    """
+    Returns the (day, start, stylist) indexes of the first free window of a (stylists, days, start times) array,
+    not before earliest_minute on the first day, or None.
+    """
+    windows = windows.copy()
+    windows[:, 0, starts < earliest_minute] = False
+
+    any_stylist = windows.any(axis=0)
+    first = int(np.argmax(any_stylist))
+    day, start = divmod(first, any_stylist.shape[1])
+    if not any_stylist[day, start]:
+        return None
+    return day, start, int(np.argmax(windows[:, day, start]))
+
+
+def list_windows(day_windows, starts):
+    """Returns the (start minute, stylist indexes) of the free windows of a (stylists, start times) array."""
+    return [(int(starts[start]), np.flatnonzero(day_windows[:, start])) for start in np.flatnonzero(day_windows.any(axis=0))]
+
+
+class SalonScheduler:
+    """
+    Calendars of the stylists over the booking horizon, at minute granularity, for services of different
+    durations.
+
+    The free minutes are a (stylists, days, minutes) boolean array, with its cumulative sum along the
+    minutes kept up to date per stylist and day on every booking. The free windows of a duration, for all the
+    stylists, days and start times at once, are then a single vectorized subtraction of the cumulative sums:
+    a window is free if all its minutes are.
+
+    Parameters:
+    - start_date (datetime.date): First day of the horizon, today by default.
+    - horizon_days (int): Number of days of the horizon.
+    - stylists (dict): Services of each stylist.
+    - services (dict): Duration in minutes of each service.
+    - opening_hours (dict): Opening and closing time of each weekday.
+    - slot_minutes (int): Granularity of the start times of the appointments.
+    """
+
+    def __init__(self, start_date=None, horizon_days=SCHEDULE_HORIZON_DAYS, stylists=STYLISTS, services=SERVICES, opening_hours=OPENING_HOURS, slot_minutes=SLOT_MINUTES):
+        self.start_date = start_date or datetime.date.today()
+        self.horizon_days = horizon_days
+        self.stylists = list(stylists)
+        self.services = services
+        self.opening_hours = {weekday: (parse_time(opening), parse_time(closing)) for weekday, (opening, closing) in opening_hours.items()}
+        self.slot_minutes = slot_minutes
+
+        self._stylist_indexes = {stylist: i for i, stylist in enumerate(self.stylists)}
+        # service -> mask of the stylists offering it
+        self._service_stylists = {
+            service: np.array([service in stylists[stylist] for stylist in self.stylists])
+            for service in services
+        }
+        self._starts = np.arange(0, MINUTES_PER_DAY, slot_minutes)
+
+        self.free = np.zeros((len(self.stylists), horizon_days, MINUTES_PER_DAY), dtype=bool)
+        # cumsum[s, d, m] is the number of free minutes before minute m
+        self._cumsum = np.zeros((len(self.stylists), horizon_days, MINUTES_PER_DAY + 1), dtype=np.int16)
+        self._open_days(0, horizon_days)
+
+    def _open_days(self, first_day, last_day):
+        self.free[:, first_day:last_day] = False
+        for day in range(first_day, last_day):
+            opening_hours = self.opening_hours.get((self.start_date + datetime.timedelta(days=day)).weekday())
+            if opening_hours is not None:
+                self.free[:, day, opening_hours[0]:opening_hours[1]] = True
+        np.cumsum(self.free[:, first_day:last_day], axis=-1, out=self._cumsum[:, first_day:last_day, 1:])
+
+    def advance_to(self, today):
+        """Moves the horizon to start today: the past days are dropped, the new ones are open."""
+        shift = (today - self.start_date).days
+        if shift <= 0:
+            return
+
+        self.start_date = today
+        if shift >= self.horizon_days:
+            self._open_days(0, self.horizon_days)
+            return
+
+        self.free[:, :-shift] = self.free[:, shift:]
+        self._cumsum[:, :-shift] = self._cumsum[:, shift:]
+        self._open_days(self.horizon_days - shift, self.horizon_days)
+
+    def get_date(self, day):
+        return (self.start_date + datetime.timedelta(days=int(day))).isoformat()
+
+    def get_day(self, date):
+        """Index of the "YYYY-MM-DD" date in the horizon, or None if it's outside of it."""
+        day = (datetime.date.fromisoformat(date) - self.start_date).days
+        if 0 <= day < self.horizon_days:
+            return day
+        return None
+
+    def get_stylists(self, service):
+        return [stylist for stylist, offered in zip(self.stylists, self._service_stylists[service]) if offered]
+
+    def get_windows(self, service, first_day, last_day, stylist=None):
+        """Free windows of the service duration: (stylists, days, start times) boolean array and the start times."""
+        duration = self.services[service]
+        starts = self._starts[self._starts + duration <= MINUTES_PER_DAY]
+        cumsum = self._cumsum[:, first_day:last_day]
+        windows = (cumsum[:, :, starts + duration] - cumsum[:, :, starts]) == duration
+
+        stylists = self._service_stylists[service]
+        if stylist is not None:
+            stylists = stylists & (np.arange(len(self.stylists)) == self._stylist_indexes[stylist])
+        windows &= stylists[:, None, None]
+        return windows, starts
+
+    def find_earliest_slot(self, service, date=None, time_string="00:00", stylist=None):
+        """Returns the first (date, time, stylist) at or after date and time when the service can be booked, or None."""
+        first_day = 0 if date is None else self.get_day(date)
+        if first_day is None:
+            return None
+
+        windows, starts = self.get_windows(service, first_day, self.horizon_days, stylist)
+        window = find_earliest_window(windows, starts, parse_time(time_string))
+        if window is None:
+            return None
+
+        day, start, stylist_index = window
+        return self.get_date(first_day + day), format_time(int(starts[start])), self.stylists[stylist_index]
+
+    def find_slots(self, service, date, stylist=None):
+        """Returns the start times of the service on date, with the stylists available at each of them."""
+        day = self.get_day(date)
+        if day is None:
+            return []
+
+        windows, starts = self.get_windows(service, day, day + 1, stylist)
+        return [
+            (format_time(start), [self.stylists[i] for i in stylist_indexes])
+            for start, stylist_indexes in list_windows(windows[:, 0], starts)
+        ]
+
+    def get_fixed_slots(self, date, every=FIXED_SLOT_MINUTES):
+        """Start times of the fixed slots of date (every minutes from the opening) when a stylist is free for every minutes."""
+        day = self.get_day(date)
+        opening_hours = self.opening_hours.get(datetime.date.fromisoformat(date).weekday())
+        if day is None or opening_hours is None:
+            return []
+
+        starts = np.arange(opening_hours[0], opening_hours[1] - every + 1, every)
+        cumsum = self._cumsum[:, day]
+        free = (cumsum[:, starts + every] - cumsum[:, starts]) == every
+        return [format_time(int(start)) for start in starts[free.any(axis=0)]]
+
+    def count_slots_per_day(self, service, first_date=None, last_date=None):
+        """Returns the number of start times of the service per day (any stylist), as an array over the days."""
+        first_day = 0 if first_date is None else self.get_day(first_date)
+        last_day = self.horizon_days if last_date is None else self.get_day(last_date) + 1
+        windows, _ = self.get_windows(service, first_day, last_day)
+        return windows.any(axis=0).sum(axis=1)
+
+    def is_free(self, stylist, date, time_string, duration):
+        day = self.get_day(date)
+        if day is None:
+            return False
+
+        start = parse_time(time_string)
+        if start + duration > MINUTES_PER_DAY:
+            return False
+        cumsum = self._cumsum[self._stylist_indexes[stylist], day]
+        return int(cumsum[start + duration] - cumsum[start]) == duration
+
+    def _set(self, stylist, date, time_string, duration, free):
+        stylist_index = self._stylist_indexes[stylist]
+        day = self.get_day(date)
+        start = parse_time(time_string)
+        self.free[stylist_index, day, start:start + duration] = free
+        # Only the row of the stylist and day changes
+        np.cumsum(self.free[stylist_index, day], out=self._cumsum[stylist_index, day, 1:])
+
+    def book(self, stylist, date, time_string, duration):
+        """Takes the window of the stylist, returns False if it isn't free."""
+        if not self.is_free(stylist, date, time_string, duration):
+            return False
+        self._set(stylist, date, time_string, duration, False)
+        return True
+
+    def release(self, stylist, date, time_string, duration):
+        """Frees the window of the stylist, e.g. when an appointment is cancelled. Closed hours stay closed."""
+        day = self.get_day(date)
+        if day is None:
+            return
+
+        opening_hours = self.opening_hours.get(datetime.date.fromisoformat(date).weekday())
+        if opening_hours is None:
+            return
+        start = max(parse_time(time_string), opening_hours[0])
+        end = min(parse_time(time_string) + duration, opening_hours[1])
+        if start < end:
+            self._set(stylist, date, format_time(start), end - start, True)
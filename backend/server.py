@@ -2,13 +2,14 @@ import json
 import os
 import asyncio
 import logging
+from contextlib import aclosing, asynccontextmanager
 
 import httpx
 
 from dotenv import load_dotenv
 
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
 from pydantic import BaseModel
 
@@ -19,8 +20,21 @@ from retell import Retell
 from .custom_types import (
     ConfigResponse,
     ResponseRequiredRequest,
+    Utterance,
 )
-from .llm import LlmClient  # or use .llm_with_func_calling
+from .llm_client_manager import LlmClientManager
+from .response_tasks import ResponseTaskRegistry
+from .frame_encoder import ResponseFrameEncoder, encode_model, encode_ping_pong
+from .token_coalescer import TokenCoalescer
+from .session_store import create_session_store
+from .webhook_events import WebhookEventQueue, WebhookEventStore
+from .retell_api_client import RetellApiClient
+from .call_recorder import create_call_recorder
+from .usage import USAGE_REPORT, CallUsage
+from .speculative import SpeculativeDrafter
+from .answer_cache import ANSWER_CACHE_SIZE, AnswerCache
+from .llm import PROMPT_PREFIX_FINGERPRINT, appointment_book
+from .metrics import REGISTRY as METRICS_REGISTRY, PROMETHEUS_CONTENT_TYPE, ResponseMetrics
 
 
 CREATE_WEB_CALL_RETELLAI_ENDPOINT = 'https://api.retellai.com/v2/create-web-call'
@@ -29,7 +43,60 @@ load_dotenv(override=True)
 RETELL_API_KEY = os.environ["RETELL_API_KEY"]
 
 
-app = FastAPI()
+llm_client_manager = LlmClientManager(
+    answer_cache=AnswerCache(PROMPT_PREFIX_FINGERPRINT) if ANSWER_CACHE_SIZE > 0 else None,
+)
+retell_api_client = RetellApiClient(RETELL_API_KEY)
+token_coalescer = TokenCoalescer()
+session_store = create_session_store()
+
+
+async def on_call_started(event):
+    logger.info("Call started event %s", event.call_id)
+
+
+async def on_call_ended(event):
+    logger.info("Call ended event %s", event.call_id)
+    # The call can't reconnect anymore, and its websocket can't save the session again when it closes
+    await session_store.delete(event.call_id)
+    # The slots held during the call and not booked are offered again
+    await appointment_book.release_holds(event.call_id)
+
+
+async def on_call_analyzed(event):
+    logger.info("Call analyzed event %s", event.call_id)
+
+
+webhook_event_queue = WebhookEventQueue(
+    WebhookEventStore(),
+    handlers={
+        "call_started": on_call_started,
+        "call_ended": on_call_ended,
+        "call_analyzed": on_call_analyzed,
+    },
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    llm_client_manager.start()
+    logger.info(f"Prompt prefix fingerprint: {PROMPT_PREFIX_FINGERPRINT}")
+    retell_api_client.start()
+    webhook_event_queue.start()
+    session_store.start()
+    await appointment_book.load()
+    appointment_book.start()
+    try:
+        yield
+    finally:
+        await appointment_book.close()
+        await webhook_event_queue.close()
+        await retell_api_client.close()
+        await llm_client_manager.close()
+        await session_store.close()
+
+
+app = FastAPI(lifespan=lifespan)
 retell = Retell(api_key=RETELL_API_KEY)
 
 logger = logging.getLogger(__name__)
@@ -46,30 +113,21 @@ class WebCallRequest(BaseModel):
 @app.post("/webhook")
 async def handle_webhook(request: Request):
     try:
-        post_data = await request.json()
+        # The signature is computed over the body exactly as sent by Retell
+        raw_body = await request.body()
         valid_signature = retell.verify(
-            json.dumps(post_data, separators=(",", ":"), ensure_ascii=False),
+            raw_body.decode("utf-8"),
             api_key=RETELL_API_KEY,
             signature=str(request.headers.get("X-Retell-Signature")),
         )
         if not valid_signature:
-            logger.warning(
-                "Received Unauthorized",
-                post_data["event"],
-                post_data["data"]["call_id"],
-            )
+            logger.warning("Received Unauthorized webhook event")
             return JSONResponse(status_code=401, content={"message": "Unauthorized"})
 
-        event_type = post_data["event"]
-
-        if event_type == "call_started":
-            logger.info("Call started event %s", post_data["data"]["call_id"])
-        elif event_type == "call_ended":
-            logger.info("Call ended event %s", post_data["data"]["call_id"])
-        elif event_type == "call_analyzed":
-            logger.info("Call analyzed event %s", post_data["data"]["call_id"])
-        else:
-            logger.info("Unknown event", event_type)
+        # Events are parsed, handled and stored in batches by webhook_event_queue
+        if not webhook_event_queue.put_raw(raw_body):
+            # Retell retries the event, e.g. a call_ended that must release the session and the holds of the call
+            return JSONResponse(status_code=503, content={"message": "Event queue full, retry later"}, headers={"Retry-After": "1"})
         return JSONResponse(status_code=200, content={"received": True})
     except Exception as err:
         logger.error(f"Error in webhook: {err}")
@@ -93,30 +151,69 @@ async def create_web_call(web_call_request: WebCallRequest):
         payload["retell_llm_dynamic_variables"] = web_call_request.retell_llm_dynamic_variables
 
     try:
-        response = await httpx.post(
-            CREATE_WEB_CALL_RETELLAI_ENDPOINT,
-            data=payload,
-            headers={
-                'Authorization': 'Bearer %s' % RETELL_API_KEY,
-                'Content-Type': 'application/json'
-            }
-        )
+        response_data = await retell_api_client.post_json(CREATE_WEB_CALL_RETELLAI_ENDPOINT, payload)
     except httpx.HTTPError as exc:
         logger.exception('Error creating web call');
         raise HTTPException(status_code=500, detail={ "error": 'Failed to create web call' });
     else:
-        data = response.json()["data"]
+        data = response_data["data"]
         return JSONResponse(status_code=201, content=data)
 
 
+@app.get("/metrics")
+async def metrics_handler():
+    return Response(content=METRICS_REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+# Token usage of all the calls handled by this worker, per state and per model, the most expensive first
+@app.get("/usage")
+async def usage_handler():
+    return JSONResponse(USAGE_REPORT.to_dict())
+
+
+# Token usage of a call in progress, per state, per model and per turn
+@app.get("/usage/{call_id}")
+async def call_usage_handler(call_id: str):
+    session = await session_store.get(call_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Call not found")
+    return JSONResponse(CallUsage.from_dict(session.data.get("usage"), call_id=call_id).to_report_dict())
+
+
 # Start a websocket server to exchange text input and output with Retell server. Retell server
 # will send over transcriptions and other information. This server here will be responsible for
 # generating responses with LLM and send back to Retell server.
 @app.websocket("/llm-websocket/{call_id}")
 async def websocket_handler(websocket: WebSocket, call_id: str):
+    response_tasks = ResponseTaskRegistry(call_id)
+    recorder = create_call_recorder(call_id)
+    session = None
+    llm_client = None
+    speculative_drafter = None
+
+    async def save_session():
+        if llm_client is not None:
+            session.data["usage"] = llm_client.call_usage.to_dict()
+            session.data["context"] = llm_client.context.to_dict()
+        await session_store.save(session)
+
+    async def send_frame(frame: str):
+        await websocket.send_text(frame)
+        if recorder is not None:
+            recorder.record_outbound(frame)
+
     try:
         await websocket.accept()
-        llm_client = LlmClient()
+
+        # With auto_reconnect, Retell may reconnect the call to any worker: the state of the call
+        # lives in the session store, not in this coroutine.
+        session, is_new_session = await session_store.get_or_create(call_id)
+        llm_client = llm_client_manager.get_llm_client(
+            call_id=call_id,
+            call_usage=CallUsage.from_dict(session.data.get("usage"), call_id=call_id),
+            context_state=session.data.get("context"),
+        )
+        speculative_drafter = SpeculativeDrafter(llm_client)
 
         # Send optional config to Retell server
         config = ConfigResponse(
@@ -127,17 +224,39 @@ async def websocket_handler(websocket: WebSocket, call_id: str):
             },
             response_id=1,
         )
-        await websocket.send_json(config.__dict__)
-
-        # Send first message to signal ready of server
-        response_id = 0
-        first_event = llm_client.draft_begin_message()
-        await websocket.send_json(first_event.__dict__)
-        interaction_type = request_json["interaction_type"]
+        await send_frame(encode_model(config))
 
+        if is_new_session:
+            # Send first message to signal ready of server
+            first_event = llm_client.draft_begin_message()
+            await send_frame(encode_model(first_event))
+            await save_session()
+        else:
+            logger.info(f"Resuming session for {call_id} at response_id={session.response_id}")
+
+        async def stream_response(request, metrics, speculative_draft=None):
+            encoder = ResponseFrameEncoder(request.response_id)
+
+            if speculative_draft is not None:
+                response_events = speculative_draft.stream(request.response_id)
+            else:
+                response_events = llm_client.draft_response(request, metrics=metrics)
+
+            try:
+                # aclosing() makes sure the generator (and its upstream stream) is closed even if
+                # the task is cancelled while sending a frame.
+                async with aclosing(token_coalescer.coalesce(response_events)) as events:
+                    async for event in events:
+                        await send_frame(encoder.encode_event(event))
+                        metrics.on_frame()
+                        if event.content_complete:
+                            metrics.on_complete()
+            except asyncio.CancelledError:
+                metrics.on_cancel()
+                raise
 
         async def handle_message(request_json):
-            nonlocal response_id
+            interaction_type = request_json["interaction_type"]
 
             # There are 5 types of interaction_type: call_details, pingpong, update_only, response_required, and reminder_required.
             # Not all of them need to be handled, only response_required and reminder_required.
@@ -145,20 +264,21 @@ async def websocket_handler(websocket: WebSocket, call_id: str):
                 print(json.dumps(request_json, indent=2))
                 return
             if interaction_type == "ping_pong":
-                await websocket.send_json(
-                    {
-                        "response_type": "ping_pong",
-                        "timestamp": request_json["timestamp"],
-                    }
-                )
+                await send_frame(encode_ping_pong(request_json["timestamp"]))
                 return
             if interaction_type == "update_only":
+                if speculative_drafter.enabled:
+                    speculative_drafter.on_update([Utterance(**utterance) for utterance in request_json["transcript"]])
                 return
             if (
                 interaction_type == "response_required"
                 or interaction_type == "reminder_required"
             ):
                 response_id = request_json["response_id"]
+                metrics = ResponseMetrics(response_id)
+                session.response_id = response_id
+                response_tasks.spawn(save_session())
+
                 request = ResponseRequiredRequest(
                     interaction_type=request_json["interaction_type"],
                     response_id=response_id,
@@ -168,13 +288,25 @@ async def websocket_handler(websocket: WebSocket, call_id: str):
                     f"""Received interaction_type={request_json['interaction_type']}, response_id={response_id}, last_transcript={request_json['transcript'][-1]['content']}"""
                 )
 
-                async for event in llm_client.draft_response(request):
-                    await websocket.send_json(event.__dict__)
-                    if request.response_id < response_id:
-                        break  # new response needed, abandon this one
+                # A draft started while the user was finishing the utterance is only used if the
+                # final transcript is the one it was drafted for.
+                speculative_draft = None
+                if interaction_type == "response_required":
+                    speculative_draft = speculative_drafter.take(request.transcript)
+                else:
+                    speculative_drafter.discard()
+
+                if speculative_draft is not None:
+                    metrics = speculative_draft.metrics
+
+                # A newer response_id supersedes the response in flight: cancel it right away
+                # instead of letting it stream tokens nobody is going to hear.
+                response_tasks.start_response(response_id, stream_response(request, metrics, speculative_draft))
 
-        async for data in websocket.iter_json():
-            asyncio.create_task(handle_message(data))
+        async for frame in websocket.iter_text():
+            if recorder is not None:
+                recorder.record_inbound(frame)
+            await handle_message(json.loads(frame))
 
     except WebSocketDisconnect:
         logger.info(f"LLM WebSocket disconnected for {call_id}")
@@ -184,4 +316,13 @@ async def websocket_handler(websocket: WebSocket, call_id: str):
         logger.error(f"Error in LLM WebSocket: {e} for {call_id}")
         await websocket.close(1011, "Server error")
     finally:
-        logger.info(f"LLM WebSocket connection closed for {call_id}")
\ No newline at end of file
+        await response_tasks.close()
+        if speculative_drafter is not None:
+            speculative_drafter.close()
+        if llm_client is not None:
+            llm_client.close()
+        if session is not None:
+            await save_session()
+        if recorder is not None:
+            recorder.close()
+        logger.info(f"LLM WebSocket connection closed for {call_id}")
@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+
+logger = logging.getLogger(__name__)
+
+
+SESSION_STORE_URL = os.environ.get("SESSION_STORE_URL", "memory://")
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 6 * 60 * 60))
+# Seconds between two purges of the expired sessions
+SESSION_PURGE_INTERVAL = float(os.environ.get("SESSION_PURGE_INTERVAL", 10 * 60))
+
+
+@dataclass
+class CallSession:
+    """State of a call that must survive a reconnect to a different worker."""
+    call_id: str
+    response_id: int = 0
+    data: dict = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def to_dict(self):
+        return {
+            "call_id": self.call_id,
+            "response_id": self.response_id,
+            "data": self.data,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, session_dict):
+        return cls(**session_dict)
+
+
+class SessionStore(ABC):
+    """
+    Base class of the call session stores, keyed by call_id.
+
+    A deleted session leaves a tombstone until it expires, so a late save of its call (e.g. when the
+    websocket closes after the call_ended webhook) doesn't recreate it. The expired sessions and
+    tombstones are purged in a background task.
+
+    Parameters:
+    - ttl (float): Seconds after the last update when a session is considered expired.
+    - purge_interval (float): Seconds between two purges of the expired sessions.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, purge_interval=SESSION_PURGE_INTERVAL):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._purge_task = None
+
+    def is_expired(self, updated_at):
+        return self.ttl is not None and time.time() - updated_at > self.ttl
+
+    @abstractmethod
+    async def get(self, call_id) -> CallSession | None:
+        pass
+
+    async def get_or_create(self, call_id) -> tuple[CallSession, bool]:
+        session = await self.get(call_id)
+        if session is None:
+            return CallSession(call_id=call_id), True
+        return session, False
+
+    @abstractmethod
+    async def save(self, session: CallSession):
+        """Saves the session, unless it was deleted."""
+        pass
+
+    @abstractmethod
+    async def delete(self, call_id):
+        """Deletes the session when the call has ended, it can't be saved again."""
+        pass
+
+    @abstractmethod
+    async def purge_expired(self):
+        pass
+
+    def start(self):
+        if self._purge_task is None and self.ttl is not None:
+            self._purge_task = asyncio.create_task(self._purge_periodically())
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                await self.purge_expired()
+            except Exception:
+                logger.exception("Error purging the expired sessions")
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local store, sessions can only be resumed by the same worker."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._sessions = {}
+
+    async def get(self, call_id):
+        session_dict = self._sessions.get(call_id)
+        if session_dict is None:
+            return None
+
+        if self.is_expired(session_dict["updated_at"]):
+            del self._sessions[call_id]
+            return None
+
+        if session_dict["state"] is None:
+            return None
+        return CallSession.from_dict(json.loads(session_dict["state"]))
+
+    async def save(self, session):
+        session_dict = self._sessions.get(session.call_id)
+        if session_dict is not None and session_dict["state"] is None:
+            return
+
+        session.updated_at = time.time()
+        # Stored serialized like in the shared stores, so the caller can't mutate a saved session.
+        self._sessions[session.call_id] = {
+            "state": json.dumps(session.to_dict()),
+            "updated_at": session.updated_at,
+        }
+
+    async def delete(self, call_id):
+        self._sessions[call_id] = {"state": None, "updated_at": time.time()}
+
+    async def purge_expired(self):
+        expired_call_ids = [call_id for call_id, session_dict in self._sessions.items() if self.is_expired(session_dict["updated_at"])]
+        for call_id in expired_call_ids:
+            del self._sessions[call_id]
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite store shared by all the workers of the host, a stand-in for a shared store like Redis.
+
+    Queries run in a single thread executor so the event loop never blocks on disk I/O.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Databases created before the tombstones have a NOT NULL state
+                not_null_columns = {row[1]: row[3] for row in connection.execute("PRAGMA table_info(call_sessions)")}
+                if not_null_columns.get("state"):
+                    connection.execute("ALTER TABLE call_sessions RENAME TO call_sessions_old")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS call_sessions ("
+                    "call_id TEXT PRIMARY KEY, "
+                    "state TEXT, "
+                    "updated_at REAL NOT NULL)"
+                )
+                if not_null_columns.get("state"):
+                    connection.execute("INSERT INTO call_sessions SELECT call_id, state, updated_at FROM call_sessions_old")
+                    connection.execute("DROP TABLE call_sessions_old")
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _get(self, call_id):
+        row = self._connect().execute(
+            "SELECT state, updated_at FROM call_sessions WHERE call_id = ?", (call_id,)
+        ).fetchone()
+        return row
+
+    def _save(self, call_id, state, updated_at):
+        # The tombstone of a deleted session (NULL state) isn't overwritten
+        self._connect().execute(
+            "INSERT INTO call_sessions (call_id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(call_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at "
+            "WHERE call_sessions.state IS NOT NULL",
+            (call_id, state, updated_at),
+        )
+
+    def _delete(self, call_id):
+        self._connect().execute(
+            "INSERT INTO call_sessions (call_id, state, updated_at) VALUES (?, NULL, ?) "
+            "ON CONFLICT(call_id) DO UPDATE SET state = NULL, updated_at = excluded.updated_at",
+            (call_id, time.time()),
+        )
+
+    def _purge_expired(self):
+        self._connect().execute("DELETE FROM call_sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    async def get(self, call_id):
+        row = await self._run(self._get, call_id)
+        if row is None:
+            return None
+
+        state, updated_at = row
+        if state is None or self.is_expired(updated_at):
+            return None
+
+        return CallSession.from_dict(json.loads(state))
+
+    async def save(self, session):
+        session.updated_at = time.time()
+        # Serialized in the event loop: the session keeps changing while the write is queued.
+        state = json.dumps(session.to_dict())
+        await self._run(self._save, session.call_id, state, session.updated_at)
+
+    async def delete(self, call_id):
+        await self._run(self._delete, call_id)
+
+    async def purge_expired(self):
+        if self.ttl is not None:
+            await self._run(self._purge_expired)
+
+    async def close(self):
+        await super().close()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+
+
+def create_session_store(url=SESSION_STORE_URL, **kwargs) -> SessionStore:
+    """
+    Creates the session store for the url:
+    - memory:// -> InMemorySessionStore
+    - sqlite:///path/to/sessions.db -> SQLiteSessionStore
+    """
+    if url == "memory://":
+        return InMemorySessionStore(**kwargs)
+    elif url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], **kwargs)
+    else:
+        raise ValueError(f"Unsupported session store url: {url}")
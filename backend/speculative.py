@@ -0,0 +1,178 @@
+import os
+import re
+import time
+import asyncio
+import logging
+
+from .custom_types import ResponseRequiredRequest, ResponseResponse
+from .metrics import ResponseMetrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Opt-in: speculative drafting is disabled unless a stability interval is configured
+SPECULATIVE_DRAFTING_DELAY_MS = float(os.environ.get("SPECULATIVE_DRAFTING_DELAY_MS", 0))
+
+# Placeholder response_id of the drafts, replaced by the real one when the draft is adopted
+SPECULATIVE_RESPONSE_ID = -1
+
+_non_word_re = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def normalize_utterance(content):
+    return _non_word_re.sub(" ", content.lower()).strip()
+
+
+def get_transcript_key(transcript):
+    return tuple((utterance.role, normalize_utterance(utterance.content)) for utterance in transcript)
+
+
+class SpeculativeDraft:
+    """
+    Response drafted from an update_only transcript, before Retell asks for it.
+
+    The events are buffered until the draft is adopted by a response_required with the same
+    transcript. Tool calls wait for the adoption, so a discarded draft never has side effects.
+    """
+
+    def __init__(self, llm_client, transcript):
+        self.key = get_transcript_key(transcript)
+        self.metrics = ResponseMetrics(SPECULATIVE_RESPONSE_ID)
+        self.events = []
+        self.done = False
+        self.error = None
+        self._tool_gate = asyncio.Event()
+        self._changed = asyncio.Event()
+
+        request = ResponseRequiredRequest(
+            interaction_type="response_required",
+            response_id=SPECULATIVE_RESPONSE_ID,
+            transcript=transcript,
+        )
+        self._task = asyncio.create_task(self._run(llm_client, request))
+
+    async def _run(self, llm_client, request):
+        try:
+            async for event in llm_client.draft_response(request, metrics=self.metrics, tool_gate=self._tool_gate):
+                self.events.append(event)
+                self._changed.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logger.error(f"Error in speculative draft: {err}")
+            self.error = err
+        finally:
+            self.done = True
+            self._changed.set()
+
+    def matches(self, transcript):
+        return self.error is None and self.key == get_transcript_key(transcript)
+
+    def cancel(self):
+        self._task.cancel()
+
+    async def stream(self, response_id):
+        """Adopts the draft for response_id: yields the buffered events, then the rest as they arrive."""
+        self._tool_gate.set()
+        self.metrics.response_id = response_id
+        self.metrics.started_at = time.perf_counter()
+
+        try:
+            i = 0
+            while True:
+                while i < len(self.events):
+                    event = self.events[i]
+                    i += 1
+                    yield ResponseResponse.model_construct(
+                        response_id=response_id,
+                        content=event.content,
+                        content_complete=event.content_complete,
+                        end_call=event.end_call,
+                        transfer_number=event.transfer_number,
+                    )
+
+                if self.done:
+                    break
+
+                self._changed.clear()
+                await self._changed.wait()
+
+            if self.error is not None:
+                raise self.error
+        finally:
+            # Abandoned (e.g. a newer response_id): stop generating
+            if not self.done:
+                self.cancel()
+
+
+class SpeculativeDrafter:
+    """
+    Starts a SpeculativeDraft once the user's latest utterance has been stable (no update_only
+    frame changing it) for delay seconds, and hands it over to the response_required that matches it.
+
+    Parameters:
+    - llm_client (LlmClient): The LLM client of the call.
+    - delay (float): Seconds the transcript must be stable before drafting.
+    """
+
+    def __init__(self, llm_client, delay=SPECULATIVE_DRAFTING_DELAY_MS / 1000):
+        self.llm_client = llm_client
+        self.delay = delay
+        self._draft = None
+        self._timer = None
+        self._timer_key = None
+
+    @property
+    def enabled(self):
+        return self.delay > 0
+
+    def on_update(self, transcript):
+        if not transcript or transcript[-1].role != "user":
+            return
+
+        key = get_transcript_key(transcript)
+        if self._draft is not None and self._draft.key == key:
+            return
+        if self._timer is not None and not self._timer.done() and self._timer_key == key:
+            return
+
+        # The user is still talking: whatever was drafted is stale
+        self.discard()
+        self._timer_key = key
+        self._timer = asyncio.create_task(self._start_after_delay(transcript))
+
+    async def _start_after_delay(self, transcript):
+        await asyncio.sleep(self.delay)
+        self._draft = SpeculativeDraft(self.llm_client, transcript)
+
+    def take(self, transcript):
+        """Returns the draft if it was made for this transcript, discarding it otherwise."""
+        draft = self._draft
+        self._draft = None
+        self._cancel_timer()
+
+        if draft is None:
+            return None
+
+        if draft.matches(transcript):
+            logger.info(f"Speculative draft adopted with {len(draft.events)} events ready")
+            return draft
+
+        draft.cancel()
+        return None
+
+    def _cancel_timer(self):
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        self._timer = None
+        self._timer_key = None
+
+    def discard(self):
+        self._cancel_timer()
+        if self._draft is not None:
+            self._draft.cancel()
+            self._draft = None
+
+    def close(self):
+        self.discard()
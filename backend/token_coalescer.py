@@ -0,0 +1,141 @@
+import os
+import asyncio
+import logging
+
+from .custom_types import ResponseResponse
+
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_FLUSH_INTERVAL_MS = float(os.environ.get("TOKEN_FLUSH_INTERVAL_MS", 30))
+TOKEN_FLUSH_MAX_CHARS = int(os.environ.get("TOKEN_FLUSH_MAX_CHARS", 80))
+
+CLAUSE_BOUNDARY_CHARS = frozenset(".,;:!?\n")
+
+
+class TokenCoalescer:
+    """
+    Output stage that merges the streamed ResponseResponse deltas of a response into bigger chunks.
+
+    The first chunk is always sent immediately to protect the time to first audio. After that,
+    the buffered text is flushed when the flush window expires, when it reaches max_chars or when
+    it ends on a sentence/clause boundary. The final (content_complete) event carries whatever is
+    still buffered.
+
+    Parameters:
+    - flush_interval (float): Maximum seconds a delta waits in the buffer. 0 disables coalescing.
+    - max_chars (int): Flush as soon as the buffer reaches this size.
+    - flush_on_boundary (bool): Flush when the buffer ends on a sentence or clause boundary.
+    """
+
+    def __init__(self, flush_interval=TOKEN_FLUSH_INTERVAL_MS / 1000, max_chars=TOKEN_FLUSH_MAX_CHARS, flush_on_boundary=True):
+        self.flush_interval = flush_interval
+        self.max_chars = max_chars
+        self.flush_on_boundary = flush_on_boundary
+
+    @property
+    def enabled(self):
+        return self.flush_interval > 0
+
+    def is_boundary(self, content):
+        stripped_content = content.rstrip(" ")
+        return stripped_content != "" and stripped_content[-1] in CLAUSE_BOUNDARY_CHARS
+
+    async def coalesce(self, events):
+        if not self.enabled:
+            async for event in events:
+                yield event
+            return
+
+        loop = asyncio.get_running_loop()
+        iterator = events.__aiter__()
+
+        buffer = []
+        buffered_chars = 0
+        deadline = None
+        response_id = None
+        first_chunk_sent = False
+        pending = None
+
+        try:
+            while True:
+                if pending is None and not buffer:
+                    try:
+                        event = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                else:
+                    # Something is buffered: wait for the next delta but not past the flush deadline.
+                    # The pending __anext__() survives a timeout and is awaited again after the flush.
+                    if pending is None:
+                        pending = asyncio.ensure_future(iterator.__anext__())
+
+                    timeout = max(deadline - loop.time(), 0) if buffer else None
+                    done, _ = await asyncio.wait((pending,), timeout=timeout)
+                    if not done:
+                        yield self._build_chunk(response_id, buffer)
+                        buffer = []
+                        buffered_chars = 0
+                        continue
+
+                    completed, pending = pending, None
+                    try:
+                        event = completed.result()
+                    except StopAsyncIteration:
+                        break
+
+                response_id = event.response_id
+
+                if event.content_complete or event.end_call:
+                    if buffer:
+                        buffer.append(event.content)
+                        event = ResponseResponse.model_construct(
+                            response_id=event.response_id,
+                            content="".join(buffer),
+                            content_complete=event.content_complete,
+                            end_call=event.end_call,
+                            transfer_number=event.transfer_number,
+                        )
+                        buffer = []
+                        buffered_chars = 0
+                    yield event
+                    continue
+
+                if not event.content:
+                    continue
+
+                if not first_chunk_sent:
+                    first_chunk_sent = True
+                    yield event
+                    continue
+
+                if not buffer:
+                    deadline = loop.time() + self.flush_interval
+
+                buffer.append(event.content)
+                buffered_chars += len(event.content)
+
+                if buffered_chars >= self.max_chars or (self.flush_on_boundary and self.is_boundary(event.content)):
+                    yield self._build_chunk(response_id, buffer)
+                    buffer = []
+                    buffered_chars = 0
+
+            if buffer:
+                yield self._build_chunk(response_id, buffer)
+        finally:
+            if pending is not None:
+                pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
+
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _build_chunk(self, response_id, buffer):
+        return ResponseResponse.model_construct(
+            response_id=response_id,
+            content="".join(buffer),
+            content_complete=False,
+            end_call=False,
+        )
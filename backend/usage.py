@@ -0,0 +1,195 @@
+import os
+import logging
+from dataclasses import dataclass, asdict
+
+
+logger = logging.getLogger(__name__)
+
+
+# Turns kept in the per-turn accounting of a call, the oldest ones are dropped
+USAGE_MAX_TURNS = int(os.environ.get("USAGE_MAX_TURNS", 200))
+
+
+def _get(obj, key):
+    # Depending on the version of the openai package, usage fields it doesn't know about
+    # (prompt_tokens_details) are kept as plain dicts
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+@dataclass
+class TokenUsage:
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    requests: int = 0
+    # Time from the request to the end of the completion
+    seconds: float = 0.0
+
+    @classmethod
+    def from_openai_usage(cls, usage, seconds=0.0):
+        """Builds a TokenUsage from the usage of a completion (or of the last chunk of a stream)."""
+        prompt_tokens_details = _get(usage, "prompt_tokens_details")
+        return cls(
+            prompt_tokens=_get(usage, "prompt_tokens") or 0,
+            cached_tokens=_get(prompt_tokens_details, "cached_tokens") or 0,
+            completion_tokens=_get(usage, "completion_tokens") or 0,
+            requests=1,
+            seconds=seconds,
+        )
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cache_hit_ratio(self):
+        if self.prompt_tokens == 0:
+            return 0.0
+        return self.cached_tokens / self.prompt_tokens
+
+    def add(self, usage):
+        self.prompt_tokens += usage.prompt_tokens
+        self.cached_tokens += usage.cached_tokens
+        self.completion_tokens += usage.completion_tokens
+        self.requests += usage.requests
+        self.seconds += usage.seconds
+
+    def to_dict(self):
+        return asdict(self)
+
+    def to_report_dict(self):
+        report = self.to_dict()
+        report["total_tokens"] = self.total_tokens
+        report["cache_hit_ratio"] = round(self.cache_hit_ratio, 4)
+        return report
+
+    @classmethod
+    def from_dict(cls, usage_dict):
+        return cls(**usage_dict)
+
+
+def _add_usage(usages, key, usage):
+    key_usage = usages.get(key)
+    if key_usage is None:
+        key_usage = usages[key] = TokenUsage()
+    key_usage.add(usage)
+
+
+def _sorted_report(usages):
+    """Report of the usages, the most expensive first."""
+    return {
+        key: usage.to_report_dict()
+        for key, usage in sorted(usages.items(), key=lambda item: item[1].total_tokens, reverse=True)
+    }
+
+
+class UsageReport:
+    """Process-wide aggregate of the token usage of all the calls, per state and per model."""
+
+    def __init__(self):
+        self.total = TokenUsage()
+        self.by_state = {}
+        self.by_model = {}
+        self.call_ids = set()
+
+    def record(self, usage: TokenUsage, call_id=None, model=None, state=None):
+        self.total.add(usage)
+        _add_usage(self.by_state, state or "unknown", usage)
+        _add_usage(self.by_model, model or "unknown", usage)
+        if call_id is not None:
+            self.call_ids.add(call_id)
+
+    def to_dict(self):
+        return {
+            "calls": len(self.call_ids),
+            "total": self.total.to_report_dict(),
+            "by_state": _sorted_report(self.by_state),
+            "by_model": _sorted_report(self.by_model),
+        }
+
+
+USAGE_REPORT = UsageReport()
+
+
+class CallUsage:
+    """
+    Token usage of a call, in total, per state, per model and per turn (response_id), kept in the call
+    session so it survives reconnects. Every record is also added to the process-wide report.
+    """
+
+    def __init__(self, call_id=None, total=None, by_state=None, by_model=None, turns=None, report=USAGE_REPORT):
+        self.call_id = call_id
+        self.total = total or TokenUsage()
+        self.by_state = by_state or {}
+        self.by_model = by_model or {}
+        # response_id -> {"state", "model", "usage"}
+        self.turns = turns or {}
+        self.report = report
+
+    def record(self, usage: TokenUsage, model=None, state=None, response_id=None):
+        self.total.add(usage)
+        _add_usage(self.by_state, state or "unknown", usage)
+        _add_usage(self.by_model, model or "unknown", usage)
+
+        if response_id is not None:
+            turn = self.turns.get(response_id)
+            if turn is None:
+                turn = self.turns[response_id] = {"state": state, "model": model, "usage": TokenUsage()}
+                while len(self.turns) > USAGE_MAX_TURNS:
+                    del self.turns[next(iter(self.turns))]
+            turn["usage"].add(usage)
+
+        if self.report is not None:
+            self.report.record(usage, call_id=self.call_id, model=model, state=state)
+
+        logger.info(
+            f"tokens ({state or 'unknown'}, {model}): {usage.prompt_tokens} prompt ({usage.cached_tokens} cached); {usage.completion_tokens} completion; "
+            f"call {self.call_id} total: {self.total.total_tokens} ({self.total.cache_hit_ratio:.0%} prompt cache hits)"
+        )
+
+    def record_openai_usage(self, usage, model=None, state=None, response_id=None, seconds=0.0):
+        """Records the usage object of a completion, used by callers that don't depend on this module (the FSM states)."""
+        self.record(TokenUsage.from_openai_usage(usage, seconds=seconds), model=model, state=state, response_id=response_id)
+
+    def to_dict(self):
+        return {
+            "total": self.total.to_dict(),
+            "by_state": {state: usage.to_dict() for state, usage in self.by_state.items()},
+            "by_model": {model: usage.to_dict() for model, usage in self.by_model.items()},
+            # JSON keys are strings, the response_id is kept in the value
+            "turns": [
+                {"response_id": response_id, "state": turn["state"], "model": turn["model"], "usage": turn["usage"].to_dict()}
+                for response_id, turn in self.turns.items()
+            ],
+        }
+
+    def to_report_dict(self):
+        return {
+            "call_id": self.call_id,
+            "total": self.total.to_report_dict(),
+            "by_state": _sorted_report(self.by_state),
+            "by_model": _sorted_report(self.by_model),
+            "turns": [
+                {"response_id": response_id, "state": turn["state"], "model": turn["model"], **turn["usage"].to_report_dict()}
+                for response_id, turn in self.turns.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, usage_dict, call_id=None):
+        if not usage_dict:
+            return cls(call_id=call_id)
+        return cls(
+            call_id=call_id,
+            total=TokenUsage.from_dict(usage_dict["total"]),
+            by_state={state: TokenUsage.from_dict(usage) for state, usage in usage_dict.get("by_state", {}).items()},
+            by_model={model: TokenUsage.from_dict(usage) for model, usage in usage_dict.get("by_model", {}).items()},
+            turns={
+                turn["response_id"]: {"state": turn["state"], "model": turn["model"], "usage": TokenUsage.from_dict(turn["usage"])}
+                for turn in usage_dict.get("turns", [])
+            },
+        )
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+
+logger = logging.getLogger(__name__)
+
+
+WEBHOOK_EVENTS_DB = os.environ.get("WEBHOOK_EVENTS_DB", "webhook_events.db")
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 200))
+WEBHOOK_BATCH_DELAY_MS = float(os.environ.get("WEBHOOK_BATCH_DELAY_MS", 250))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 10000))
+
+
+@dataclass
+class WebhookEvent:
+    event: str
+    call_id: str | None
+    received_at: float
+    payload: dict
+
+
+class WebhookEventStore:
+    """SQLite store of the webhook events, written in bulk from a single thread executor."""
+
+    def __init__(self, path=WEBHOOK_EVENTS_DB):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="webhook-events")
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS call_events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "call_id TEXT, "
+                "event TEXT NOT NULL, "
+                "received_at REAL NOT NULL, "
+                "payload TEXT NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS call_events_call_id ON call_events (call_id)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _write_batch(self, rows):
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO call_events (call_id, event, received_at, payload) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    async def write_batch(self, events):
+        rows = [
+            (event.call_id, event.event, event.received_at, json.dumps(event.payload, separators=(",", ":")))
+            for event in events
+        ]
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._write_batch, rows)
+
+    async def close(self):
+        if self._connection is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+
+
+class WebhookEventQueue:
+    """
+    In-process queue between the webhook endpoint and the event store.
+
+    The endpoint only verifies the signature and enqueues the raw body. A background task parses
+    the events, runs the handlers and writes them to the store in batches of up to
+    max_batch_size events, waiting at most max_batch_delay seconds for a batch to fill.
+
+    Parameters:
+    - store (WebhookEventStore): Where the batches are written.
+    - handlers (dict): Optional mapping of event type to an async function receiving the WebhookEvent.
+    """
+
+    def __init__(self, store, handlers=None, max_batch_size=WEBHOOK_BATCH_SIZE, max_batch_delay=WEBHOOK_BATCH_DELAY_MS / 1000, max_queue_size=WEBHOOK_QUEUE_SIZE):
+        self.store = store
+        self.handlers = handlers or {}
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def put_raw(self, raw_body: bytes) -> bool:
+        try:
+            self._queue.put_nowait((time.time(), raw_body))
+        except asyncio.QueueFull:
+            logger.error("Webhook event queue is full, rejecting event")
+            return False
+        return True
+
+    def parse(self, received_at, raw_body):
+        payload = json.loads(raw_body)
+        data = payload.get("data") or {}
+        return WebhookEvent(
+            event=payload["event"],
+            call_id=data.get("call_id"),
+            received_at=received_at,
+            payload=payload,
+        )
+
+    async def _next_batch(self):
+        item = await self._queue.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_batch_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _process_batch(self, batch):
+        events = []
+        for received_at, raw_body in batch:
+            try:
+                event = self.parse(received_at, raw_body)
+            except (ValueError, KeyError) as err:
+                logger.error(f"Invalid webhook event: {err}")
+                continue
+
+            handler = self.handlers.get(event.event)
+            if handler is None:
+                logger.info("Unknown event %s", event.event)
+            else:
+                try:
+                    await handler(event)
+                except Exception:
+                    logger.exception(f"Error handling webhook event {event.event} of {event.call_id}")
+            events.append(event)
+
+        if events:
+            try:
+                await self.store.write_batch(events)
+            except Exception:
+                logger.exception(f"Error writing {len(events)} webhook events")
+
+    async def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = await self._next_batch()
+            if batch:
+                await self._process_batch(batch)
+
+    async def close(self):
+        if self._task is not None:
+            # The None sentinel is queued after the pending events, so they are flushed first
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+        await self.store.close()
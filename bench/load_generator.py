@@ -0,0 +1,238 @@
+"""
+Load generator impersonating the Retell server: it opens concurrent websockets to
+/llm-websocket/{call_id}, plays scripted transcripts and reports throughput, time to first
+token and error rates.
+
+    python -m bench.load_generator --url ws://localhost:8080/llm-websocket --calls 100 --turns 5
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, field
+
+import websockets
+
+
+DEFAULT_SCRIPT = [
+    "Hi, I'd like to know how much a women's haircut costs",
+    "And do you do coloring too?",
+    "Great, can I book an appointment for next Tuesday?",
+    "Around ten in the morning would be perfect",
+    "My name is Maria Santos and my phone is 0917 555 1234",
+    "Yes, that's all correct, thank you",
+    "What are your opening hours on Saturday?",
+    "Perfect, thanks a lot, bye",
+]
+
+
+@dataclass
+class TurnResult:
+    response_id: int
+    started_at: float = 0.0
+    time_to_first_token: float | None = None
+    duration: float | None = None
+    frames: int = 0
+    error: str | None = None
+
+
+@dataclass
+class CallResult:
+    call_id: str
+    turns: list = field(default_factory=list)
+    error: str | None = None
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(int(round(p / 100 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class SimulatedCall:
+    """
+    A single call as seen by the custom LLM server: the user "speaks" each scripted utterance
+    word by word (update_only frames), then Retell asks for a response (response_required).
+    """
+
+    def __init__(self, url, call_id, script, words_per_second=3.0, update_interval=0.25, think_time=0.5, response_timeout=30.0, ping_interval=2.0):
+        self.url = url
+        self.call_id = call_id
+        self.script = script
+        self.words_per_second = words_per_second
+        self.update_interval = update_interval
+        self.think_time = think_time
+        self.response_timeout = response_timeout
+        self.ping_interval = ping_interval
+
+        self.transcript = []
+        self.result = CallResult(call_id=call_id)
+        self._turns = {}
+        self._completed = {}
+        self._agent_content = {}
+
+    async def send(self, websocket, frame):
+        await websocket.send(json.dumps(frame))
+
+    async def receive_frames(self, websocket):
+        async for message in websocket:
+            frame = json.loads(message)
+            if frame.get("response_type") != "response":
+                continue
+
+            response_id = frame["response_id"]
+            turn = self._turns.get(response_id)
+            if turn is None:
+                continue
+
+            now = time.perf_counter()
+            if turn.frames == 0:
+                turn.time_to_first_token = now - turn.started_at
+            turn.frames += 1
+            self._agent_content[response_id] = self._agent_content.get(response_id, "") + frame.get("content", "")
+
+            if frame.get("content_complete"):
+                turn.duration = now - turn.started_at
+                completed = self._completed.get(response_id)
+                if completed is not None and not completed.done():
+                    completed.set_result(True)
+
+    async def send_pings(self, websocket):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await self.send(websocket, {"interaction_type": "ping_pong", "timestamp": int(time.time() * 1000)})
+
+    async def speak(self, websocket, utterance):
+        words = utterance.split(" ")
+        words_per_update = max(int(self.words_per_second * self.update_interval), 1)
+
+        for i in range(words_per_update, len(words), words_per_update):
+            partial_utterance = {"role": "user", "content": " ".join(words[:i])}
+            await self.send(websocket, {"interaction_type": "update_only", "transcript": self.transcript + [partial_utterance]})
+            await asyncio.sleep(self.update_interval)
+
+        self.transcript.append({"role": "user", "content": utterance})
+
+    async def run_turn(self, websocket, response_id, utterance):
+        await self.speak(websocket, utterance)
+
+        turn = TurnResult(response_id=response_id, started_at=time.perf_counter())
+        self._turns[response_id] = turn
+        self._completed[response_id] = asyncio.get_running_loop().create_future()
+
+        await self.send(websocket, {
+            "interaction_type": "response_required",
+            "response_id": response_id,
+            "transcript": self.transcript,
+        })
+
+        try:
+            await asyncio.wait_for(self._completed[response_id], self.response_timeout)
+        except asyncio.TimeoutError:
+            turn.error = "timeout"
+
+        self.transcript.append({"role": "agent", "content": self._agent_content.get(response_id, "")})
+        self.result.turns.append(turn)
+
+    async def run(self):
+        try:
+            async with websockets.connect("%s/%s" % (self.url.rstrip("/"), self.call_id), max_size=None) as websocket:
+                receiver = asyncio.create_task(self.receive_frames(websocket))
+                pinger = asyncio.create_task(self.send_pings(websocket))
+                try:
+                    for response_id, utterance in enumerate(self.script, start=1):
+                        await self.run_turn(websocket, response_id, utterance)
+                        await asyncio.sleep(random.uniform(0, 2 * self.think_time))
+                finally:
+                    receiver.cancel()
+                    pinger.cancel()
+                    await asyncio.gather(receiver, pinger, return_exceptions=True)
+        except Exception as err:
+            self.result.error = "%s: %s" % (type(err).__name__, err)
+
+        return self.result
+
+
+def print_report(results, elapsed):
+    turns = [turn for result in results for turn in result.turns]
+    completed_turns = [turn for turn in turns if turn.error is None and turn.duration is not None]
+    failed_calls = [result for result in results if result.error is not None]
+    failed_turns = [turn for turn in turns if turn.error is not None]
+
+    ttfts = [turn.time_to_first_token for turn in completed_turns if turn.time_to_first_token is not None]
+    durations = [turn.duration for turn in completed_turns]
+    frames = [turn.frames for turn in completed_turns]
+
+    def format_ms(value):
+        return "-" if value is None else "%.1f ms" % (value * 1000)
+
+    print("Calls: %d (%d failed, %.1f%% error rate)" % (len(results), len(failed_calls), 100 * len(failed_calls) / max(len(results), 1)))
+    print("Turns: %d completed, %d failed (%.1f%% error rate)" % (len(completed_turns), len(failed_turns), 100 * len(failed_turns) / max(len(turns), 1)))
+    print("Elapsed: %.1f s, throughput: %.2f turns/s" % (elapsed, len(completed_turns) / elapsed if elapsed else 0))
+    for p in (50, 90, 99):
+        print("TTFT p%d: %s, completion p%d: %s" % (p, format_ms(percentile(ttfts, p)), p, format_ms(percentile(durations, p))))
+    if frames:
+        print("Frames per response: %.1f avg" % (sum(frames) / len(frames)))
+
+    errors = {}
+    for result in failed_calls:
+        errors[result.error] = errors.get(result.error, 0) + 1
+    for error, count in sorted(errors.items(), key=lambda item: -item[1]):
+        print("  %dx %s" % (count, error))
+
+
+async def run_load(args, script):
+    semaphore = asyncio.Semaphore(args.calls)
+
+    async def run_call(i):
+        # Calls are started progressively over the ramp-up period
+        await asyncio.sleep(args.ramp_up * i / max(args.total_calls, 1))
+        async with semaphore:
+            call = SimulatedCall(
+                args.url,
+                "bench-" + uuid.uuid4().hex,
+                script[:args.turns] if args.turns else script,
+                words_per_second=args.words_per_second,
+                think_time=args.think_time,
+                response_timeout=args.response_timeout,
+            )
+            return await call.run()
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*[run_call(i) for i in range(args.total_calls)])
+    print_report(results, time.perf_counter() - started_at)
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description="Concurrent call load generator impersonating the Retell server")
+    parser.add_argument("--url", default="ws://localhost:8080/llm-websocket", help="Base url of the LLM websocket, the call_id is appended")
+    parser.add_argument("--calls", type=int, default=10, help="Concurrent calls")
+    parser.add_argument("--total-calls", type=int, default=None, help="Total calls to run (default: --calls)")
+    parser.add_argument("--turns", type=int, default=None, help="Turns per call (default: the whole script)")
+    parser.add_argument("--script", default=None, help="JSON file with the list of user utterances to play")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Seconds to start all the calls")
+    parser.add_argument("--words-per-second", type=float, default=3.0, help="Speaking rate of the simulated user")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Average pause of the user after a response")
+    parser.add_argument("--response-timeout", type=float, default=30.0)
+    return parser
+
+
+def main():
+    args = get_argument_parser().parse_args()
+    if args.total_calls is None:
+        args.total_calls = args.calls
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    asyncio.run(run_load(args, script))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+OpenAI-compatible stub of the streaming chat completions endpoint, with configurable latency.
+
+Point the server to it to run benchmarks offline:
+
+    python -m bench.openai_stub --port 8001 --ttft-ms 300 --token-ms 20
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub uvicorn backend.server:app --port 8080
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+DEFAULT_RESPONSE = "Sure, we have a few slots open that day. Would you prefer the morning or the afternoon? We open at nine and the last appointment is at six."
+
+
+class StubSettings:
+    ttft = 0.3
+    token_latency = 0.02
+    jitter = 0.2
+    response = DEFAULT_RESPONSE
+    # Optional function receiving the request body and returning the text to stream
+    response_provider = None
+
+
+settings = StubSettings()
+
+app = FastAPI()
+
+
+def tokenize(text):
+    tokens = []
+    for i, word in enumerate(text.split(" ")):
+        tokens.append(word if i == 0 else " " + word)
+    return tokens
+
+
+def with_jitter(seconds):
+    return seconds * random.uniform(1 - settings.jitter, 1 + settings.jitter)
+
+
+def get_response_text(body):
+    if settings.response_provider is not None:
+        return settings.response_provider(body)
+    return settings.response
+
+
+def build_chunk(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def build_usage_chunk(completion_id, model, prompt_tokens, completion_tokens):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        },
+    }
+
+
+async def stream_completion(body, text):
+    completion_id = "chatcmpl-" + uuid.uuid4().hex
+    model = body.get("model", "stub")
+    tokens = tokenize(text)
+
+    await asyncio.sleep(with_jitter(settings.ttft))
+    yield "data: %s\n\n" % json.dumps(build_chunk(completion_id, model, {"role": "assistant", "content": ""}))
+
+    for i, token in enumerate(tokens):
+        if i > 0:
+            await asyncio.sleep(with_jitter(settings.token_latency))
+        yield "data: %s\n\n" % json.dumps(build_chunk(completion_id, model, {"content": token}))
+
+    yield "data: %s\n\n" % json.dumps(build_chunk(completion_id, model, {}, finish_reason="stop"))
+
+    stream_options = body.get("stream_options") or {}
+    if stream_options.get("include_usage"):
+        prompt_tokens = sum(len(str(message.get("content") or "")) // 4 for message in body.get("messages", []))
+        yield "data: %s\n\n" % json.dumps(build_usage_chunk(completion_id, model, prompt_tokens, len(tokens)))
+
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    text = get_response_text(body)
+
+    if body.get("stream"):
+        return StreamingResponse(stream_completion(body, text), media_type="text/event-stream")
+
+    await asyncio.sleep(with_jitter(settings.ttft + settings.token_latency * len(tokenize(text))))
+    return JSONResponse({
+        "id": "chatcmpl-" + uuid.uuid4().hex,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(tokenize(text)), "total_tokens": len(tokenize(text))},
+    })
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible streaming stub with configurable latency")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft-ms", type=float, default=300, help="Latency until the first token")
+    parser.add_argument("--token-ms", type=float, default=20, help="Latency between tokens")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative random jitter of the latencies")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE, help="Text streamed in every completion")
+    return parser
+
+
+def configure(args):
+    settings.ttft = args.ttft_ms / 1000
+    settings.token_latency = args.token_ms / 1000
+    settings.jitter = args.jitter
+    settings.response = args.response
+
+
+def main():
+    import uvicorn
+
+    args = get_argument_parser().parse_args()
+    configure(args)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Deterministic replay of a recorded call (see CALL_RECORDING_DIR).
+
+The inbound frames of the recording are sent again to the server with their original timing,
+while an in-process OpenAI stub serves the agent responses of the recording, so the same
+traffic can be used to compare the latency of two versions of the server:
+
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub uvicorn backend.server:app --port 8080
+    python -m bench.replay_call recordings/<call_id>.log --url ws://localhost:8080/llm-websocket --stub-port 8001
+"""
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from collections import defaultdict, deque
+
+import websockets
+
+from backend.call_recorder import INBOUND, OUTBOUND, read_call_recording
+
+from . import openai_stub
+from .load_generator import percentile
+
+
+class RecordedTurn:
+    def __init__(self, response_id, requested_at, transcript):
+        self.response_id = response_id
+        self.requested_at = requested_at
+        self.transcript = transcript
+        self.first_frame_at = None
+        self.completed_at = None
+        self.content = ""
+
+    @property
+    def time_to_first_token(self):
+        if self.first_frame_at is None:
+            return None
+        return self.first_frame_at - self.requested_at
+
+    @property
+    def duration(self):
+        if self.completed_at is None:
+            return None
+        return self.completed_at - self.requested_at
+
+
+def get_last_user_utterance(messages):
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+
+def collect_turns(frames):
+    """Builds the turns (one per response_id) from a sequence of (offset, direction, frame)."""
+    turns = {}
+    for offset, direction, frame in frames:
+        if direction == INBOUND and frame.get("interaction_type") in ("response_required", "reminder_required"):
+            turns[frame["response_id"]] = RecordedTurn(frame["response_id"], offset, frame["transcript"])
+        elif direction == OUTBOUND and frame.get("response_type") == "response":
+            turn = turns.get(frame["response_id"])
+            if turn is None:
+                continue
+            if turn.first_frame_at is None:
+                turn.first_frame_at = offset
+            turn.content += frame.get("content", "")
+            if frame.get("content_complete") and turn.completed_at is None:
+                turn.completed_at = offset
+    return turns
+
+
+def load_recording(path):
+    frames = list(read_call_recording(path))
+    inbound_frames = [(offset, frame) for offset, direction, frame in frames if direction == INBOUND]
+    return inbound_frames, collect_turns(frames)
+
+
+def build_response_provider(recorded_turns):
+    """Serves the recorded agent responses, matched by the last user utterance of the prompt."""
+    responses = defaultdict(deque)
+    for response_id in sorted(recorded_turns):
+        turn = recorded_turns[response_id]
+        if turn.completed_at is not None:
+            responses[get_last_user_utterance(turn.transcript)].append(turn.content)
+
+    def response_provider(body):
+        messages = body.get("messages", [])
+        for message in reversed(messages):
+            if message.get("role") != "user":
+                continue
+            pending_responses = responses.get(message.get("content") or "")
+            if pending_responses:
+                return pending_responses.popleft()
+        return openai_stub.settings.response
+
+    return response_provider
+
+
+async def replay(url, call_id, inbound_frames, speed=1.0, grace_period=10.0):
+    replayed_frames = []
+
+    async with websockets.connect("%s/%s" % (url.rstrip("/"), call_id), max_size=None) as websocket:
+        started_at = time.perf_counter()
+
+        # Frames are scheduled at the recorded offsets divided by speed, but timestamped in real
+        # seconds so the latencies can be compared with the recording.
+        def elapsed():
+            return time.perf_counter() - started_at
+
+        async def receive_frames():
+            async for message in websocket:
+                replayed_frames.append((elapsed(), OUTBOUND, json.loads(message)))
+
+        receiver = asyncio.create_task(receive_frames())
+        try:
+            for offset, frame in inbound_frames:
+                delay = offset / speed - elapsed()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                replayed_frames.append((elapsed(), INBOUND, frame))
+                await websocket.send(json.dumps(frame))
+
+            # Wait for the last response to complete
+            await asyncio.sleep(grace_period)
+        finally:
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+
+    return collect_turns(replayed_frames)
+
+
+def print_comparison(recorded_turns, replayed_turns):
+    def format_ms(value):
+        return "-" if value is None else "%.0f" % (value * 1000)
+
+    print("%-12s %14s %14s %14s %14s" % ("response_id", "rec. TTFT ms", "replay TTFT ms", "rec. total ms", "replay total ms"))
+    for response_id in sorted(recorded_turns):
+        recorded_turn = recorded_turns[response_id]
+        replayed_turn = replayed_turns.get(response_id)
+        print("%-12s %14s %14s %14s %14s" % (
+            response_id,
+            format_ms(recorded_turn.time_to_first_token),
+            format_ms(replayed_turn.time_to_first_token if replayed_turn else None),
+            format_ms(recorded_turn.duration),
+            format_ms(replayed_turn.duration if replayed_turn else None),
+        ))
+
+    for name, turns in (("recorded", recorded_turns), ("replayed", replayed_turns)):
+        ttfts = [turn.time_to_first_token for turn in turns.values() if turn.time_to_first_token is not None]
+        print("%s: TTFT p50 %s ms, p99 %s ms" % (name, format_ms(percentile(ttfts, 50)), format_ms(percentile(ttfts, 99))))
+
+
+async def start_stub(port, response_provider):
+    import uvicorn
+
+    openai_stub.settings.response_provider = response_provider
+    server = uvicorn.Server(uvicorn.Config(openai_stub.app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run_replay(args):
+    inbound_frames, recorded_turns = load_recording(args.recording)
+
+    stub = None
+    if args.stub_port:
+        openai_stub.settings.ttft = args.ttft_ms / 1000
+        openai_stub.settings.token_latency = args.token_ms / 1000
+        openai_stub.settings.jitter = 0
+        stub = await start_stub(args.stub_port, build_response_provider(recorded_turns))
+
+    try:
+        call_id = "replay-" + uuid.uuid4().hex
+        replayed_turns = await replay(args.url, call_id, inbound_frames, speed=args.speed, grace_period=args.grace_period)
+    finally:
+        if stub is not None:
+            server, task = stub
+            server.should_exit = True
+            await task
+
+    print_comparison(recorded_turns, replayed_turns)
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description="Replay a recorded call against the server")
+    parser.add_argument("recording", help="Call recording written by the server (CALL_RECORDING_DIR)")
+    parser.add_argument("--url", default="ws://localhost:8080/llm-websocket", help="Base url of the LLM websocket, the call_id is appended")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor")
+    parser.add_argument("--grace-period", type=float, default=10.0, help="Seconds to wait for the last response")
+    parser.add_argument("--stub-port", type=int, default=None, help="Serve the recorded LLM output from an OpenAI stub on this port")
+    parser.add_argument("--ttft-ms", type=float, default=300, help="Latency until the first token of the stub")
+    parser.add_argument("--token-ms", type=float, default=20, help="Latency between tokens of the stub")
+    return parser
+
+
+def main():
+    args = get_argument_parser().parse_args()
+    asyncio.run(run_replay(args))
+
+
+if __name__ == "__main__":
+    main()
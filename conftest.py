@@ -0,0 +1 @@
+# Makes the backend package importable from the tests
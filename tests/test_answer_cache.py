@@ -0,0 +1,25 @@
+from backend.answer_cache import AnswerCache
+
+
+def test_make_key_normalizes_the_question():
+    cache = AnswerCache("v1", max_size=2)
+    assert cache.make_key("Um, what are your opening hours?") == cache.make_key("what are your OPENING hours")
+    assert cache.make_key("yes that one") is None
+
+
+def test_questions_with_personal_details_are_not_cacheable():
+    cache = AnswerCache("v1", max_size=2)
+    assert cache.make_key("hi this is Maria, what are your prices") is None
+    assert cache.make_key("can you call me back at 0902392393") is None
+    assert cache.make_key("can you email maria@example.com the prices") is None
+
+
+def test_lru_eviction_and_config_version():
+    cache = AnswerCache("v1", max_size=2)
+    keys = [cache.make_key(question) for question in ["what are your opening hours", "where is the salon located", "how much is a haircut"]]
+    for key, answer in zip(keys, ["9 to 7", "SM Mega Mall", "300 pesos"]):
+        cache.put(key, answer)
+    assert len(cache) == 2
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == "300 pesos"
+    assert AnswerCache("v2", max_size=2).make_key("how much is a haircut") != keys[2]
@@ -0,0 +1,308 @@
+import time
+import asyncio
+import sqlite3
+import datetime
+
+from backend.appointments import AppointmentRepository, AppointmentBook
+from backend.availability import AvailabilityIndex
+from backend.scheduler import SalonScheduler
+
+
+def get_next_monday():
+    today = datetime.date.today()
+    return (today + datetime.timedelta(days=7 - today.weekday())).isoformat()
+
+
+def make_book(path, hold_ttl=300):
+    today = datetime.date.today()
+    return AppointmentBook(
+        AvailabilityIndex.from_opening_hours(today, 14),
+        AppointmentRepository(str(path)),
+        hold_ttl=hold_ttl,
+        scheduler=SalonScheduler(start_date=today, horizon_days=14),
+    )
+
+
+def test_reserve_is_atomic_across_repositories(tmp_path):
+    async def run():
+        repository_1 = AppointmentRepository(str(tmp_path / "appointments.db"))
+        repository_2 = AppointmentRepository(str(tmp_path / "appointments.db"))
+        date = get_next_monday()
+        appointment_id = await repository_1.reserve_service(date, "10:00", "John Doe", None, 60, "A", "1")
+        assert appointment_id is not None
+        assert await repository_2.reserve_service(date, "10:00", "John Doe", None, 60, "B", "2") is None
+
+        assert await repository_2.cancel(appointment_id)
+        assert not await repository_2.cancel(appointment_id)
+        assert (await repository_1.get(appointment_id)).status == "cancelled"
+        assert await repository_2.reserve_service(date, "10:00", "John Doe", None, 60, "B", "2") is not None
+        assert await repository_1.get_booked_services() == [(date, "10:00", "John Doe", 60)]
+        await repository_1.close()
+        await repository_2.close()
+
+    asyncio.run(run())
+
+
+def test_reserve_service_rejects_overlapping_windows(tmp_path):
+    async def run():
+        repository = AppointmentRepository(str(tmp_path / "appointments.db"))
+        date = get_next_monday()
+        assert await repository.reserve_service(date, "10:00", "John Doe", "coloring", 120, "A", "1") is not None
+        # 11:00-12:00 overlaps 10:00-12:00, 12:00 doesn't
+        assert await repository.reserve_service(date, "11:00", "John Doe", "treatment", 60, "B", "2") is None
+        assert await repository.reserve_service(date, "09:30", "John Doe", "treatment", 60, "B", "2") is None
+        assert await repository.reserve_service(date, "12:00", "John Doe", "treatment", 60, "B", "2") is not None
+        assert await repository.reserve_service(date, "11:00", "Jane Smith", "treatment", 60, "C", "3") is not None
+        await repository.close()
+
+    asyncio.run(run())
+
+
+def test_service_hold_blocks_other_owners_until_it_expires(tmp_path):
+    async def run():
+        repository = AppointmentRepository(str(tmp_path / "appointments.db"))
+        date = get_next_monday()
+        assert await repository.hold_service(date, "10:00", "John Doe", 120, "call-1", time.time() + 300)
+        assert not await repository.hold_service(date, "11:00", "John Doe", 60, "call-2", time.time() + 300)
+        assert await repository.reserve_service(date, "11:00", "John Doe", "treatment", 60, "B", "2", owner="call-2") is None
+        # The owner renews it and converts it
+        assert await repository.hold_service(date, "10:00", "John Doe", 120, "call-1", time.time() + 300)
+        assert await repository.reserve_service(date, "10:00", "John Doe", "coloring", 120, "A", "1", owner="call-1") is not None
+        assert not await repository.hold_service(date, "10:00", "John Doe", 120, "call-1", time.time() + 300)
+
+        assert await repository.hold_service(date, "14:00", "John Doe", 60, "call-1", time.time() - 1)
+        # Expired: ignored, then taken over
+        assert await repository.hold_service(date, "14:00", "John Doe", 60, "call-2", time.time() + 300)
+        await repository.close()
+
+    asyncio.run(run())
+
+
+def test_fixed_slots_are_booked_with_the_free_stylists(tmp_path):
+    async def run():
+        book = make_book(tmp_path / "appointments.db")
+        await book.load()
+        date = get_next_monday()
+
+        assert await book.book(date, "10:00", "A", "1") is not None
+        # Jane is still free at 10:00
+        assert "10:00" in book.get_slots(date)
+        assert await book.book(date, "10:00", "B", "2") is not None
+        assert "10:00" not in book.get_slots(date)
+        assert await book.book(date, "10:00", "C", "3") is None
+        assert sorted(stylist for _, _, stylist, _ in await book.repository.get_booked_services()) == ["Jane Smith", "John Doe"]
+        await book.close()
+
+    asyncio.run(run())
+
+
+def test_fixed_slot_and_service_cant_take_the_same_stylist(tmp_path):
+    async def run():
+        path = tmp_path / "appointments.db"
+        worker_1 = make_book(path)
+        worker_2 = make_book(path)
+        await worker_1.load()
+        await worker_2.load()
+        date = get_next_monday()
+
+        # John's coloring 10:00-12:00 and Jane's fixed slot at 10:00
+        assert (await worker_1.book_service("coloring", date, "10:00", "A", "1"))[1] == "John Doe"
+        assert await worker_1.book(date, "10:00", "B", "2") is not None
+        assert "10:00" not in worker_1.get_slots(date)
+        # Jane is free again at 11:00
+        assert "11:00" in worker_1.get_slots(date)
+        # Worker 2 doesn't know about them, the database rejects the overlap
+        assert "10:00" in worker_2.get_slots(date)
+        assert await worker_2.book(date, "10:00", "C", "3") is None
+        assert await worker_2.hold(date, "11:00", "call-2", stylist="John Doe") is False
+
+        # And the other way around: a fixed slot held with Jane blocks her services
+        assert await worker_1.hold(date, "14:00", "call-1", stylist="Jane Smith")
+        assert await worker_2.book_service("haircut", date, "14:30", "D", "4", stylist="Jane Smith") is None
+        await worker_1.close()
+        await worker_2.close()
+
+    asyncio.run(run())
+
+
+def test_two_workers_cannot_double_book_a_stylist(tmp_path):
+    async def run():
+        path = tmp_path / "appointments.db"
+        worker_1 = make_book(path)
+        worker_2 = make_book(path)
+        await worker_1.load()
+        await worker_2.load()
+        date = get_next_monday()
+
+        assert await worker_1.book_service("coloring", date, "10:00", "A", "1") is not None
+        # Worker 2 doesn't know about the coloring, the database rejects the overlap
+        assert worker_2.scheduler.is_free("John Doe", date, "11:00", 60)
+        assert await worker_2.book_service("treatment", date, "11:00", "B", "2", stylist="John Doe") is None
+        # Jane offers treatments too
+        appointment_id, stylist = await worker_2.book_service("treatment", date, "11:00", "B", "2")
+        assert stylist == "Jane Smith"
+
+        assert len(await worker_1.repository.get_booked_services()) == 2
+        await worker_1.close()
+        await worker_2.close()
+
+    asyncio.run(run())
+
+
+def test_hold_is_converted_by_its_owner(tmp_path):
+    async def run():
+        path = tmp_path / "appointments.db"
+        worker_1 = make_book(path)
+        worker_2 = make_book(path)
+        await worker_1.load()
+        await worker_2.load()
+        date = get_next_monday()
+
+        assert await worker_1.hold_service("coloring", date, "10:00", "call-1") == "John Doe"
+        assert worker_1.get_hold_owner(date, "10:00", "John Doe") == "call-1"
+        assert await worker_2.hold_service("treatment", date, "11:00", "call-2", stylist="John Doe") is None
+        assert await worker_2.book_service("coloring", date, "10:00", "B", "2", owner="call-2") is None
+
+        appointment_id, stylist = await worker_1.book_service("coloring", date, "10:00", "A", "1", owner="call-1")
+        assert stylist == "John Doe"
+        assert worker_1.get_hold_owner(date, "10:00", "John Doe") is None
+        assert not worker_1.scheduler.is_free("John Doe", date, "10:00", 120)
+
+        assert await worker_1.cancel(appointment_id)
+        assert worker_1.scheduler.is_free("John Doe", date, "10:00", 120)
+        await worker_1.close()
+        await worker_2.close()
+
+    asyncio.run(run())
+
+
+def test_fixed_slot_hold_is_renewed_with_the_same_stylist(tmp_path):
+    async def run():
+        book = make_book(tmp_path / "appointments.db")
+        await book.load()
+        date = get_next_monday()
+
+        assert await book.hold(date, "10:00", "call-1", stylist="Jane Smith")
+        assert await book.hold(date, "10:00", "call-1")
+        assert book.get_hold_owner(date, "10:00", "John Doe") is None
+        assert "10:00" in book.get_slots(date)
+        assert "10:00" in book.get_slots(date, owner="call-1")
+
+        assert await book.book(date, "10:00", "A", "1", owner="call-1") is not None
+        assert book.get_hold_owner(date, "10:00", "Jane Smith") is None
+        assert book.scheduler.is_free("John Doe", date, "10:00", 60)
+        assert not book.scheduler.is_free("Jane Smith", date, "10:00", 60)
+        await book.close()
+
+    asyncio.run(run())
+
+
+def test_reaper_frees_expired_holds(tmp_path):
+    async def run():
+        book = make_book(tmp_path / "appointments.db", hold_ttl=0.05)
+        await book.load()
+        book.start()
+        date = get_next_monday()
+
+        assert await book.hold_service("coloring", date, "13:00", "call-1") == "John Doe"
+        assert await book.hold(date, "13:00", "call-2")
+        assert "13:00" not in book.get_slots(date)
+        assert "13:00" in book.get_slots(date, owner="call-2")
+        assert not book.scheduler.is_free("John Doe", date, "13:00", 120)
+
+        await asyncio.sleep(0.2)
+        assert book.get_hold_owner(date, "13:00", "John Doe") is None
+        assert book.get_hold_owner(date, "13:00", "Jane Smith") is None
+        assert "13:00" in book.get_slots(date)
+        assert book.scheduler.is_free("John Doe", date, "13:00", 120)
+        await book.close()
+
+    asyncio.run(run())
+
+
+def test_renewed_hold_outlives_its_first_expiration(tmp_path):
+    async def run():
+        book = make_book(tmp_path / "appointments.db", hold_ttl=0.1)
+        await book.load()
+        book.start()
+        date = get_next_monday()
+
+        assert await book.hold(date, "10:00", "call-1")
+        await asyncio.sleep(0.06)
+        assert await book.hold(date, "10:00", "call-1")
+        await asyncio.sleep(0.06)
+        assert book.get_hold_owner(date, "10:00", "John Doe") == "call-1"
+        await asyncio.sleep(0.1)
+        assert book.get_hold_owner(date, "10:00", "John Doe") is None
+        await book.close()
+
+    asyncio.run(run())
+
+
+def test_release_holds_of_an_owner(tmp_path):
+    async def run():
+        book = make_book(tmp_path / "appointments.db")
+        await book.load()
+        date = get_next_monday()
+
+        assert await book.hold(date, "10:00", "call-1", stylist="John Doe")
+        assert await book.hold_service("haircut", date, "15:00", "call-1") == "Jane Smith"
+        await book.release_holds("call-1")
+        assert "10:00" in book.get_slots(date)
+        assert book.scheduler.is_free("Jane Smith", date, "15:00", 45)
+        assert await book.hold_service("haircut", date, "15:00", "call-2") == "Jane Smith"
+        await book.close()
+
+    asyncio.run(run())
+
+
+def test_migrates_a_database_created_before_the_stylists(tmp_path):
+    path = tmp_path / "appointments.db"
+    date = get_next_monday()
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE appointments (id INTEGER PRIMARY KEY, date TEXT NOT NULL, start_time TEXT NOT NULL, name TEXT NOT NULL, "
+        "phone TEXT NOT NULL, email TEXT, status TEXT NOT NULL, created_at REAL NOT NULL)"
+    )
+    connection.execute("CREATE TABLE slot_holds (date TEXT NOT NULL, start_time TEXT NOT NULL, owner TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (date, start_time))")
+    connection.execute("INSERT INTO appointments (date, start_time, name, phone, status, created_at) VALUES (?, '10:00', 'A', '1', 'booked', 0)", (date,))
+    connection.commit()
+    connection.close()
+
+    async def run():
+        book = make_book(path)
+        assert await book.repository.get_unassigned_slots() == [(1, date, "10:00")]
+        await book.load()
+        # The fixed slot booked before the stylists is assigned to the first free stylist
+        assert await book.repository.get_unassigned_slots() == []
+        assert (await book.repository.get(1)).stylist == "John Doe"
+        assert not book.scheduler.is_free("John Doe", date, "10:00", 60)
+        assert await book.repository.reserve_service(date, "10:30", "John Doe", "treatment", 60, "B", "2") is None
+        assert await book.repository.hold_service(date, "14:00", "John Doe", 60, "call-1", time.time() + 300)
+        await book.close()
+
+    asyncio.run(run())
+
+
+def test_holds_released_by_another_worker_are_freed(tmp_path):
+    async def run():
+        path = tmp_path / "appointments.db"
+        worker_1 = make_book(path)
+        worker_2 = make_book(path)
+        await worker_1.load()
+        await worker_2.load()
+        date = get_next_monday()
+
+        assert await worker_1.hold_service("coloring", date, "10:00", "call-1") == "John Doe"
+        assert await worker_1.hold_service("highlights", date, "10:00", "call-2") is None
+        # The call_ended webhook of call-1 reaches worker 2
+        await worker_2.release_holds("call-1")
+        assert worker_1.get_hold_owner(date, "10:00", "John Doe") == "call-1"
+
+        assert await worker_1.hold_service("highlights", date, "10:00", "call-2") == "John Doe"
+        assert worker_1.get_hold_owner(date, "10:00", "John Doe") == "call-2"
+        assert "call-1" not in worker_1._owner_holds
+        await worker_1.close()
+        await worker_2.close()
+
+    asyncio.run(run())
@@ -0,0 +1,107 @@
+import datetime
+
+import numpy as np
+
+from backend.availability import AvailabilityIndex
+from backend.availability_snapshot import AvailabilitySnapshot
+from backend.scheduler import SalonScheduler
+
+
+def get_next_weekday(weekday):
+    """Date of the weekday in the week after the current one, so the days of a test are in order."""
+    today = datetime.date.today()
+    return (today + datetime.timedelta(days=7 - today.weekday() + weekday)).isoformat()
+
+
+def make_snapshot(days=14):
+    today = datetime.date.today()
+    availability = AvailabilityIndex.from_opening_hours(today, days)
+    scheduler = SalonScheduler(start_date=today, horizon_days=days)
+    snapshot = AvailabilitySnapshot(availability, scheduler, summary_days=7)
+    snapshot.rebuild()
+    return snapshot
+
+
+def test_matches_the_scheduler_and_the_index():
+    snapshot = make_snapshot()
+    monday = get_next_weekday(0)
+    assert snapshot.get_slots(monday) == snapshot.availability.get_slots(monday)
+    for service in snapshot.scheduler.services:
+        assert snapshot.find_slots(service, monday) == snapshot.scheduler.find_slots(service, monday)
+        assert snapshot.find_earliest_slot(service, monday) == snapshot.scheduler.find_earliest_slot(service, monday)
+
+
+def test_update_after_a_booking_changes_only_its_date():
+    snapshot = make_snapshot()
+    monday, tuesday = get_next_weekday(0), get_next_weekday(1)
+    tuesday_summary = snapshot.get_day_summary(tuesday)
+    version = snapshot.version
+
+    snapshot.scheduler.book("John Doe", monday, "09:00", 120)
+    # Not updated yet
+    assert snapshot.find_earliest_slot("coloring", monday) == (monday, "09:00", "John Doe")
+    snapshot.update(monday)
+
+    assert snapshot.version == version + 1
+    assert snapshot.find_earliest_slot("coloring", monday) == (monday, "11:00", "John Doe")
+    # Jane is free at 09:00
+    assert "09:00" in snapshot.get_slots(monday)
+    snapshot.scheduler.book("Jane Smith", monday, "09:00", 60)
+    snapshot.update(monday)
+    assert "09:00" not in snapshot.get_slots(monday)
+    assert snapshot.get_slots(monday) == snapshot.availability.get_slots(monday)
+    assert snapshot.find_slots("coloring", monday, stylist="John Doe")[0][0] == "11:00"
+    assert snapshot.get_day_summary(tuesday) == tuesday_summary
+
+    windows, _ = snapshot.scheduler.get_windows("coloring", 0, snapshot.scheduler.horizon_days)
+    assert np.array_equal(snapshot._windows["coloring"], windows)
+
+
+def test_next_free_slot_skips_the_booked_days():
+    snapshot = make_snapshot()
+    monday, tuesday = get_next_weekday(0), get_next_weekday(1)
+    assert snapshot.get_next_free_slot(monday) == (monday, "09:00")
+    assert snapshot.get_next_free_slot(monday, "18:30") == (tuesday, "09:00")
+
+    for stylist in snapshot.scheduler.stylists:
+        snapshot.scheduler.book(stylist, tuesday, "09:00", 600)
+    snapshot.update(tuesday)
+    assert snapshot.get_slots(tuesday) == []
+    assert snapshot.get_next_free_slot(monday, "18:30") == (get_next_weekday(2), "09:00")
+
+    snapshot.scheduler.release("Jane Smith", tuesday, "12:00", 60)
+    snapshot.update(tuesday)
+    assert snapshot.get_next_free_slot(monday, "18:30") == (tuesday, "12:00")
+
+
+def test_day_summaries():
+    snapshot = make_snapshot()
+    monday, saturday, sunday = get_next_weekday(0), get_next_weekday(5), get_next_weekday(6)
+    assert snapshot.get_day_summary(sunday).endswith(": closed")
+    # 09:00 to 17:00 on Saturdays, 60 minutes slots
+    assert snapshot.get_day_summary(saturday).endswith("appointment slots left: 3 in the morning, 5 in the afternoon")
+    assert snapshot.get_day_summary(monday).endswith("appointment slots left: 3 in the morning, 5 in the afternoon, 2 in the evening")
+
+    # Jane can still take the fixed slots
+    snapshot.scheduler.book("John Doe", monday, "09:00", 600)
+    snapshot.update(monday)
+    assert snapshot.get_day_summary(monday).endswith(
+        "appointment slots left: 3 in the morning, 5 in the afternoon, 2 in the evening; no time left for coloring, highlights"
+    )
+
+    snapshot.scheduler.book("Jane Smith", monday, "09:00", 180)
+    snapshot.update(monday)
+    assert snapshot.get_day_summary(monday).endswith("appointment slots left: 5 in the afternoon, 2 in the evening; no time left for coloring, highlights")
+
+    snapshot.scheduler.book("Jane Smith", monday, "12:00", 420)
+    snapshot.update(monday)
+    assert snapshot.get_slots(monday) == []
+    assert snapshot.get_day_summary(monday).endswith(": fully booked")
+
+
+def test_summary_lists_the_next_days():
+    snapshot = make_snapshot()
+    lines = snapshot.get_summary().split("\n")
+    assert len(lines) == 8
+    assert lines[0].startswith(datetime.date.today().strftime("%A"))
+    assert lines[1].split(": ")[0].endswith((datetime.date.today() + datetime.timedelta(days=1)).isoformat())
@@ -0,0 +1,12 @@
+from backend.metrics import ResponseMetrics, PROMPT_TOKENS, COMPLETION_TOKENS
+from backend.usage import TokenUsage
+
+
+def test_usage_is_counted_under_the_model_of_its_round():
+    metrics = ResponseMetrics(1, model="test-fast")
+    metrics.on_usage(TokenUsage(prompt_tokens=100, completion_tokens=5))
+    metrics.on_usage(TokenUsage(prompt_tokens=300, completion_tokens=20), "test-smart")
+
+    assert PROMPT_TOKENS.get(model="test-fast") == 100
+    assert PROMPT_TOKENS.get(model="test-smart") == 300
+    assert COMPLETION_TOKENS.get(model="test-smart") == 20
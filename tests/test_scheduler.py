@@ -0,0 +1,90 @@
+import datetime
+
+from backend.scheduler import SalonScheduler
+
+
+# Saturday
+START_DATE = datetime.date(2024, 12, 21)
+
+
+def make_scheduler(**kwargs):
+    return SalonScheduler(start_date=START_DATE, **kwargs)
+
+
+def test_earliest_slot_respects_opening_hours_and_specialties():
+    scheduler = make_scheduler()
+    assert scheduler.find_earliest_slot("coloring") == ("2024-12-21", "09:00", "John Doe")
+    assert scheduler.find_earliest_slot("haircut") == ("2024-12-21", "09:00", "Jane Smith")
+    # Saturday closes at 17:00 and Sunday is closed: a 120 minutes coloring at 15:30 goes to Monday
+    assert scheduler.find_earliest_slot("coloring", "2024-12-21", "15:30") == ("2024-12-23", "09:00", "John Doe")
+    assert scheduler.find_slots("haircut", "2024-12-22") == []
+
+
+def test_service_fits_until_closing():
+    scheduler = make_scheduler()
+    times = [time_string for time_string, _ in scheduler.find_slots("coloring", "2024-12-21")]
+    assert times[0] == "09:00"
+    assert times[-1] == "15:00"
+
+
+def test_book_takes_the_window_of_the_stylist_only():
+    scheduler = make_scheduler()
+    assert scheduler.book("John Doe", "2024-12-23", "09:00", 120)
+    assert not scheduler.book("John Doe", "2024-12-23", "10:00", 60)
+    assert scheduler.find_earliest_slot("coloring", "2024-12-23") == ("2024-12-23", "11:00", "John Doe")
+    # Jane isn't affected
+    assert dict(scheduler.find_slots("treatment", "2024-12-23"))["09:00"] == ["Jane Smith"]
+
+
+def test_release_frees_the_window_but_not_the_closed_hours():
+    scheduler = make_scheduler()
+    scheduler.book("John Doe", "2024-12-23", "09:00", 120)
+    scheduler.release("John Doe", "2024-12-23", "08:00", 240)
+    assert scheduler.is_free("John Doe", "2024-12-23", "09:00", 120)
+    assert not scheduler.is_free("John Doe", "2024-12-23", "08:00", 60)
+
+
+def test_unknown_stylist_filter():
+    scheduler = make_scheduler()
+    assert scheduler.find_earliest_slot("haircut", stylist="John Doe") is None
+    assert scheduler.find_earliest_slot("treatment", stylist="Jane Smith") == ("2024-12-21", "09:00", "Jane Smith")
+
+
+def test_outside_the_horizon():
+    scheduler = make_scheduler(horizon_days=3)
+    assert scheduler.find_slots("haircut", "2024-12-24") == []
+    assert scheduler.find_earliest_slot("haircut", "2024-12-30") is None
+    assert not scheduler.book("Jane Smith", "2024-12-24", "09:00", 45)
+
+
+def test_advance_to_keeps_the_bookings_and_opens_the_new_days():
+    scheduler = make_scheduler(horizon_days=5)
+    scheduler.book("John Doe", "2024-12-23", "09:00", 120)
+    scheduler.advance_to(datetime.date(2024, 12, 23))
+
+    assert scheduler.get_day("2024-12-23") == 0
+    assert not scheduler.is_free("John Doe", "2024-12-23", "09:00", 120)
+    # The last day of the horizon is new and open
+    assert scheduler.is_free("John Doe", "2024-12-27", "09:00", 120)
+    assert scheduler.find_earliest_slot("coloring") == ("2024-12-23", "11:00", "John Doe")
+
+
+def test_advance_past_the_horizon_reopens_every_day():
+    scheduler = make_scheduler(horizon_days=3)
+    scheduler.book("John Doe", "2024-12-23", "09:00", 120)
+    scheduler.advance_to(datetime.date(2025, 1, 6))
+    assert scheduler.find_earliest_slot("coloring") == ("2025-01-06", "09:00", "John Doe")
+
+
+def test_windows_match_a_brute_force_search():
+    scheduler = make_scheduler(horizon_days=3)
+    scheduler.book("Jane Smith", "2024-12-23", "10:00", 45)
+    scheduler.book("Jane Smith", "2024-12-23", "12:30", 60)
+
+    expected = []
+    for minute in range(0, 24 * 60, scheduler.slot_minutes):
+        time_string = "%02d:%02d" % divmod(minute, 60)
+        if scheduler.is_free("Jane Smith", "2024-12-23", time_string, 180):
+            expected.append(time_string)
+    assert [time_string for time_string, _ in scheduler.find_slots("extensions", "2024-12-23")] == expected
+    assert expected[0] == "13:30"
@@ -0,0 +1,72 @@
+import time
+import asyncio
+import sqlite3
+
+import pytest
+
+from backend.session_store import CallSession, InMemorySessionStore, SQLiteSessionStore
+
+
+def make_stores(tmp_path, **kwargs):
+    return [InMemorySessionStore(**kwargs), SQLiteSessionStore(str(tmp_path / "sessions.db"), **kwargs)]
+
+
+@pytest.mark.parametrize("store_index", [0, 1])
+def test_deleted_session_is_not_saved_again(tmp_path, store_index):
+    async def run():
+        store = make_stores(tmp_path)[store_index]
+        session, is_new_session = await store.get_or_create("call-1")
+        assert is_new_session
+        session.response_id = 3
+        await store.save(session)
+        assert (await store.get("call-1")).response_id == 3
+
+        await store.delete("call-1")
+        # e.g. the websocket closing after the call_ended webhook
+        await store.save(session)
+        assert await store.get("call-1") is None
+        await store.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("store_index", [0, 1])
+def test_purge_removes_the_expired_sessions_and_tombstones(tmp_path, store_index):
+    async def run():
+        store = make_stores(tmp_path, ttl=0.05, purge_interval=0.02)[store_index]
+        store.start()
+        await store.save(CallSession(call_id="call-1"))
+        await store.delete("call-2")
+        await asyncio.sleep(0.2)
+
+        await store.save(CallSession(call_id="call-3"))
+        await store.purge_expired()
+        if isinstance(store, InMemorySessionStore):
+            assert list(store._sessions) == ["call-3"]
+        else:
+            call_ids = [row[0] for row in store._connect().execute("SELECT call_id FROM call_sessions")]
+            assert call_ids == ["call-3"]
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_migrates_a_database_created_before_the_tombstones(tmp_path):
+    path = tmp_path / "sessions.db"
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE call_sessions (call_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)")
+    connection.execute(
+        "INSERT INTO call_sessions VALUES ('call-1', ?, ?)",
+        ('{"call_id": "call-1", "response_id": 2, "data": {}, "created_at": 0, "updated_at": 0}', time.time()),
+    )
+    connection.commit()
+    connection.close()
+
+    async def run():
+        store = SQLiteSessionStore(str(path))
+        assert (await store.get("call-1")).response_id == 2
+        await store.delete("call-1")
+        assert await store.get("call-1") is None
+        await store.close()
+
+    asyncio.run(run())